@@ -6,6 +6,9 @@ class DassConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.assessments.dass'
 
+    def ready(self):
+        from . import receivers  # noqa: F401
+
     # def ready(self):
     #     from .models import Question
     #     try:
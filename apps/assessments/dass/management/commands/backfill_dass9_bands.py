@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.assessments.dass.services import Dass9Service
+
+
+class Command(BaseCommand):
+    help = "Заполняет степени выраженности (bands) у результатов DASS-9, сохранённых до их появления"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Размер пачки обновления")
+        parser.add_argument("--pause", type=float, default=0.0, help="Пауза между пачками, сек")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = Dass9Service.backfill_severity_bands(batch_size=options["batch_size"], pause=options["pause"])
+        self.stdout.write(
+            f"updated={stats['updated']} batches={stats['batches']} seconds={time.monotonic() - started:.3f}"
+        )
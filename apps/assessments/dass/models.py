@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.lookups import GreaterThanOrEqual
 from django.conf import settings
 
 class Question(models.Model):
@@ -19,6 +20,17 @@ class Question(models.Model):
 
 
 class Dass9Result(models.Model):
+    class SeverityBand(models.IntegerChoices):
+        NORMAL = 0, "Норма"
+        MILD = 1, "Лёгкая"
+        MODERATE = 2, "Умеренная"
+        SEVERE = 3, "Тяжёлая"
+
+    # нижние границы баллов подшкалы (0..9) для MILD, MODERATE, SEVERE
+    SEVERITY_THRESHOLDS = (3, 5, 7)
+    # с этой степени сотрудник считается в группе риска (и попадает в частичный индекс)
+    AT_RISK_BAND = SeverityBand.MODERATE
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -26,14 +38,87 @@ class Dass9Result(models.Model):
         verbose_name="Сотрудник"
     )
     date = models.DateField(auto_now_add=True, verbose_name="Дата прохождения")
+    # связь по дате без столбца: аналитика берёт ключи периодов JOIN'ом календаря
+    calendar_day = models.ForeignObject(
+        "dass_analytics.CalendarDay", on_delete=models.DO_NOTHING, from_fields=["date"], to_fields=["date"],
+        related_name="+",
+    )
     depression_score = models.PositiveIntegerField(verbose_name="Баллы по депрессии")
     stress_score = models.PositiveIntegerField(verbose_name="Баллы по стрессу")
     anxiety_score = models.PositiveIntegerField(verbose_name="Баллы по тревожности")
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        verbose_name="Ключ идемпотентности клиента"
+    )
+    # степени выраженности считаются при записи; null — ещё не заполнены (см. backfill_dass9_bands)
+    depression_band = models.PositiveSmallIntegerField(
+        choices=SeverityBand.choices, null=True, blank=True, verbose_name="Степень депрессии"
+    )
+    stress_band = models.PositiveSmallIntegerField(
+        choices=SeverityBand.choices, null=True, blank=True, verbose_name="Степень стресса"
+    )
+    anxiety_band = models.PositiveSmallIntegerField(
+        choices=SeverityBand.choices, null=True, blank=True, verbose_name="Степень тревожности"
+    )
+    max_band = models.PositiveSmallIntegerField(
+        choices=SeverityBand.choices, null=True, blank=True, verbose_name="Наибольшая степень"
+    )
 
     class Meta:
         unique_together = ("user", "date")  # один тест в день
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "idempotency_key"],
+                condition=models.Q(idempotency_key__isnull=False),
+                name="dass9result_user_idempotency_key_uniq",
+            ),
+        ]
+        indexes = [
+            # выборка группы риска (max_band >= MODERATE) за окно дат читает только этот небольшой индекс
+            models.Index(
+                fields=["date", "user"],
+                include=["max_band", "depression_band", "stress_band", "anxiety_band"],
+                condition=models.Q(max_band__gte=2),
+                name="dass9result_at_risk_idx",
+            ),
+        ]
         verbose_name = "Результат DASS-9"
         verbose_name_plural = "Результаты DASS-9"
 
+    @classmethod
+    def severity_band(cls, score: int) -> int:
+        return sum(1 for threshold in cls.SEVERITY_THRESHOLDS if score >= threshold)
+
+    @classmethod
+    def severity_bands(cls, depression: int, stress: int, anxiety: int) -> dict:
+        bands = {
+            "depression_band": cls.severity_band(depression),
+            "stress_band": cls.severity_band(stress),
+            "anxiety_band": cls.severity_band(anxiety),
+        }
+        bands["max_band"] = max(bands.values())
+        return bands
+
+    @classmethod
+    def severity_band_expression(cls, score):
+        """
+        SQL-выражение степени для выражения с баллами (для массового пересчёта в БД).
+        """
+        return models.Case(
+            *(
+                models.When(GreaterThanOrEqual(score, threshold), then=models.Value(band))
+                for band, threshold in reversed(list(enumerate(cls.SEVERITY_THRESHOLDS, start=1)))
+            ),
+            default=models.Value(cls.SeverityBand.NORMAL),
+            output_field=models.PositiveSmallIntegerField(),
+        )
+
+    def save(self, *args, **kwargs):
+        for field, value in self.severity_bands(self.depression_score, self.stress_score, self.anxiety_score).items():
+            setattr(self, field, value)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.username} - {self.date} ({self.total_score} баллов)"
@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Dass9Result, Question
+from .services import Dass9Service, question_bank
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_bank(sender, **kwargs):
+    # после коммита: иначе параллельная перезагрузка закэширует банк вопросов до изменения
+    transaction.on_commit(question_bank.invalidate)
+
+
+@receiver(post_save, sender=Dass9Result)
+def send_results_created_on_orm_insert(sender, instance, created, raw=False, **kwargs):
+    # сервис вставляет результаты SQL-запросом и шлёт results_created сам (post_save при этом не приходит);
+    # вставка через ORM (create/save/админка) идёт тем же путём, чтобы производные данные не отставали
+    if created and not raw:
+        Dass9Service._send_results_created(instance.user_id, [{
+            "date": instance.date,
+            "depression_score": instance.depression_score,
+            "stress_score": instance.stress_score,
+            "anxiety_score": instance.anxiety_score,
+        }])
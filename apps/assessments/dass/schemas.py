@@ -1,12 +1,16 @@
-from typing import Dict
+from typing import Annotated, Dict, List, Optional, Literal
 
 from ninja import Schema
+from pydantic import Field
 from datetime import date
 
+# балл подшкалы DASS-9: три вопроса по 0..3
+Dass9Score = Annotated[int, Field(ge=0, le=9)]
+
 class Dass9Input(Schema):
-    depression: int
-    stress: int
-    anxiety: int
+    depression: Dass9Score
+    stress: Dass9Score
+    anxiety: Dass9Score
 
 class Dass9Output(Schema):
     date: date
@@ -18,4 +22,19 @@ class QuestionOutput(Schema):
     id: int
     text: str
     type: str
-    answers: Dict[int, str]
\ No newline at end of file
+    answers: Dict[int, str]
+
+class Dass9BatchItemIn(Schema):
+    date: date
+    depression: Dass9Score
+    stress: Dass9Score
+    anxiety: Dass9Score
+    idempotency_key: Optional[str] = Field(None, max_length=64)
+
+class Dass9BatchIn(Schema):
+    items: List[Dass9BatchItemIn]
+
+class Dass9BatchItemOut(Schema):
+    date: date
+    status: Literal["created", "exists", "duplicate", "invalid"]
+    message: Optional[str] = None
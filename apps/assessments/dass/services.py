@@ -1,8 +1,15 @@
+import hashlib
+import threading
+import time
 from datetime import date
-from typing import Optional, List
+from typing import Optional, List, Dict
 
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, Max, F
+from django.db.models.functions import Greatest
 from .models import Dass9Result, Question
+from .signals import results_created
 import random
 
 from ...auth_user.models import User
@@ -17,51 +24,301 @@ class Dass9Service:
         3: "Почти всё время",
     }
 
+    # поля, которые пишутся напрямую SQL-вставкой, и поля, возвращаемые из RETURNING
+    INSERT_FIELDS = (
+        "user", "date", "depression_score", "stress_score", "anxiety_score", "idempotency_key",
+        "depression_band", "stress_band", "anxiety_band", "max_band",
+    )
+    RETURNING_FIELDS = ("id", "date", "depression_score", "stress_score", "anxiety_score")
+
+    MAX_SCORE = 9
+
+    @staticmethod
+    def _result_columns(*fields: str) -> str:
+        return ", ".join(
+            connection.ops.quote_name(Dass9Result._meta.get_field(f).column) for f in fields
+        )
+
     @staticmethod
-    def save_result(userInfo, depression: int, stress: int, anxiety: int):
-        user = User.objects.get(id=userInfo["user_id"])
+    def _insert_sql(n_rows: int) -> str:
+        """
+        INSERT на n_rows строк, пропускающий конфликты по уникальным ограничениям.
+        """
+        table = connection.ops.quote_name(Dass9Result._meta.db_table)
+        placeholders = "(" + ", ".join(["%s"] * len(Dass9Service.INSERT_FIELDS)) + ")"
+        return (
+            f"INSERT INTO {table} ({Dass9Service._result_columns(*Dass9Service.INSERT_FIELDS)}) "
+            f"VALUES {', '.join([placeholders] * n_rows)} "
+            f"ON CONFLICT DO NOTHING RETURNING {Dass9Service._result_columns(*Dass9Service.RETURNING_FIELDS)}"
+        )
+
+    @staticmethod
+    def save_result(userInfo, depression: int, stress: int, anxiety: int,
+                    idempotency_key: Optional[str] = None) -> Optional[Dass9Result]:
+        """
+        Сохраняет результат за сегодня одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+        Если результат за сегодня уже есть — возвращает None.
+        Если передан idempotency_key и запись с этим ключом уже сохранена —
+        возвращает её (повторная отправка того же запроса).
+        """
+        user_id = User._meta.pk.to_python(userInfo["user_id"])
+        db_user_id = Dass9Result._meta.get_field("user").get_db_prep_value(user_id, connection)
         today = date.today()
 
-        existing = Dass9Result.objects.filter(user=user, date=today).first()
-        if existing:
+        table = connection.ops.quote_name(Dass9Result._meta.db_table)
+        returning_fields = Dass9Service.RETURNING_FIELDS
+        returning = Dass9Service._result_columns(*returning_fields)
+        user_column = Dass9Service._result_columns("user")
+        key_column = Dass9Service._result_columns("idempotency_key")
+
+        insert_sql = Dass9Service._insert_sql(1)
+        params = [db_user_id, today, depression, stress, anxiety, idempotency_key,
+                  *Dass9Result.severity_bands(depression, stress, anxiety).values()]
+
+        if idempotency_key:
+            # в том же запросе отдаём ранее сохранённую запись с этим ключом
+            sql = (
+                f"WITH inserted AS ({insert_sql}) "
+                f"SELECT *, TRUE FROM inserted "
+                f"UNION ALL "
+                f"SELECT {returning}, FALSE FROM {table} "
+                f"WHERE {user_column} = %s AND {key_column} = %s "
+                f"AND NOT EXISTS (SELECT 1 FROM inserted)"
+            )
+            params += [db_user_id, idempotency_key]
+        else:
+            sql = insert_sql
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+
+            if row is not None and (not idempotency_key or row[-1]):
+                values = dict(zip(returning_fields, row))
+                Dass9Service._send_results_created(user_id, [values])
+
+        if row is None and idempotency_key:
+            # параллельный запрос с тем же ключом закоммитился после снимка нашего запроса
+            row = (
+                Dass9Result.objects.filter(user_id=user_id, idempotency_key=idempotency_key)
+                .values_list(*returning_fields)
+                .first()
+            )
+        if row is None:
             return None
 
-        result = Dass9Result.objects.create(
-            user=user,
-            date=today,
-            depression_score=depression,
-            stress_score=stress,
-            anxiety_score=anxiety,
+        values = dict(zip(returning_fields, row))
+        return Dass9Result(user_id=user_id, idempotency_key=idempotency_key, **values)
+
+    @staticmethod
+    def _send_results_created(user_id, rows: List[Dict]) -> None:
+        results_created.send(
+            sender=Dass9Result,
+            results=[
+                {
+                    "user_id": user_id,
+                    "date": r["date"],
+                    "depression_score": r["depression_score"],
+                    "stress_score": r["stress_score"],
+                    "anxiety_score": r["anxiety_score"],
+                }
+                for r in rows
+            ],
         )
-        return result
 
     @staticmethod
-    def get_random_questions():
+    def save_results_batch(user_id, items: List[Dict]) -> List[Dict]:
         """
-        Возвращает 9 вопросов: по 3 из каждой категории
+        Сохраняет пачку результатов, собранных офлайн (с датами клиента).
+
+        Правило «один тест в день» проверяется одним запросом по всем датам пачки,
+        вставка — одним многострочным INSERT ... ON CONFLICT DO NOTHING в транзакции.
+        Возвращает статус по каждому элементу в исходном порядке:
+        created / exists / duplicate / invalid.
         """
-        result = {}
-        questions = []
+        user_id = User._meta.pk.to_python(user_id)
+        db_user_id = Dass9Result._meta.get_field("user").get_db_prep_value(user_id, connection)
+        today = date.today()
+        max_age = getattr(settings, "DASS9_BATCH_MAX_AGE_DAYS", 365)
 
-        for q_type in Question.QuestionType:
-            qs = list(Question.objects.filter(type=q_type))
-            selected = random.sample(qs, min(3, len(qs)))
-            questions.extend(selected)
-            result[q_type.label] = [q.text for q in selected]
+        statuses: List[Dict] = []
+        pending: Dict[date, Dict] = {}
 
-        return questions
+        for item in items:
+            status = {"date": item["date"], "status": "invalid", "message": None}
+            statuses.append(status)
+
+            scores = (item["depression"], item["stress"], item["anxiety"])
+            if item["date"] > today:
+                status["message"] = "Дата в будущем"
+            elif (today - item["date"]).days > max_age:
+                status["message"] = "Слишком старая дата"
+            elif any(score < 0 or score > Dass9Service.MAX_SCORE for score in scores):
+                status["message"] = f"Баллы должны быть в диапазоне 0..{Dass9Service.MAX_SCORE}"
+            elif item["date"] in pending:
+                status["status"] = "duplicate"
+                status["message"] = "Несколько результатов за один день в пачке"
+            else:
+                pending[item["date"]] = {"status": status, "item": item}
+
+        if not pending:
+            return statuses
+
+        with transaction.atomic():
+            existing = set(
+                Dass9Result.objects.filter(user_id=user_id, date__in=list(pending))
+                .values_list("date", flat=True)
+            )
+            to_insert = [p for d, p in pending.items() if d not in existing]
+            for d in existing:
+                pending[d]["status"]["status"] = "exists"
+                pending[d]["status"]["message"] = "Тест за этот день уже пройден"
+
+            params = []
+            for p in to_insert:
+                item = p["item"]
+                params += [db_user_id, item["date"], item["depression"], item["stress"], item["anxiety"],
+                           item.get("idempotency_key"),
+                           *Dass9Result.severity_bands(item["depression"], item["stress"], item["anxiety"]).values()]
+
+            created = {}
+            if to_insert:
+                with connection.cursor() as cursor:
+                    cursor.execute(Dass9Service._insert_sql(len(to_insert)), params)
+                    for row in cursor.fetchall():
+                        values = dict(zip(Dass9Service.RETURNING_FIELDS, row))
+                        created[values["date"]] = values
+                if created:
+                    Dass9Service._send_results_created(user_id, list(created.values()))
+
+        for p in to_insert:
+            status = p["status"]
+            if status["date"] in created:
+                status["status"] = "created"
+            else:
+                # запись появилась параллельно между проверкой и вставкой
+                status["status"] = "exists"
+                status["message"] = "Тест за этот день уже пройден"
+
+        return statuses
+
+    @staticmethod
+    def backfill_severity_bands(batch_size: int = 5000, pause: float = 0.0) -> Dict[str, int]:
+        """
+        Заполняет степени выраженности у старых результатов пачками по id.
+        Пересчёт делается в БД одним UPDATE на пачку, без загрузки строк в Python.
+        """
+        band = Dass9Result.severity_band_expression
+        updated = batches = 0
+        last_id = None
+        while True:
+            pending = Dass9Result.objects.filter(max_band__isnull=True)
+            if last_id is not None:
+                # курсор по id: каждая пачка продолжает с места предыдущей, а не с начала таблицы
+                pending = pending.filter(id__gt=last_id)
+            ids = list(pending.order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            updated += Dass9Result.objects.filter(id__in=ids).update(
+                depression_band=band(F("depression_score")),
+                stress_band=band(F("stress_score")),
+                anxiety_band=band(F("anxiety_score")),
+                max_band=band(Greatest("depression_score", "stress_score", "anxiety_score")),
+            )
+            batches += 1
+            if pause:
+                time.sleep(pause)
+        return {"updated": updated, "batches": batches}
 
     @staticmethod
-    def get_results(user_id: int, from_date: Optional[date] = None, to_date: Optional[date] = None) -> List[Dass9Result]:
+    def get_random_questions():
         """
-        Получить результаты DASS-9 для пользователя с фильтрацией по датам
+        Возвращает 9 вопросов: по 3 из каждой категории.
+        Выборка делается из закэшированного банка вопросов, без обращения к БД.
         """
-        user = User.objects.get(id=user_id)
-        results = Dass9Result.objects.filter(user=user)
+        return question_bank.sample(per_type=3)
+
+    @staticmethod
+    def get_results(user_id: int, from_date: Optional[date] = None, to_date: Optional[date] = None,
+                    before: Optional[date] = None):
+        """
+        Получить результаты DASS-9 для пользователя с фильтрацией по датам.
+
+        before — курсор keyset-пагинации: только результаты строго раньше этой даты.
+        Возвращает queryset кортежей (date, depression, stress, anxiety) от новых к старым.
+        """
+        results = Dass9Result.objects.filter(user_id=user_id)
 
         if from_date:
             results = results.filter(date__gte=from_date)
         if to_date:
             results = results.filter(date__lte=to_date)
+        if before:
+            results = results.filter(date__lt=before)
+
+        return results.order_by("-date").values_list("date", "depression_score", "stress_score", "anxiety_score")
+
+    @staticmethod
+    def get_results_etag(user_id: int, *key_parts) -> str:
+        """
+        ETag истории пользователя. Результаты только добавляются, поэтому
+        количество и максимальный id однозначно описывают состояние.
+        """
+        state = Dass9Result.objects.filter(user_id=user_id).aggregate(count=Count("id"), last_id=Max("id"))
+        raw = ":".join(str(part) for part in (user_id, state["count"], state["last_id"], *key_parts))
+        return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+class QuestionBank:
+    """
+    Кэш банка вопросов внутри процесса.
+
+    Вопросы загружаются одним запросом и хранятся уже в виде готовых payload для QuestionOutput.
+    Сбрасывается сигналами save/delete модели Question; ttl ограничивает
+    устаревание при изменениях из других процессов.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_type: Optional[Dict[str, List[Dict]]] = None
+        self._loaded_at = 0.0
+
+    def _load(self) -> Dict[str, List[Dict]]:
+        by_type: Dict[str, List[Dict]] = {q_type.value: [] for q_type in Question.QuestionType}
+        for q in Question.objects.order_by("id").values("id", "text", "type"):
+            by_type.setdefault(q["type"], []).append({
+                "id": q["id"],
+                "text": q["text"],
+                "type": q["type"],
+                "answers": Dass9Service.ANSWERS_MAP,
+            })
+        return by_type
+
+    def _get(self) -> Dict[str, List[Dict]]:
+        by_type = self._by_type
+        if by_type is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return by_type
+        with self._lock:
+            if self._by_type is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._by_type = self._load()
+                self._loaded_at = time.monotonic()
+            return self._by_type
+
+    def sample(self, per_type: int = 3) -> List[Dict]:
+        by_type = self._get()
+        questions = []
+        for q_type in Question.QuestionType:
+            pool = by_type.get(q_type.value, [])
+            questions.extend(random.sample(pool, min(per_type, len(pool))))
+        return questions
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._by_type = None
+
 
-        return results.order_by("-date")
+question_bank = QuestionBank(ttl=getattr(settings, "DASS_QUESTION_BANK_TTL", 300))
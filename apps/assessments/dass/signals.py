@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Отправляется после вставки результатов в обход ORM (внутри той же транзакции).
+# results — список dict с ключами user_id, date, depression_score, stress_score, anxiety_score.
+results_created = Signal()
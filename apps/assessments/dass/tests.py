@@ -0,0 +1,362 @@
+import io
+import json
+import threading
+from datetime import date, timedelta
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.assessments.dass.models import Dass9Result, Question
+from apps.assessments.dass.services import Dass9Service, question_bank
+from apps.auth_user.models import User
+from apps.auth_user.services import create_access_token
+
+
+@skipUnless(connection.vendor == "postgresql", "save_result использует INSERT ... ON CONFLICT внутри CTE (Postgres)")
+class SaveResultConcurrencyTests(TransactionTestCase):
+    """
+    Параллельные отправки результата одним пользователем за один день.
+    """
+
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, "password")
+        # в токене id пользователя — число
+        self.user_info = {"user_id": self.user.id.int}
+
+    def _submit_concurrently(self, make_kwargs):
+        barrier = threading.Barrier(self.THREADS)
+        results = [None] * self.THREADS
+        errors = []
+
+        def worker(index):
+            try:
+                barrier.wait()
+                results[index] = Dass9Service.save_result(self.user_info, **make_kwargs(index))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def _today_rows(self):
+        return Dass9Result.objects.filter(user=self.user, date=date.today())
+
+    def test_parallel_submissions_store_one_row(self):
+        results, errors = self._submit_concurrently(
+            lambda i: {"depression": i, "stress": 1, "anxiety": 2, "idempotency_key": f"key-{i}"}
+        )
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self._today_rows().count(), 1)
+        saved = [r for r in results if r is not None]
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(saved[0].id, self._today_rows().get().id)
+
+    def test_parallel_submissions_without_key_store_one_row(self):
+        results, errors = self._submit_concurrently(lambda i: {"depression": i, "stress": 1, "anxiety": 2})
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self._today_rows().count(), 1)
+        self.assertEqual(len([r for r in results if r is not None]), 1)
+
+    def test_parallel_submissions_with_same_key_return_original_row(self):
+        results, errors = self._submit_concurrently(
+            lambda i: {"depression": i, "stress": 1, "anxiety": 2, "idempotency_key": "same-key"}
+        )
+
+        self.assertEqual(errors, [])
+        row = self._today_rows().get()
+        self.assertEqual({r.id for r in results}, {row.id})
+        self.assertEqual({r.depression_score for r in results}, {row.depression_score})
+
+    def test_replayed_idempotency_key_returns_original_row(self):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.user.id.int, False)}"}
+
+        first = self.client.post(
+            "/api/dass9/", {"depression": 3, "stress": 4, "anxiety": 5},
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY="replay-key", **headers,
+        )
+        replay = self.client.post(
+            "/api/dass9/", {"depression": 9, "stress": 9, "anxiety": 9},
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY="replay-key", **headers,
+        )
+        other = self.client.post(
+            "/api/dass9/", {"depression": 9, "stress": 9, "anxiety": 9},
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY="another-key", **headers,
+        )
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(first.json()["depression"], 3)
+        self.assertEqual(other.json(), {"message": "Вы уже проходили тест сегодня!"})
+        self.assertEqual(self._today_rows().count(), 1)
+
+
+class Dass9ScoreValidationTests(TestCase):
+    """
+    Баллы подшкал вне 0..9 отклоняются схемой до сохранения.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, "password")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.user.id.int, False)}"}
+
+    def test_single_result_rejects_out_of_range_scores(self):
+        for scores in ({"depression": 10, "stress": 0, "anxiety": 0}, {"depression": 0, "stress": -1, "anxiety": 0}):
+            response = self.client.post("/api/dass9/", scores, content_type="application/json", **self.headers)
+            self.assertEqual(response.status_code, 422)
+        self.assertFalse(Dass9Result.objects.exists())
+
+    def test_batch_rejects_out_of_range_scores(self):
+        payload = {"items": [{"date": date.today().isoformat(), "depression": 0, "stress": 0, "anxiety": 12}]}
+        response = self.client.post("/api/dass9/batch", payload, content_type="application/json", **self.headers)
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Dass9Result.objects.exists())
+
+
+class QuestionBankCacheTests(TestCase):
+    """
+    /dass9/random отдаётся из кэша банка вопросов; изменения вопросов сбрасывают кэш после коммита.
+    """
+
+    def setUp(self):
+        for q_type in Question.QuestionType:
+            for i in range(4):
+                Question.objects.create(text=f"{q_type.value} {i}", type=q_type.value)
+        question_bank.invalidate()
+        self.addCleanup(question_bank.invalidate)
+
+    def test_random_returns_three_questions_per_type_without_queries(self):
+        self.client.get("/api/dass9/random")  # прогрев
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/dass9/random")
+
+        self.assertEqual(response.status_code, 200)
+        questions = response.json()
+        self.assertEqual(len(questions), 9)
+        self.assertEqual(len({q["id"] for q in questions}), 9)
+        self.assertEqual(
+            sorted(q["type"] for q in questions),
+            sorted([q_type.value for q_type in Question.QuestionType] * 3),
+        )
+        self.assertEqual(questions[0]["answers"]["0"], Dass9Service.ANSWERS_MAP[0])
+
+    def test_question_change_invalidates_after_commit(self):
+        question_bank.sample()
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.filter(type=Question.QuestionType.STRESS).delete()
+            # до коммита кэш ещё не сброшен
+            self.assertIsNotNone(question_bank._by_type)
+
+        with self.assertNumQueries(1):
+            questions = question_bank.sample()
+        self.assertEqual(len(questions), 6)
+        self.assertNotIn(Question.QuestionType.STRESS.value, {q["type"] for q in questions})
+
+    def test_ttl_expiry_reloads_bank(self):
+        question_bank.sample()
+        question_bank._loaded_at -= question_bank.ttl
+
+        with self.assertNumQueries(1):
+            question_bank.sample()
+
+
+@override_settings(DASS9_BATCH_MAX_ITEMS=5, DASS9_BATCH_MAX_AGE_DAYS=30)
+class Dass9BatchSyncTests(TestCase):
+    """
+    /dass9/batch: статус по каждому элементу и одна вставка на пачку.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, None)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.user.id.int, False)}"}
+        self.today = date.today()
+
+    def _item(self, days_ago: int, depression: int = 1, **extra):
+        return {"date": (self.today - timedelta(days=days_ago)).isoformat(),
+                "depression": depression, "stress": 2, "anxiety": 3, **extra}
+
+    def _post(self, items):
+        return self.client.post("/api/dass9/batch", {"items": items}, content_type="application/json", **self.headers)
+
+    def test_statuses_in_request_order(self):
+        Dass9Result.objects.create(user=self.user, depression_score=0, stress_score=0, anxiety_score=0)
+        Dass9Result.objects.filter(user=self.user).update(date=self.today - timedelta(days=2))
+
+        response = self._post([
+            self._item(1, depression=4),
+            self._item(2),
+            self._item(1, depression=9),
+            self._item(-1),
+            self._item(31),
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["status"] for item in response.json()],
+            ["created", "exists", "duplicate", "invalid", "invalid"],
+        )
+        saved = Dass9Result.objects.get(user=self.user, date=self.today - timedelta(days=1))
+        # первый элемент дня побеждает, степени заполняются при вставке
+        self.assertEqual((saved.depression_score, saved.depression_band), (4, Dass9Result.SeverityBand.MILD))
+        self.assertEqual(saved.max_band, Dass9Result.SeverityBand.MILD)
+
+    def test_batch_inserts_with_single_statement(self):
+        items = [self._item(days_ago) for days_ago in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post(items)
+
+        self.assertEqual([item["status"] for item in response.json()], ["created"] * 3)
+        table = connection.ops.quote_name(Dass9Result._meta.db_table)
+        inserts = [q["sql"] for q in queries.captured_queries if q["sql"].startswith(f"INSERT INTO {table}")]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Dass9Result.objects.filter(user=self.user).count(), 3)
+
+    def test_resending_batch_reports_exists(self):
+        items = [self._item(0), self._item(1)]
+        self._post(items)
+        response = self._post(items)
+
+        self.assertEqual([item["status"] for item in response.json()], ["exists", "exists"])
+        self.assertEqual(Dass9Result.objects.filter(user=self.user).count(), 2)
+
+    def test_too_many_items_is_400(self):
+        response = self._post([self._item(days_ago) for days_ago in range(6)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Dass9Result.objects.exists())
+
+
+class Dass9HistoryTests(TestCase):
+    """
+    GET /dass9/: keyset-пагинация по дате, потоковая выдача и ETag.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, None)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.user.id.int, False)}"}
+        self.today = date.today()
+        Dass9Service.save_results_batch(self.user.id, [
+            {"date": self.today - timedelta(days=days_ago), "depression": days_ago, "stress": 0, "anxiety": 0}
+            for days_ago in range(5)
+        ])
+
+    def _get(self, **params):
+        return self.client.get("/api/dass9/", params, **self.headers)
+
+    @staticmethod
+    def _body(response):
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return json.loads(content)
+
+    def test_pages_follow_cursor_without_gaps(self):
+        dates, cursor, pages = [], None, 0
+        while True:
+            response = self._get(limit=2, **({"cursor": cursor} if cursor else {}))
+            self.assertEqual(response.status_code, 200)
+            dates += [row["date"] for row in self._body(response)]
+            pages += 1
+            cursor = response.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(dates, [(self.today - timedelta(days=d)).isoformat() for d in range(5)])
+
+    def test_last_full_page_has_no_cursor(self):
+        response = self._get(limit=5)
+        self.assertEqual(len(self._body(response)), 5)
+        self.assertNotIn("X-Next-Cursor", response)
+
+    def test_without_limit_history_is_streamed(self):
+        response = self._get(from_date=(self.today - timedelta(days=1)).isoformat())
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(self._body(response), [
+            {"date": (self.today - timedelta(days=d)).isoformat(), "depression": d, "stress": 0, "anxiety": 0}
+            for d in range(2)
+        ])
+
+    def test_unchanged_history_returns_304(self):
+        etag = self._get(limit=2)["ETag"]
+
+        response = self.client.get("/api/dass9/", {"limit": 2}, HTTP_IF_NONE_MATCH=etag, **self.headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # другие параметры запроса — другой ETag
+        self.assertNotEqual(self._get(limit=3)["ETag"], etag)
+
+    def test_new_result_changes_etag(self):
+        etag = self._get()["ETag"]
+        Dass9Service.save_results_batch(self.user.id, [
+            {"date": self.today - timedelta(days=10), "depression": 1, "stress": 1, "anxiety": 1},
+        ])
+
+        response = self.client.get("/api/dass9/", HTTP_IF_NONE_MATCH=etag, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(self._body(response)), 6)
+
+
+class BackfillSeverityBandsTests(TestCase):
+    """
+    Заполнение степеней у старых результатов пачками по id.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, None)
+        self.scores = [(0, 2, 3), (4, 5, 6), (7, 1, 0), (9, 9, 9), (2, 2, 2)]
+        Dass9Service.save_results_batch(self.user.id, [
+            {"date": date.today() - timedelta(days=days), "depression": d, "stress": s, "anxiety": a}
+            for days, (d, s, a) in enumerate(self.scores)
+        ])
+        # строки, сохранённые до появления степеней
+        Dass9Result.objects.update(depression_band=None, stress_band=None, anxiety_band=None, max_band=None)
+
+    def _assert_bands_filled(self):
+        for result in Dass9Result.objects.all():
+            expected = Dass9Result.severity_bands(result.depression_score, result.stress_score, result.anxiety_score)
+            self.assertEqual(
+                {field: getattr(result, field) for field in expected}, expected, (result.depression_score,)
+            )
+
+    def test_backfill_in_batches(self):
+        stats = Dass9Service.backfill_severity_bands(batch_size=2)
+
+        self.assertEqual(stats, {"updated": 5, "batches": 3})
+        self._assert_bands_filled()
+        self.assertEqual(
+            sorted(Dass9Result.objects.values_list("max_band", flat=True)),
+            [Dass9Result.SeverityBand.NORMAL, Dass9Result.SeverityBand.MILD, Dass9Result.SeverityBand.MODERATE,
+             Dass9Result.SeverityBand.SEVERE, Dass9Result.SeverityBand.SEVERE],
+        )
+        self.assertEqual(Dass9Service.backfill_severity_bands(batch_size=2), {"updated": 0, "batches": 0})
+
+    def test_batches_continue_after_last_id(self):
+        with CaptureQueriesContext(connection) as queries:
+            Dass9Service.backfill_severity_bands(batch_size=2)
+        # выборка каждой следующей пачки продолжает с id предыдущей
+        selects = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(selects), 4)
+        self.assertNotIn(" > ", selects[0])
+        self.assertTrue(all(" > " in sql for sql in selects[1:]))
+
+    def test_command_output(self):
+        out = io.StringIO()
+        call_command("backfill_dass9_bands", batch_size=10, stdout=out)
+
+        self.assertRegex(out.getvalue(), r"^updated=5 batches=1 seconds=\d+\.\d{3}$")
+        self._assert_bands_filled()
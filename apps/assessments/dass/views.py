@@ -1,9 +1,13 @@
 from ninja import Router, Query
+from ninja.errors import HttpError
 from typing import List, Optional
 from datetime import date
 
 from .models import Dass9Result
-from .schemas import Dass9Input, Dass9Output, QuestionOutput
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .schemas import Dass9Input, Dass9Output, QuestionOutput, Dass9BatchIn, Dass9BatchItemOut
 from .services import Dass9Service
 from ...auth_user.models import User
 from ...auth_user.permissions import JWTAuth
@@ -13,14 +17,22 @@ router = Router(tags=["Dass assessments(Тестирование по метод
 @router.post("/", auth=JWTAuth())
 def save_dass9_result(request, payload: Dass9Input):
     """
-    Сохранить результат DASS-9 для текущего пользователя
+    Сохранить результат DASS-9 для текущего пользователя.
+
+    Необязательный заголовок Idempotency-Key: повторная отправка с тем же ключом
+    возвращает ранее сохранённый результат.
     """
     userInfo = request.auth
+    idempotency_key = request.headers.get("Idempotency-Key") or None
+    if idempotency_key and len(idempotency_key) > 64:
+        raise HttpError(400, "Idempotency-Key не может быть длиннее 64 символов")
+
     result = Dass9Service.save_result(
         userInfo=userInfo,
         depression=payload.depression,
         stress=payload.stress,
         anxiety=payload.anxiety,
+        idempotency_key=idempotency_key,
     )
 
     if result is None:
@@ -33,6 +45,24 @@ def save_dass9_result(request, payload: Dass9Input):
         "anxiety": result.anxiety_score
     })
 
+@router.post("/batch", response=List[Dass9BatchItemOut], auth=JWTAuth())
+def save_dass9_results_batch(request, payload: Dass9BatchIn):
+    """
+    Пакетная синхронизация результатов DASS-9, пройденных офлайн.
+
+    - Каждый элемент содержит дату прохождения на клиенте.
+    - Действует правило «один тест в день»: уже сохранённые дни и повторы внутри пачки пропускаются.
+    - Возвращает статус по каждому элементу: created / exists / duplicate / invalid.
+    """
+    max_items = getattr(settings, "DASS9_BATCH_MAX_ITEMS", 500)
+    if len(payload.items) > max_items:
+        raise HttpError(400, f"Не больше {max_items} результатов за один запрос")
+
+    return Dass9Service.save_results_batch(
+        user_id=request.auth["user_id"],
+        items=[item.model_dump() for item in payload.items],
+    )
+
 @router.get("/check", auth=JWTAuth())
 def check_dass9_passed_today(request):
     """
@@ -43,42 +73,73 @@ def check_dass9_passed_today(request):
     return {"passed_today": passed}
 
 
+def _stream_results(rows, chunk_size: int):
+    """
+    Сериализует строки истории в JSON-массив чанками, не собирая весь список в памяти.
+    """
+    yield "["
+    first = True
+    chunk = []
+    for d, depression, stress, anxiety in rows:
+        chunk.append(
+            '{"date": "%s", "depression": %d, "stress": %d, "anxiety": %d}'
+            % (d.isoformat(), depression, stress, anxiety)
+        )
+        if len(chunk) >= chunk_size:
+            yield ("" if first else ", ") + ", ".join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ("" if first else ", ") + ", ".join(chunk)
+    yield "]"
+
 @router.get("/", response=List[Dass9Output], auth=JWTAuth())
 def get_dass9_result(
         request,
         from_date: Optional[date] = Query(None),
-        to_date: Optional[date] = Query(None)
+        to_date: Optional[date] = Query(None),
+        cursor: Optional[date] = Query(None, description="Вернуть результаты строго раньше этой даты"),
+        limit: Optional[int] = Query(None, ge=1, le=1000, description="Размер страницы")
 ):
     """
     Получить историю результатов текущего пользователя
-    с возможностью фильтрации по диапазону дат
+    с возможностью фильтрации по диапазону дат.
+
+    - Keyset-пагинация: `limit` задаёт размер страницы, курсор следующей страницы
+      возвращается в заголовке `X-Next-Cursor` и передаётся в параметре `cursor`.
+    - Без `limit` история отдаётся потоком целиком.
+    - Поддерживается `If-None-Match`: неизменившаяся история возвращает 304.
     """
 
     user_id = request.auth["user_id"]
-    results = Dass9Service.get_results(user_id=user_id, from_date=from_date, to_date=to_date)
-
-    return [
-        {
-            "date": r.date,
-            "depression": r.depression_score,
-            "stress": r.stress_score,
-            "anxiety": r.anxiety_score,
-        }
-        for r in results
-    ]
+    etag = Dass9Service.get_results_etag(user_id, from_date, to_date, cursor, limit)
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+        response["ETag"] = etag
+        return response
+
+    results = Dass9Service.get_results(user_id=user_id, from_date=from_date, to_date=to_date, before=cursor)
+
+    if limit:
+        rows = list(results[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        response = HttpResponse(_stream_results(rows, chunk_size=limit), content_type="application/json")
+        if has_more:
+            response["X-Next-Cursor"] = rows[-1][0].isoformat()
+    else:
+        chunk_size = getattr(settings, "DASS9_HISTORY_CHUNK_SIZE", 500)
+        response = StreamingHttpResponse(
+            _stream_results(results.iterator(chunk_size=chunk_size), chunk_size=chunk_size),
+            content_type="application/json",
+        )
+
+    response["ETag"] = etag
+    return response
 
 @router.get("/random", response=List[QuestionOutput])
 def get_dass9_questions(request):
     """
     Получить 9 случайных вопросов (по 3 на каждую тему)
     """
-    questions = Dass9Service.get_random_questions()
-    return [
-        {
-            "id": q.id,
-            "text": q.text,
-            "type": q.type,
-            "answers": Dass9Service.ANSWERS_MAP
-        }
-        for q in questions
-    ]
+    return Dass9Service.get_random_questions()
@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections
+
+
+class HashingPoolBusy(Exception):
+    """
+    Пул хэширования заполнен, запрос нужно повторить позже.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing pool is full")
+        self.retry_after = retry_after
+
+
+class PasswordHashingPool:
+    """
+    Ограниченный пул потоков для операций с хэшированием паролей (PBKDF2).
+
+    Одновременно принимается не больше max_workers + max_pending задач,
+    остальные сразу получают HashingPoolBusy, чтобы не копить очередь
+    и не держать event loop.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 16, retry_after: int = 1):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hashing")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    @staticmethod
+    def _call(fn, *args, **kwargs):
+        # задачи могут обращаться к БД: соединения потока живут по тем же правилам, что и в запросе
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolBusy(self.retry_after)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                functools.partial(self._call, fn, *args, **kwargs),
+            )
+        finally:
+            self._slots.release()
+
+
+hashing_pool = PasswordHashingPool(
+    max_workers=getattr(settings, "PASSWORD_HASHING_WORKERS", 4),
+    max_pending=getattr(settings, "PASSWORD_HASHING_MAX_PENDING", 16),
+    retry_after=getattr(settings, "PASSWORD_HASHING_RETRY_AFTER", 1),
+)
+
+
+def _init_hashing_process():
+    # процессы пула запускаются через forkserver/spawn: Django нужно инициализировать заново
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+        django.setup()
+
+
+class PasswordHashingProcessPool:
+    """
+    Долгоживущий пул процессов для пакетного хэширования паролей.
+
+    Создаётся при первом использовании и переиспользуется между запросами.
+    Процессы запускаются через forkserver (где недоступен — spawn), а не fork:
+    веб-воркер уже держит пулы потоков, и fork такого процесса может зависнуть на их блокировках.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers or os.cpu_count()
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_hashing_process,
+                )
+            return self._executor
+
+    def map(self, fn, items: list, chunksize: int = 1) -> list:
+        try:
+            return list(self._get_executor().map(fn, items, chunksize=chunksize))
+        except BrokenProcessPool:
+            # процесс пула упал — следующий вызов создаст пул заново
+            with self._lock:
+                self._executor = None
+            raise
+
+
+hashing_process_pool = PasswordHashingProcessPool(
+    max_workers=getattr(settings, "PASSWORD_HASHING_PROCESSES", None),
+)
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """
+    Хэширует пачку паролей параллельно в пуле процессов (PBKDF2 упирается в CPU).
+    Порядок результата совпадает с порядком входных паролей.
+    """
+    if len(passwords) < getattr(settings, "PASSWORD_HASHING_PARALLEL_THRESHOLD", 8):
+        return [make_password(p) for p in passwords]
+
+    chunksize = max(1, len(passwords) // (hashing_process_pool.max_workers * 4))
+    return hashing_process_pool.map(make_password, passwords, chunksize=chunksize)
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+
+from apps.auth_user.models import User
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный бенчмарк /auth/login: сравнение p50/p99 синхронной и асинхронной версий"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Количество запросов на каждый путь")
+        parser.add_argument("--concurrency", type=int, default=32, help="Количество одновременных запросов")
+
+    def handle(self, *args, **options):
+        username = f"bench-{uuid4().hex[:12]}"
+        password = uuid4().hex
+        User.objects.create_user(username=username, password=password)
+        try:
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                for path in ("/api/auth/login", "/api/auth/async/login"):
+                    stats = asyncio.run(
+                        self._run(path, username, password, options["requests"], options["concurrency"])
+                    )
+                    self.stdout.write(
+                        f"{path}: ok={stats['ok']} rejected_429={stats['rejected']} errors={stats['errors']} "
+                        f"p50={stats['p50']:.1f}ms p99={stats['p99']:.1f}ms rps={stats['rps']:.1f}"
+                    )
+        finally:
+            User.objects.filter(username=username).delete()
+
+    @staticmethod
+    async def _run(path: str, username: str, password: str, total: int, concurrency: int) -> dict:
+        """
+        Запросы идут через ASGI-обработчик: синхронный view выполняется в общем
+        потоке sync_to_async, асинхронный — в пуле хэширования.
+        """
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        rejected = 0
+        errors = 0
+
+        async def one():
+            nonlocal rejected, errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(
+                    path,
+                    {"username": username, "password": password},
+                    content_type="application/json",
+                )
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code == 200:
+                latencies.append(elapsed)
+            elif response.status_code == 429:
+                rejected += 1
+            else:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        duration = time.perf_counter() - started
+
+        latencies.sort()
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "ok": len(latencies),
+            "rejected": rejected,
+            "errors": errors,
+            "p50": percentile(0.50),
+            "p99": percentile(0.99),
+            "rps": total / duration if duration else 0.0,
+        }
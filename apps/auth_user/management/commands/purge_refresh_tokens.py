@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.auth_user.services import purge_expired_refresh_tokens
+
+
+class Command(BaseCommand):
+    help = "Удаляет истёкшие refresh-токены пачками (для запуска из cron или в режиме --interval)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Размер пачки удаления")
+        parser.add_argument("--pause", type=float, default=0.05, help="Пауза между пачками, сек")
+        parser.add_argument("--max-seconds", type=float, default=None, help="Ограничение времени одного прохода, сек")
+        parser.add_argument("--interval", type=float, default=None,
+                            help="Если задан — повторять проход каждые N секунд")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = purge_expired_refresh_tokens(
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+                max_seconds=options["max_seconds"],
+            )
+            self.stdout.write(
+                f"deleted={stats['deleted']} batches={stats['batches']} seconds={stats['seconds']}"
+            )
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
@@ -46,8 +46,11 @@ class User(AbstractBaseUser, PermissionsMixin):
 class RefreshToken(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # jti из payload токена; у записей, созданных до перехода на HMAC, пусто
+    jti = models.UUIDField(unique=True, null=True, blank=True)
+    # HMAC-SHA256 от токена (legacy-записи хранят make_password-хэш)
     token = models.CharField(max_length=512, unique=True)
-    expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -1,17 +1,17 @@
 from ninja.security import HttpBearer
 from ninja.errors import HttpError
-from apps.auth_user.services import verify_token
+from apps.auth_user.token_cache import verify_access_token
 
 class JWTAuth(HttpBearer):
     def authenticate(self, request, token):
-        payload = verify_token(token, token_type="access")
+        payload = verify_access_token(token)
         if payload is None:
             raise HttpError(401, "Invalid or expired token")
         return payload
 
 class JWTAuthManager(HttpBearer):
     def authenticate(self, request, token):
-        payload = verify_token(token, token_type="access")
+        payload = verify_access_token(token)
         if payload is None:
             raise HttpError(401, "Invalid or expired token")
         if payload['is_manager'] is False:
@@ -15,3 +15,7 @@ class LoginResponse(Schema):
     username: str
     fullname: str
     is_manager: bool
+
+class ChangePasswordIn(Schema):
+    old_password: str
+    new_password: str
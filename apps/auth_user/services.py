@@ -1,6 +1,10 @@
+import hashlib
+import hmac
+import time
 import jwt
 from uuid import uuid4
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import transaction
 from django.utils import timezone
 from django.conf import settings
 from apps.auth_user.models import User, RefreshToken
@@ -13,36 +17,100 @@ ALGORITHM = "HS256"
 # REFRESH_TOKEN_EXPIRE_DAYS = 7
 ACCESS_TOKEN_EXPIRE_MINUTES = 150000
 REFRESH_TOKEN_EXPIRE_DAYS =   150000
+# формат refresh-токена: у токенов, хранящихся как jti + HMAC, в payload есть поле "v"
+REFRESH_TOKEN_VERSION = 2
 
 def create_access_token(user_id: int, is_manager: bool):
-    expire = timezone.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    now = timezone.now()
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {
         "user_id": user_id,
         "is_manager": is_manager,
+        "iat": now.timestamp(),
         "exp": int(expire.timestamp()),
         "type": "access",
+        "jti": str(uuid4()),
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def _token_digest(token: str) -> str:
+    """
+    Быстрый keyed-хэш токена для хранения в БД (HMAC-SHA256 на SECRET_KEY).
+    """
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+def _pop_legacy_refresh_token(payload: dict, token: str) -> RefreshToken | None:
+    """
+    Ищет токен среди записей старого формата (make_password-хэш без jti).
+    Найденная запись переводится на новый формат, так что полный перебор
+    выполняется не более одного раза на токен.
+
+    Перебор включается настройкой REFRESH_TOKEN_LEGACY_LOOKUP = True только на время
+    перехода и делается лишь для токенов, выданных до него (без поля "v"): промах
+    по токену нового формата не приводит к PBKDF2-проверкам.
+    """
+    if not getattr(settings, "REFRESH_TOKEN_LEGACY_LOOKUP", False) or "v" in payload:
+        return None
+    user_id = payload["user_id"]
+
+    legacy_tokens = RefreshToken.objects.filter(user_id=user_id, jti__isnull=True)
+    db_token = next((t for t in legacy_tokens if check_password(token, t.token)), None)
+    if db_token is None:
+        return None
+
+    jti = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False}).get("jti")
+    db_token.jti = jti
+    db_token.token = _token_digest(token)
+    db_token.save(update_fields=["jti", "token"])
+    return db_token
+
+
+def _get_refresh_token(payload: dict, token: str) -> RefreshToken | None:
+    """
+    Находит запись refresh-токена одним индексным запросом по jti.
+    """
+    jti = payload.get("jti")
+    if jti:
+        db_token = RefreshToken.objects.filter(jti=jti, user_id=payload["user_id"]).first()
+        if db_token and hmac.compare_digest(db_token.token, _token_digest(token)):
+            return db_token
+    return _pop_legacy_refresh_token(payload, token)
+
+
 def create_refresh_token(user_id: int, is_manager: bool, *, replace_token: str | None = None) -> str | None:
     """
     Создаёт новый refresh-токен для пользователя.
 
     Если replace_token передан, старый токен заменяется новым.
     Поддерживается максимум MAX_REFRESH_TOKENS активных токенов.
-    Хэш токена хранится в БД.
+    В БД хранится jti и HMAC токена.
     """
 
     tokens_qs = RefreshToken.objects.filter(user_id=user_id).order_by("created_at")
 
     if replace_token:
 
-        old_token = next((t for t in tokens_qs if check_password(replace_token, t.token)), None)
-        if not old_token:
+        try:
+            payload = jwt.decode(replace_token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            return None
+        if payload.get("type") != "refresh" or payload.get("user_id") != user_id:
             return None
-        expire = old_token.expires_at
-        old_token.delete()
+
+        # Ротация одним DELETE: при гонке двух запросов токен заменит только один
+        deleted, _ = RefreshToken.objects.filter(
+            user_id=user_id,
+            jti=payload.get("jti"),
+            token=_token_digest(replace_token),
+        ).delete()
+        if not deleted:
+            legacy_token = _pop_legacy_refresh_token(payload, replace_token)
+            if not legacy_token:
+                return None
+            legacy_token.delete()
+        expire = datetime.fromtimestamp(payload["exp"], tz=dt_timezone.utc)
     else:
 
         expire = timezone.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
@@ -51,18 +119,21 @@ def create_refresh_token(user_id: int, is_manager: bool, *, replace_token: str |
         if tokens_qs.count() >= max_tokens:
             tokens_qs.first().delete()
 
+    jti = str(uuid4())
     payload = {
         "user_id": user_id,
         "is_manager": is_manager,
         "exp": int(expire.timestamp()),
         "type": "refresh",
-        "jti": str(uuid4()),
+        "jti": jti,
+        "v": REFRESH_TOKEN_VERSION,
     }
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
     RefreshToken.objects.create(
         user_id=user_id,
-        token=make_password(token),
+        jti=jti,
+        token=_token_digest(token),
         expires_at=expire,
     )
 
@@ -75,7 +146,7 @@ def verify_token(token: str, token_type="access"):
     """
     Проверяет JWT-токен.
     Для access-токена не трогаем БД.
-    Для refresh-токена ищем хэш в БД и проверяем срок действия.
+    Для refresh-токена ищем запись по jti, сверяем HMAC и проверяем срок действия.
     Возвращает payload или None.
     """
     try:
@@ -90,8 +161,7 @@ def verify_token(token: str, token_type="access"):
 
         if token_type == "refresh":
 
-            db_tokens = RefreshToken.objects.filter(user_id=user_id)
-            db_token = next((t for t in db_tokens if check_password(token, t.token)), None)
+            db_token = _get_refresh_token(payload, token)
             if not db_token:
                 return None
             if db_token.expires_at <= timezone.now():
@@ -104,7 +174,70 @@ def verify_token(token: str, token_type="access"):
         return None
 
 def revoke_refresh_token(token: str) -> int:
-    return RefreshToken.objects.filter(token=token).delete()[0]
+    """
+    Отзывает refresh-токен. Access-токены не привязаны к конкретному refresh-токену,
+    поэтому отзываются все выданные пользователю к этому моменту: другие сессии
+    получат новый access-токен по своему refresh-токену.
+    """
+    from apps.auth_user.token_cache import revoke_user_access_tokens
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+    except jwt.InvalidTokenError:
+        payload = {}
+    deleted = RefreshToken.objects.filter(token=_token_digest(token)).delete()[0]
+    if deleted and payload.get("user_id"):
+        revoke_user_access_tokens(payload["user_id"])
+    return deleted
 
 def revoke_all_refresh_tokens(user_id: int) -> int:
-    return RefreshToken.objects.filter(user_id=user_id).delete()[0]
+    """
+    Отзывает все refresh- и access-токены пользователя.
+    """
+    from apps.auth_user.token_cache import revoke_user_access_tokens
+
+    deleted = RefreshToken.objects.filter(user_id=user_id).delete()[0]
+    revoke_user_access_tokens(user_id)
+    return deleted
+
+def purge_expired_refresh_tokens(batch_size: int = 1000, pause: float = 0.0, max_seconds: float | None = None) -> dict:
+    """
+    Удаляет истёкшие refresh-токены пачками фиксированного размера.
+
+    Каждая пачка — отдельная короткая транзакция: строки выбираются по индексу expires_at
+    с SKIP LOCKED, поэтому параллельные ротации токенов не ждут уборщика.
+    Между пачками можно делать паузу, max_seconds ограничивает общее время работы.
+    Возвращает количество удалённых строк, пачек и затраченное время.
+    """
+    started = time.monotonic()
+    now = timezone.now()
+    deleted_total = 0
+    batches = 0
+
+    while True:
+        with transaction.atomic():
+            ids = list(
+                RefreshToken.objects.filter(expires_at__lte=now)
+                .order_by("expires_at")
+                .select_for_update(skip_locked=True)
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            deleted, _ = RefreshToken.objects.filter(id__in=ids).delete()
+
+        deleted_total += deleted
+        batches += 1
+
+        if len(ids) < batch_size:
+            break
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return {
+        "deleted": deleted_total,
+        "batches": batches,
+        "seconds": round(time.monotonic() - started, 3),
+    }
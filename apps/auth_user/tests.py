@@ -0,0 +1,298 @@
+import asyncio
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import jwt
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from apps.auth_user import services, token_cache as token_cache_module, views
+from apps.auth_user.hashing import HashingPoolBusy, PasswordHashingPool
+from apps.auth_user.models import RefreshToken, User
+from apps.auth_user.services import ALGORITHM, SECRET_KEY, create_access_token, create_refresh_token, \
+    purge_expired_refresh_tokens, verify_token
+from apps.auth_user.token_cache import VerifiedTokenCache, token_cache, verify_access_token
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RefreshTokenRotationTests(TestCase):
+    """
+    Ротация refresh-токена: старый токен после обмена больше не принимается.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, "password")
+
+    def _refresh(self, token):
+        self.client.cookies["refresh_token"] = token
+        return self.client.get("/api/auth/refresh")
+
+    def test_login_then_rotate(self):
+        response = self.client.post(
+            "/api/auth/login", {"username": "employee", "password": "password"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        first = response.cookies["refresh_token"].value
+
+        rotated = self._refresh(first)
+        self.assertEqual(rotated.status_code, 200)
+        self.assertIn("access", rotated.json())
+        second = rotated.cookies["refresh_token"].value
+        self.assertNotEqual(first, second)
+        self.assertEqual(RefreshToken.objects.filter(user=self.user).count(), 1)
+
+        self.assertEqual(self._refresh(second).status_code, 200)
+
+    def test_reused_token_is_rejected(self):
+        first = create_refresh_token(self.user.id.int, False)
+        self.assertEqual(self._refresh(first).status_code, 200)
+
+        self.assertEqual(self._refresh(first).status_code, 401)
+        self.assertIsNone(create_refresh_token(self.user.id.int, False, replace_token=first))
+
+    def test_expired_record_is_rejected_and_deleted(self):
+        token = create_refresh_token(self.user.id.int, False)
+        RefreshToken.objects.filter(user=self.user).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNone(verify_token(token, token_type="refresh"))
+        self.assertFalse(RefreshToken.objects.filter(user=self.user).exists())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class LegacyRefreshTokenLookupTests(TestCase):
+    """
+    Перебор legacy-записей (PBKDF2) выключен по умолчанию и не делается для токенов нового формата.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, None)
+        # токен в формате до перехода на jti + HMAC: без поля "v", в БД — make_password-хэш
+        self.legacy_token = jwt.encode({
+            "user_id": self.user.id.int,
+            "is_manager": False,
+            "exp": int((timezone.now() + timedelta(days=1)).timestamp()),
+            "type": "refresh",
+            "jti": "3f1e1a52-6e8b-4cd5-9a37-1c1f0f7b7f10",
+        }, SECRET_KEY, algorithm=ALGORITHM)
+        RefreshToken.objects.create(
+            user=self.user, token=make_password(self.legacy_token), expires_at=timezone.now() + timedelta(days=1)
+        )
+
+    def test_lookup_is_disabled_by_default(self):
+        with mock.patch.object(services, "check_password") as check_password:
+            self.assertIsNone(verify_token(self.legacy_token, token_type="refresh"))
+        check_password.assert_not_called()
+
+    def test_new_format_miss_does_not_scan_legacy_records(self):
+        token = create_refresh_token(self.user.id.int, False)
+        RefreshToken.objects.filter(jti__isnull=False).delete()
+
+        with override_settings(REFRESH_TOKEN_LEGACY_LOOKUP=True), \
+                mock.patch.object(services, "check_password") as check_password:
+            self.assertIsNone(verify_token(token, token_type="refresh"))
+        check_password.assert_not_called()
+
+    @override_settings(REFRESH_TOKEN_LEGACY_LOOKUP=True)
+    def test_legacy_token_is_migrated_on_first_use(self):
+        self.assertIsNotNone(verify_token(self.legacy_token, token_type="refresh"))
+
+        record = RefreshToken.objects.get(user=self.user)
+        self.assertIsNotNone(record.jti)
+        with mock.patch.object(services, "check_password") as check_password:
+            self.assertIsNotNone(verify_token(self.legacy_token, token_type="refresh"))
+        check_password.assert_not_called()
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AccessTokenCacheTests(TestCase):
+    """
+    Кэш проверенных access-токенов: попадание не декодирует JWT и не ходит в денайлист,
+    отзыв (выход, смена пароля, другой процесс) действует и на закэшированные токены.
+    """
+
+    def setUp(self):
+        token_cache.clear()
+        caches[token_cache.denylist_alias].clear()
+        self.user = User.objects.create_user("employee", None, "password")
+        self.access = create_access_token(self.user.id.int, False)
+
+    def _hello(self, access=None):
+        return self.client.get("/api/auth/hello", HTTP_AUTHORIZATION=f"Bearer {access or self.access}")
+
+    def test_hit_skips_decode_and_denylist(self):
+        self.assertIsNotNone(verify_access_token(self.access))
+        hits, checks = token_cache.hits, token_cache.revocation_checks
+
+        with mock.patch.object(token_cache_module, "verify_token") as decode:
+            for _ in range(5):
+                self.assertEqual(verify_access_token(self.access)["user_id"], self.user.id.int)
+        decode.assert_not_called()
+        self.assertEqual(token_cache.hits, hits + 5)
+        self.assertEqual(token_cache.revocation_checks, checks)
+
+    def test_invalid_token_is_not_cached(self):
+        self.assertIsNone(verify_access_token(self.access + "x"))
+        self.assertEqual(token_cache.stats()["size"], 0)
+
+    def test_logout_revokes_cached_access_and_refresh_tokens(self):
+        refresh = create_refresh_token(self.user.id.int, False)
+        self.assertEqual(self._hello().status_code, 200)
+
+        self.client.cookies["refresh_token"] = refresh
+        response = self.client.post("/api/auth/logout", HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self._hello().status_code, 401)
+        self.client.cookies["refresh_token"] = refresh
+        self.assertEqual(self.client.get("/api/auth/refresh").status_code, 401)
+
+    def test_change_password_revokes_existing_tokens(self):
+        refresh = create_refresh_token(self.user.id.int, False)
+        self.assertEqual(self._hello().status_code, 200)
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access}"}
+
+        wrong = self.client.post("/api/auth/change_password", {"old_password": "wrong", "new_password": "new"},
+                                 content_type="application/json", **headers)
+        self.assertEqual(wrong.status_code, 400)
+        self.assertEqual(self._hello().status_code, 200)
+
+        changed = self.client.post("/api/auth/change_password", {"old_password": "password", "new_password": "new"},
+                                   content_type="application/json", **headers)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(self._hello().status_code, 401)
+        self.client.cookies["refresh_token"] = refresh
+        self.assertEqual(self.client.get("/api/auth/refresh").status_code, 401)
+
+        login = self.client.post("/api/auth/login", {"username": "employee", "password": "new"},
+                                 content_type="application/json")
+        self.assertEqual(login.status_code, 200)
+        self.assertEqual(self._hello(login.json()["access"]).status_code, 200)
+
+    def test_revocation_from_another_process_applies_after_generation_check(self):
+        self.assertIsNotNone(verify_access_token(self.access))
+        # другой воркер со своим локальным кэшем, но общим денайлистом
+        VerifiedTokenCache(denylist_alias=token_cache.denylist_alias).revoke_user(self.user.id.int)
+
+        with mock.patch.object(token_cache, "generation_interval", 0):
+            self.assertIsNone(verify_access_token(self.access))
+
+    def test_stats_are_exposed_to_staff_only(self):
+        self.assertEqual(self._hello().status_code, 200)
+        self.assertEqual(self.client.get("/api/auth/token_cache_stats",
+                                         HTTP_AUTHORIZATION=f"Bearer {self.access}").status_code, 403)
+
+        staff = User.objects.create_user("admin", None, None, is_staff=True)
+        response = self.client.get("/api/auth/token_cache_stats",
+                                   HTTP_AUTHORIZATION=f"Bearer {create_access_token(staff.id.int, False)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.json()["hits"], 1)
+        self.assertIn("hit_rate", response.json())
+
+
+class PasswordHashingPoolTests(TestCase):
+    """
+    Пул хэширования принимает не больше max_workers + max_pending задач, остальным — HashingPoolBusy.
+    """
+
+    def test_full_pool_rejects_immediately(self):
+        pool = PasswordHashingPool(max_workers=1, max_pending=1, retry_after=3)
+        release = threading.Event()
+
+        async def scenario():
+            running = [asyncio.ensure_future(pool.run(release.wait, 5)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(HashingPoolBusy) as busy:
+                await pool.run(lambda: None)
+            release.set()
+            await asyncio.gather(*running)
+            return busy.exception.retry_after, await pool.run(lambda: "done")
+
+        self.assertEqual(asyncio.run(scenario()), (3, "done"))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AsyncAuthEndpointTests(TransactionTestCase):
+    """
+    Асинхронные /login и /refresh: работа в пуле хэширования и 429 с Retry-After при перегрузке.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, "password")
+        self.client = AsyncClient()
+
+    def _login(self):
+        return asyncio.run(self.client.post(
+            "/api/auth/async/login", {"username": "employee", "password": "password"}, content_type="application/json"
+        ))
+
+    def test_login_and_refresh(self):
+        login = self._login()
+        self.assertEqual(login.status_code, 200)
+        self.assertEqual(login.json()["username"], "employee")
+
+        self.client.cookies["refresh_token"] = login.cookies["refresh_token"].value
+        refreshed = asyncio.run(self.client.get("/api/auth/async/refresh"))
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertIn("access", refreshed.json())
+
+    def test_wrong_password_is_401(self):
+        response = asyncio.run(self.client.post(
+            "/api/auth/async/login", {"username": "employee", "password": "wrong"}, content_type="application/json"
+        ))
+        self.assertEqual(response.status_code, 401)
+
+    def test_busy_pool_returns_429_with_retry_after(self):
+        pool = PasswordHashingPool(max_workers=1, max_pending=0, retry_after=7)
+        pool._slots.acquire()
+        with mock.patch.object(views, "hashing_pool", pool):
+            response = self._login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+
+
+class PurgeExpiredRefreshTokensTests(TestCase):
+    """
+    Уборка истёкших refresh-токенов пачками: живые токены не трогаются.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user("employee", None, None)
+        now = timezone.now()
+        for index in range(7):
+            RefreshToken.objects.create(user=self.user, token=f"expired-{index}",
+                                        expires_at=now - timedelta(minutes=index + 1))
+        for index in range(2):
+            RefreshToken.objects.create(user=self.user, token=f"alive-{index}", expires_at=now + timedelta(days=1))
+
+    def _tokens(self):
+        return set(RefreshToken.objects.values_list("token", flat=True))
+
+    def test_deletes_expired_tokens_in_batches(self):
+        stats = purge_expired_refresh_tokens(batch_size=3)
+
+        self.assertEqual(stats["deleted"], 7)
+        self.assertEqual(stats["batches"], 3)
+        self.assertEqual(self._tokens(), {"alive-0", "alive-1"})
+        self.assertEqual(purge_expired_refresh_tokens(batch_size=3)["deleted"], 0)
+
+    def test_exact_multiple_of_batch_size_stops_on_empty_batch(self):
+        stats = purge_expired_refresh_tokens(batch_size=7)
+        self.assertEqual((stats["deleted"], stats["batches"]), (7, 1))
+
+    def test_max_seconds_stops_after_current_batch(self):
+        stats = purge_expired_refresh_tokens(batch_size=2, max_seconds=0)
+
+        self.assertEqual((stats["deleted"], stats["batches"]), (2, 1))
+        self.assertEqual(len(self._tokens()), 7)
+
+    def test_command_reports_stats(self):
+        out = StringIO()
+        call_command("purge_refresh_tokens", "--batch-size", "4", "--pause", "0", stdout=out)
+        self.assertIn("deleted=7 batches=2", out.getvalue())
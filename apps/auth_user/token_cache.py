@@ -0,0 +1,199 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from apps.auth_user.models import User
+from apps.auth_user.services import ACCESS_TOKEN_EXPIRE_MINUTES, verify_token
+
+REVOKED_JTI_KEY = "auth:revoked_jti:{jti}"
+REVOKED_USER_KEY = "auth:revoked_user:{user_id}"
+# счётчик поколений отзыва: увеличивается при каждой записи в денайлист
+REVOCATION_GENERATION_KEY = "auth:revocation_generation"
+
+
+class VerifiedTokenCache:
+    """
+    LRU-кэш проверенных payload access-токенов внутри процесса.
+
+    Ключ — SHA-256 от токена, запись живёт не дольше exp токена и не дольше max_ttl.
+    Кэш payload локален для процесса (воркера). Отзыв (по jti или всех токенов
+    пользователя) хранится в общем бэкенде CACHES, чтобы отзыв в одном воркере
+    действовал во всех. Каждый отзыв увеличивает общий счётчик поколений; процесс
+    читает его не чаще раза в generation_interval секунд, а денайлист для токена из кэша
+    проверяет, только если поколение изменилось с прошлой проверки этого токена.
+    Поэтому попадание в кэш обычно не ходит в общий кэш, а отзыв действует
+    не позже чем через generation_interval секунд.
+    """
+
+    def __init__(self, max_size: int = 10000, max_ttl: int = 300, denylist_alias: str = "default",
+                 generation_interval: float = 1.0):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.denylist_alias = denylist_alias
+        self.generation_interval = generation_interval
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[bytes, list] = OrderedDict()
+        self._generation = 0
+        self._generation_read_at = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revocation_checks = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> tuple[dict, int] | None:
+        """
+        Payload из кэша и поколение отзыва, при котором он последний раз сверялся с денайлистом.
+        """
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, token: str, payload: dict, generation: int) -> None:
+        expires_at = min(payload.get("exp", 0), time.time() + self.max_ttl)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = [expires_at, payload, generation]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def mark_checked(self, token: str, generation: int) -> None:
+        with self._lock:
+            entry = self._entries.get(self._key(token))
+            if entry is not None:
+                entry[2] = generation
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    @property
+    def denylist(self):
+        return caches[self.denylist_alias]
+
+    def generation(self) -> int:
+        """
+        Текущее поколение отзыва; общий кэш читается не чаще раза в generation_interval секунд.
+        """
+        now = time.monotonic()
+        if now - self._generation_read_at >= self.generation_interval:
+            self._generation = self.denylist.get(REVOCATION_GENERATION_KEY, 0)
+            self._generation_read_at = now
+        return self._generation
+
+    def _bump_generation(self) -> None:
+        self.denylist.add(REVOCATION_GENERATION_KEY, 0, timeout=None)
+        self.denylist.incr(REVOCATION_GENERATION_KEY)
+        # свой процесс видит отзыв сразу
+        self._generation_read_at = float("-inf")
+
+    @staticmethod
+    def _user_key(user_id) -> str:
+        # в access-токене id — число, в остальном коде — UUID: приводим к одному виду
+        return REVOKED_USER_KEY.format(user_id=User._meta.pk.to_python(user_id))
+
+    def is_revoked(self, payload: dict) -> bool:
+        self.revocation_checks += 1
+        keys = [self._user_key(payload.get("user_id"))]
+        jti = payload.get("jti")
+        if jti is not None:
+            keys.append(REVOKED_JTI_KEY.format(jti=jti))
+        revoked = self.denylist.get_many(keys)
+        if len(keys) > 1 and keys[1] in revoked:
+            return True
+        revoked_at = revoked.get(keys[0])
+        return revoked_at is not None and payload.get("iat", 0) <= revoked_at
+
+    def revoke(self, jti: str, exp: float) -> None:
+        # запись нужна только до истечения самого токена
+        timeout = max(1, int(exp - time.time()) + 1)
+        self.denylist.set(REVOKED_JTI_KEY.format(jti=jti), True, timeout=timeout)
+        self._bump_generation()
+
+    def revoke_user(self, user_id) -> None:
+        # после максимального срока жизни access-токена запись отзыва больше не нужна
+        self.denylist.set(self._user_key(user_id), time.time(), timeout=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+        self._bump_generation()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self._generation_read_at = float("-inf")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "revocation_checks": self.revocation_checks,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+token_cache = VerifiedTokenCache(
+    max_size=getattr(settings, "ACCESS_TOKEN_CACHE_SIZE", 10000),
+    max_ttl=getattr(settings, "ACCESS_TOKEN_CACHE_TTL", 300),
+    denylist_alias=getattr(settings, "ACCESS_TOKEN_DENYLIST_CACHE_ALIAS", "default"),
+    generation_interval=getattr(settings, "ACCESS_TOKEN_REVOCATION_CHECK_INTERVAL", 1.0),
+)
+
+
+def verify_access_token(token: str) -> dict | None:
+    """
+    Проверяет access-токен, используя кэш уже проверенных payload.
+    """
+    # поколение читается до сверки с денайлистом: отзыв, записанный позже, его увеличит
+    generation = token_cache.generation()
+    cached = token_cache.get(token)
+    if cached is None:
+        payload = verify_token(token, token_type="access")
+        if payload is None or token_cache.is_revoked(payload):
+            return None
+        token_cache.put(token, payload, generation)
+        return payload
+
+    payload, checked_generation = cached
+    if checked_generation != generation:
+        if token_cache.is_revoked(payload):
+            token_cache.discard(token)
+            return None
+        token_cache.mark_checked(token, generation)
+    return payload
+
+
+def revoke_access_token(payload: dict) -> None:
+    """
+    Отзывает конкретный access-токен до истечения его срока.
+    """
+    if payload.get("jti"):
+        token_cache.revoke(payload["jti"], payload.get("exp", time.time()))
+    else:
+        token_cache.revoke_user(payload["user_id"])
+
+
+def revoke_user_access_tokens(user_id) -> None:
+    """
+    Отзывает все access-токены пользователя, выданные до текущего момента.
+    """
+    token_cache.revoke_user(user_id)
@@ -4,24 +4,18 @@ from django.contrib.auth import get_user_model
 from ninja.responses import Response
 from django.conf import settings
 
+from apps.auth_user.hashing import hashing_pool, HashingPoolBusy
 from apps.auth_user.permissions import JWTAuth
-from apps.auth_user.schemas import UserCreateSchema, LoginResponse
+from apps.auth_user.schemas import UserCreateSchema, LoginResponse, ChangePasswordIn
 from apps.auth_user.services import create_access_token, create_refresh_token, authenticate_user, verify_token, \
-    REFRESH_TOKEN_EXPIRE_DAYS
+    revoke_refresh_token, revoke_all_refresh_tokens, REFRESH_TOKEN_EXPIRE_DAYS
+from apps.auth_user.token_cache import revoke_access_token, token_cache
 from ninja.errors import HttpError
 
 User = get_user_model()
 router = Router(tags=["Authentication(Аутентификация)"])
 
-@router.post("/register", response=dict)
-def register(request, data: UserCreateSchema):
-    """
-    Регистрирует нового пользователя.
-
-    - Проверяет уникальность username и email (если указан).
-    - Создаёт пользователя с указанными данными.
-    - Если указан is_manager = true то пользователю выдается роль менеджера.
-    """
+def _register_user(data: UserCreateSchema):
     user = User.objects.filter(
         Q(username=data.username) |
         (Q(email=data.email) & ~Q(email__isnull=True) & ~Q(email=""))
@@ -37,6 +31,63 @@ def register(request, data: UserCreateSchema):
     )
     return {"message": "Пользователь успешно зарегистрирован"}
 
+def _login_user(username: str, password: str):
+    user = authenticate_user(username, password)
+    if not user:
+        raise HttpError(401, "Invalid credentials")
+
+    access = create_access_token(user.id.int, user.is_manager)
+    refresh = create_refresh_token(user.id.int, user.is_manager)
+    return user, access, refresh
+
+def _rotate_refresh_token(refresh_token_from_cookies: str):
+    payload = verify_token(refresh_token_from_cookies, token_type="refresh")
+    if not payload:
+        raise HttpError(401, "Invalid refresh token")
+
+    access = create_access_token(payload['user_id'], payload['is_manager'])
+    new_refresh = create_refresh_token(payload['user_id'], payload['is_manager'], replace_token=refresh_token_from_cookies)
+    if not new_refresh:
+        raise HttpError(401, "Invalid refresh token")
+    return access, new_refresh
+
+def _set_refresh_cookie(response, refresh: str):
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh,
+        httponly=True,
+        secure=not settings.DEBUG,
+        samesite="Strict",
+        max_age=REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    )
+
+def _login_response(user, access: str, refresh: str):
+    response = Response({
+        "access": access,
+        "userId": user.id,
+        "username": user.__str__(),
+        "fullname": user.full_name,
+        "is_manager": user.is_manager,
+    })
+    _set_refresh_cookie(response, refresh)
+    return response
+
+def _busy_response(exc: HashingPoolBusy):
+    response = Response({"detail": "Сервер перегружен, повторите запрос позже"}, status=429)
+    response["Retry-After"] = str(exc.retry_after)
+    return response
+
+@router.post("/register", response=dict)
+def register(request, data: UserCreateSchema):
+    """
+    Регистрирует нового пользователя.
+
+    - Проверяет уникальность username и email (если указан).
+    - Создаёт пользователя с указанными данными.
+    - Если указан is_manager = true то пользователю выдается роль менеджера.
+    """
+    return _register_user(data)
+
 @router.post("/login", response=LoginResponse)
 def login(request, data: UserCreateSchema):
     """
@@ -54,30 +105,8 @@ def login(request, data: UserCreateSchema):
     - `fullname` — полное имя.
     - `is_manager` — флаг, является ли пользователь руководителем.
     """
-    user = authenticate_user(data.username, data.password)
-    if not user:
-        raise HttpError(401, "Invalid credentials")
-
-    access = create_access_token(user.id.int, user.is_manager)
-    refresh = create_refresh_token(user.id.int, user.is_manager)
-
-    response = Response({
-        "access": access,
-        "userId": user.id,
-        "username": user.__str__(),
-        "fullname": user.full_name,
-        "is_manager": user.is_manager,
-    })
-
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh,
-        httponly=True,
-        secure=not settings.DEBUG,
-        samesite="Strict",
-        max_age=REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-    )
-    return response
+    user, access, refresh = _login_user(data.username, data.password)
+    return _login_response(user, access, refresh)
 
 @router.get("/refresh")
 def refresh_token(request):
@@ -92,22 +121,104 @@ def refresh_token(request):
     if not refresh_token_from_cookies:
         raise HttpError(401, "No refresh token")
 
-    payload = verify_token(refresh_token_from_cookies, token_type="refresh")
-    if not payload:
-        raise HttpError(401, "Invalid refresh token")
+    access, new_refresh = _rotate_refresh_token(refresh_token_from_cookies)
 
-    access = create_access_token(payload['user_id'], payload['is_manager'])
-    new_refresh = create_refresh_token(payload['user_id'], payload['is_manager'], replace_token=refresh_token_from_cookies)
+    response = Response({"access": access})
+    _set_refresh_cookie(response, new_refresh)
+    return response
+
+@router.post("/logout", auth=JWTAuth(), response=dict)
+def logout(request):
+    """
+    Выход из текущей сессии.
+
+    - Отзывает access-токен запроса и refresh-токен из cookies.
+    - Удаляет refresh_token из cookies.
+    """
+    revoke_access_token(request.auth)
+    refresh_token_from_cookies = request.COOKIES.get("refresh_token")
+    if refresh_token_from_cookies:
+        revoke_refresh_token(refresh_token_from_cookies)
+
+    response = Response({"message": "Вы вышли из системы"})
+    response.delete_cookie("refresh_token")
+    return response
+
+@router.post("/change_password", auth=JWTAuth(), response=dict)
+def change_password(request, data: ChangePasswordIn):
+    """
+    Смена пароля.
+
+    - Проверяет текущий пароль.
+    - Отзывает все refresh- и access-токены пользователя: после смены нужно войти заново.
+    """
+    user = User.objects.filter(id=request.auth["user_id"]).first()
+    if not user or not user.check_password(data.old_password):
+        raise HttpError(400, "Неверный текущий пароль")
+    user.set_password(data.new_password)
+    user.save(update_fields=["password"])
+    revoke_all_refresh_tokens(user.id)
+
+    response = Response({"message": "Пароль изменён, войдите заново"})
+    response.delete_cookie("refresh_token")
+    return response
+
+@router.get("/token_cache_stats", auth=JWTAuth(), response=dict)
+def token_cache_stats(request):
+    """
+    Счётчики кэша проверенных access-токенов текущего процесса (только для staff):
+    размер, попадания, промахи, вытеснения, проверки денайлиста, доля попаданий.
+    """
+    if not User.objects.filter(id=request.auth["user_id"], is_staff=True).exists():
+        raise HttpError(403, "No permission")
+    return token_cache.stats()
+
+@router.post("/async/register", response=dict)
+async def register_async(request, data: UserCreateSchema):
+    """
+    Асинхронная версия /register.
+
+    - Хэширование пароля выполняется в ограниченном пуле потоков, event loop не блокируется.
+    - Если пул заполнен — сразу возвращается 429 с заголовком Retry-After.
+    """
+    try:
+        return await hashing_pool.run(_register_user, data)
+    except HashingPoolBusy as exc:
+        return _busy_response(exc)
+
+@router.post("/async/login", response=LoginResponse)
+async def login_async(request, data: UserCreateSchema):
+    """
+    Асинхронная версия /login.
+
+    - Проверка пароля (PBKDF2) выполняется в ограниченном пуле потоков.
+    - Если пул заполнен — сразу возвращается 429 с заголовком Retry-After.
+    """
+    try:
+        user, access, refresh = await hashing_pool.run(_login_user, data.username, data.password)
+    except HashingPoolBusy as exc:
+        return _busy_response(exc)
+    return _login_response(user, access, refresh)
+
+@router.get("/async/refresh")
+async def refresh_token_async(request):
+    """
+    Асинхронная версия /refresh.
+
+    - Проверка и ротация refresh-токена (включая сверку legacy-хэшей) выполняется в ограниченном пуле потоков.
+    - Если пул заполнен — сразу возвращается 429 с заголовком Retry-After.
+    """
+    refresh_token_from_cookies = request.COOKIES.get("refresh_token")
+    if not refresh_token_from_cookies:
+        raise HttpError(401, "No refresh token")
+
+    try:
+        access, new_refresh = await hashing_pool.run(_rotate_refresh_token, refresh_token_from_cookies)
+    except HashingPoolBusy as exc:
+        return _busy_response(exc)
 
     response = Response({"access": access})
-    response.set_cookie(
-        key="refresh_token",
-        value=new_refresh,
-        httponly=True,
-        secure=not settings.DEBUG,
-        samesite="Strict",
-        max_age=REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60,
-    )
+    _set_refresh_cookie(response, new_refresh)
     return response
 
 
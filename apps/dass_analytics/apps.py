@@ -1,4 +1,7 @@
 from django.apps import AppConfig
 
 class DassAnalyticsConfig(AppConfig):
-    name = 'apps.dass_analytics'
\ No newline at end of file
+    name = 'apps.dass_analytics'
+
+    def ready(self):
+        from . import receivers  # noqa: F401
@@ -0,0 +1,126 @@
+import functools
+import hashlib
+import json
+import time
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from pydantic import BaseModel
+
+from apps.auth_user.models import User
+
+VERSION_KEY = "dass_analytics:version:{manager_id}"
+RESPONSE_KEY = "dass_analytics:response:{manager_id}:{version}:{endpoint}:{params}"
+LOCK_KEY = "dass_analytics:lock:{key}"
+
+
+class AnalyticsCache:
+    """
+    Кэш ответов аналитики руководителя с версионированием данных.
+
+    Ключ ответа включает версию данных руководителя; версия увеличивается при сохранении
+    результатов DASS-9 и изменениях состава команд, поэтому старые ответы просто
+    перестают читаться и вытесняются по timeout.
+    Одновременные промахи по одному ключу вычисляются один раз (single-flight через cache.add).
+    """
+
+    def __init__(self, alias: str = "default", timeout: int = 300, lock_timeout: int = 30,
+                 poll_interval: float = 0.05):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _manager_key(manager_id) -> str:
+        # в токене id — число, в сигналах — UUID: приводим к одному виду
+        return str(User._meta.pk.to_python(manager_id))
+
+    def get_version(self, manager_id) -> int:
+        key = VERSION_KEY.format(manager_id=self._manager_key(manager_id))
+        version = self.cache.get(key)
+        if version is None:
+            # версия не должна совпасть с уже вытесненной — берём текущее время
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def bump_versions(self, manager_ids: Iterable) -> None:
+        for manager_id in {m for m in manager_ids if m}:
+            key = VERSION_KEY.format(manager_id=self._manager_key(manager_id))
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.add(key, time.time_ns(), timeout=None)
+
+    @staticmethod
+    def _params_hash(params: dict) -> str:
+        def default(value):
+            if isinstance(value, BaseModel):
+                return value.model_dump()
+            return str(value)
+
+        raw = json.dumps(params, sort_keys=True, default=default)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get_or_compute(self, manager_id, endpoint: str, params: dict, compute):
+        key = RESPONSE_KEY.format(
+            manager_id=self._manager_key(manager_id),
+            version=self.get_version(manager_id),
+            endpoint=endpoint,
+            params=self._params_hash(params),
+        )
+        cache = self.cache
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        lock_key = LOCK_KEY.format(key=key)
+        deadline = time.monotonic() + self.lock_timeout
+        while not cache.add(lock_key, 1, timeout=self.lock_timeout):
+            # ключ уже вычисляет другой запрос — ждём его результат
+            time.sleep(self.poll_interval)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if time.monotonic() >= deadline:
+                return compute()
+
+        try:
+            value = cache.get(key)
+            if value is None:
+                value = compute()
+                cache.set(key, value, timeout=self.timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+
+analytics_cache = AnalyticsCache(
+    alias=getattr(settings, "DASS_ANALYTICS_CACHE_ALIAS", "default"),
+    timeout=getattr(settings, "DASS_ANALYTICS_CACHE_TIMEOUT", 300),
+    lock_timeout=getattr(settings, "DASS_ANALYTICS_CACHE_LOCK_TIMEOUT", 30),
+)
+
+
+def cached_analytics(endpoint: str):
+    """
+    Декоратор view руководителя: кэширует результат по (руководитель, endpoint, параметры, версия данных).
+    """
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            return analytics_cache.get_or_compute(
+                request.auth["user_id"], endpoint, kwargs,
+                lambda: view_func(request, *args, **kwargs),
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from apps.dass_analytics.models import CalendarDay
+
+PERIODS = ("day", "week", "month", "quarter", "year")
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _period_of(day: date, period: str) -> Tuple[int, date, date]:
+    """
+    Ключ и границы периода, в который попадает дата.
+    """
+    if period == "day":
+        return day.toordinal(), day, day
+    if period == "week":
+        start = day - timedelta(days=day.weekday())
+        # date(1, 1, 1) — понедельник с ordinal 1
+        return (start.toordinal() - 1) // 7, start, start + timedelta(days=6)
+    if period == "month":
+        start = day.replace(day=1)
+        return day.year * 12 + day.month - 1, start, _add_months(start, 1) - timedelta(days=1)
+    if period == "quarter":
+        start = date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+        return day.year * 4 + (day.month - 1) // 3, start, _add_months(start, 3) - timedelta(days=1)
+    if period == "year":
+        return day.year, date(day.year, 1, 1), date(day.year, 12, 31)
+    raise ValueError("Invalid period")
+
+
+class Calendar:
+    """
+    Календарное измерение в памяти: массив дней диапазона и границы периодов по ключам.
+    Ключ периода даты и границы периода по ключу находятся за O(1).
+    """
+
+    def __init__(self, start: date, end: date):
+        self.start = start
+        self.end = end
+        self._keys: List[Tuple[int, ...]] = []
+        self._bounds: Dict[str, Dict[int, Tuple[date, date]]] = {period: {} for period in PERIODS}
+
+        day = start
+        while day <= end:
+            keys = []
+            for period in PERIODS:
+                key, period_start, period_end = _period_of(day, period)
+                keys.append(key)
+                self._bounds[period].setdefault(key, (period_start, period_end))
+            self._keys.append(tuple(keys))
+            day += timedelta(days=1)
+
+    def key(self, day: date, period: str) -> int:
+        index = (day - self.start).days
+        if not 0 <= index < len(self._keys):
+            raise ValueError(f"Дата {day} вне календаря {self.start}..{self.end}")
+        return self._keys[index][PERIODS.index(period)]
+
+    def bounds(self, period: str, key: int) -> Tuple[date, date]:
+        try:
+            return self._bounds[period][key]
+        except KeyError:
+            raise ValueError(f"Период {period}={key} вне календаря {self.start}..{self.end}")
+
+    def period(self, day: date, period: str, offset: int = 0) -> Tuple[date, date]:
+        """
+        Границы периода, отстоящего на offset периодов назад от периода даты.
+        """
+        return self.bounds(period, self.key(day, period) - offset)
+
+    def rows(self) -> Iterator[CalendarDay]:
+        day = self.start
+        while day <= self.end:
+            values = {"date": day}
+            for period in PERIODS:
+                key, period_start, period_end = _period_of(day, period)
+                values[f"{period}_key"] = key
+                if period != "day":
+                    values[f"{period}_start"] = period_start
+                    values[f"{period}_end"] = period_end
+            iso_year, iso_week, _ = day.isocalendar()
+            yield CalendarDay(iso_year=iso_year, iso_week=iso_week, **values)
+            day += timedelta(days=1)
+
+
+calendar = Calendar(
+    start=date.fromisoformat(getattr(settings, "DASS_CALENDAR_START", "2000-01-01")),
+    end=date.fromisoformat(getattr(settings, "DASS_CALENDAR_END", "2050-12-31")),
+)
+
+
+def load_calendar(batch_size: int = 2000) -> int:
+    """
+    Загружает календарное измерение в таблицу (идемпотентно: существующие даты пропускаются).
+    """
+    with transaction.atomic():
+        CalendarDay.objects.filter(date__lt=calendar.start).delete()
+        CalendarDay.objects.filter(date__gt=calendar.end).delete()
+        CalendarDay.objects.bulk_create(calendar.rows(), batch_size=batch_size, ignore_conflicts=True)
+    return CalendarDay.objects.count()
+
+
+def period_key_expression(period: str, relation: str = "calendar_day") -> F:
+    """
+    Ключ периода через связь relation с календарной таблицей (INNER JOIN по дате,
+    а не коррелированный подзапрос на каждую строку).
+    """
+    if period not in PERIODS:
+        raise ValueError("Invalid period")
+    return F(f"{relation}__{period}_key")
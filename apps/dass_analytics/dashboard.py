@@ -0,0 +1,108 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from ninja.errors import HttpError
+
+from apps.dass_analytics.cache import analytics_cache
+from apps.dass_analytics.services import StatisticsService
+from apps.manager.management.models import Team
+from apps.manager.management.services import Dass9TeamService
+
+PANELS = ("ips_overview", "test_count", "test_count_common", "all_teams_dass9_results")
+
+
+class DashboardService:
+    """
+    Сводный дашборд руководителя: панели считаются параллельно в отдельном пуле потоков.
+
+    У каждого потока своё соединение с БД, поэтому запросы панелей идут одновременно.
+    Каждая панель кэшируется отдельно (analytics_cache), так что при частичном
+    изменении набора panels посчитанные панели переиспользуются.
+    """
+
+    _executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, "DASS_DASHBOARD_WORKERS", 4),
+        thread_name_prefix="dass-dashboard",
+    )
+
+    @staticmethod
+    def _call(fn, *args, **kwargs):
+        # соединения потока пула живут по тем же правилам, что и в запросе
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    async def _run(fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            DashboardService._executor,
+            functools.partial(DashboardService._call, fn, *args, **kwargs),
+        )
+
+    @staticmethod
+    def _resolve_team(manager_id, team_id: Optional[str]) -> Optional[str]:
+        """
+        Проверяет один раз, что команда принадлежит руководителю.
+        """
+        if not team_id:
+            return None
+        try:
+            team = Team.objects.filter(id=team_id, manager_id=manager_id).values_list("id", flat=True).first()
+        except ValidationError:
+            team = None
+        if team is None:
+            raise HttpError(404, "Команда не найдена")
+        return str(team)
+
+    @staticmethod
+    def _panel(manager_id, panel: str, params: Dict):
+        def compute():
+            if panel == "ips_overview":
+                return StatisticsService.get_ips_overview(manager_id, period=params["period"])
+            if panel == "test_count":
+                return StatisticsService.get_test_count(
+                    manager_id, team_id=params["team_id"], period=params["period"], buckets=params["buckets"]
+                )
+            if panel == "test_count_common":
+                return StatisticsService.get_teams_test_comparison(manager_id, period=params["period"])
+            return Dass9TeamService.get_all_teams_results(manager_id, params["from_date"], params["to_date"])
+
+        return analytics_cache.get_or_compute(manager_id, f"dashboard:{panel}", params, compute)
+
+    @staticmethod
+    async def build(manager_id,
+                    panels: Iterable[str],
+                    period: str = "week",
+                    team_id: Optional[str] = None,
+                    buckets: int = 4,
+                    from_date: Optional[date] = None,
+                    to_date: Optional[date] = None) -> Dict[str, any]:
+        """
+        Возвращает выбранные панели одним ответом. Ошибка любой панели прерывает запрос.
+        """
+        team_id = await DashboardService._run(DashboardService._resolve_team, manager_id, team_id)
+        panel_params = {
+            "ips_overview": {"period": period},
+            "test_count": {"period": period, "team_id": team_id, "buckets": buckets},
+            "test_count_common": {"period": period},
+            "all_teams_dass9_results": {"from_date": from_date, "to_date": to_date},
+        }
+
+        panels = list(dict.fromkeys(panels))
+        try:
+            results = await asyncio.gather(*(
+                DashboardService._run(DashboardService._panel, manager_id, panel, panel_params[panel])
+                for panel in panels
+            ))
+        except ValueError as exc:
+            raise HttpError(400, str(exc))
+        return dict(zip(panels, results))
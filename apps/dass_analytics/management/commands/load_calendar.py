@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.dass_analytics.calendar import calendar, load_calendar
+
+
+class Command(BaseCommand):
+    help = "Загружает календарное измерение (ключи и границы недель, месяцев, кварталов, лет)"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = load_calendar()
+        self.stdout.write(
+            f"range={calendar.start}..{calendar.end} rows={rows} seconds={time.monotonic() - started:.3f}"
+        )
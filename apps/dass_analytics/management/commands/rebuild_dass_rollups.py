@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.dass_analytics.rollups import DailyRollupService
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дневные агрегаты DASS-9 по командам и руководителям с нуля"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = DailyRollupService.rebuild()
+        self.stdout.write(
+            f"team_rows={stats['team_rows']} manager_rows={stats['manager_rows']} "
+            f"seconds={time.monotonic() - started:.3f}"
+        )
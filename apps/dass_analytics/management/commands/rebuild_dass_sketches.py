@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.dass_analytics.sketches import SketchService
+
+
+class Command(BaseCommand):
+    help = "Пересобирает дневные HLL-скетчи участников команд по сырым результатам DASS-9"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = SketchService.rebuild()
+        self.stdout.write(f"sketches={stats['sketches']} seconds={time.monotonic() - started:.3f}")
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.dass_analytics.trends import TrendService
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает EWMA-тренды DASS-9 всех сотрудников по истории одним потоковым проходом"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = TrendService.rebuild()
+        self.stdout.write(f"states={stats['states']} seconds={time.monotonic() - started:.3f}")
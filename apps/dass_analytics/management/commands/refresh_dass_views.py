@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.dass_analytics.matviews import MaterializedViewService
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт (если нужно) и обновляет материализованные представления дашборда "
+        "через REFRESH MATERIALIZED VIEW CONCURRENTLY (только Postgres)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view", action="append", dest="views", default=None,
+                            help="Имя представления (можно несколько раз; по умолчанию — все)")
+        parser.add_argument("--interval", type=float, default=None,
+                            help="Если задан — обновлять каждые N секунд")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Материализованные представления поддерживаются только в Postgres")
+        views = options["views"]
+        unknown = set(views or ()) - set(MaterializedViewService.definitions())
+        if unknown:
+            raise CommandError(f"Неизвестные представления: {', '.join(sorted(unknown))}")
+
+        MaterializedViewService.create(views)
+        while True:
+            for name, seconds in MaterializedViewService.refresh(views).items():
+                self.stdout.write(f"{name}: refreshed seconds={seconds:.3f}")
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,136 @@
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.assessments.dass.models import Dass9Result
+from apps.auth_user.models import User
+from apps.dass_analytics.models import (
+    CalendarDay, ManagerDailyRollup, ManagerPeriodStats, MaterializedViewRefresh, NoTeamDailyStats,
+    TeamDailyRollup, TeamPeriodStats,
+)
+from apps.manager.management.models import TeamMembershipPeriod
+
+# периоды материализованных представлений; дни читаются прямо из дневных агрегатов
+MV_PERIODS = ("week", "month", "quarter", "year")
+
+
+def _table(model) -> str:
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _column(model, field: str) -> str:
+    return connection.ops.quote_name(model._meta.get_field(field).column)
+
+
+def _period_stats_sql(rollup_model, key_field: str) -> str:
+    calendar = _table(CalendarDay)
+    periods = ", ".join(
+        f"('{period}', c.{period}_key, c.{period}_start)" for period in MV_PERIODS
+    )
+    key = _column(rollup_model, key_field)
+    return (
+        f"SELECT r.{key}, p.period, p.period_key, MIN(p.period_start) AS period_start, "
+        f"SUM(r.test_count)::bigint AS test_count, "
+        f"SUM(r.depression_sum)::bigint AS depression_sum, "
+        f"SUM(r.stress_sum)::bigint AS stress_sum, "
+        f"SUM(r.anxiety_sum)::bigint AS anxiety_sum "
+        f"FROM {_table(rollup_model)} r "
+        f"JOIN {calendar} c ON c.date = r.date "
+        f"CROSS JOIN LATERAL (VALUES {periods}) AS p(period, period_key, period_start) "
+        f"WHERE r.test_count > 0 "
+        f"GROUP BY r.{key}, p.period, p.period_key"
+    )
+
+
+def _no_team_daily_sql() -> str:
+    results = _table(Dass9Result)
+    users = _table(User)
+    periods = _table(TeamMembershipPeriod)
+    user = _column(Dass9Result, "user")
+    manager = _column(User, "manager")
+    return (
+        f"SELECT u.{manager} AS manager_id, r.date, COUNT(*)::bigint AS test_count, "
+        f"SUM(r.depression_score)::bigint AS depression_sum, "
+        f"SUM(r.stress_score)::bigint AS stress_sum, "
+        f"SUM(r.anxiety_score)::bigint AS anxiety_sum "
+        f"FROM {results} r JOIN {users} u ON u.id = r.{user} "
+        f"WHERE u.{manager} IS NOT NULL AND NOT EXISTS ("
+        f"SELECT 1 FROM {periods} p WHERE p.{_column(TeamMembershipPeriod, 'user')} = r.{user} "
+        f"AND p.valid_from <= r.date AND (p.valid_to IS NULL OR p.valid_to > r.date)) "
+        f"GROUP BY u.{manager}, r.date"
+    )
+
+
+class MaterializedViewService:
+    """
+    Материализованные представления Postgres для тяжёлых запросов дашборда руководителя.
+
+    Создаются и обновляются (REFRESH ... CONCURRENTLY) командой refresh_dass_views.
+    Сервисы читают из них, только если последнее обновление не старше
+    DASS_ANALYTICS_MV_MAX_STALENESS секунд (0 или None — не использовать).
+    """
+
+    @staticmethod
+    def definitions() -> Dict[str, Dict[str, str]]:
+        return {
+            TeamPeriodStats._meta.db_table: {
+                "sql": _period_stats_sql(TeamDailyRollup, "team"),
+                "unique": "team_id, period, period_key",
+            },
+            ManagerPeriodStats._meta.db_table: {
+                "sql": _period_stats_sql(ManagerDailyRollup, "manager"),
+                "unique": "manager_id, period, period_key",
+            },
+            NoTeamDailyStats._meta.db_table: {
+                "sql": _no_team_daily_sql(),
+                "unique": "manager_id, date",
+            },
+        }
+
+    @staticmethod
+    def create(names: Optional[Iterable[str]] = None) -> None:
+        """
+        Создаёт представления и уникальные индексы (нужны для CONCURRENTLY), если их ещё нет.
+        """
+        definitions = MaterializedViewService.definitions()
+        with connection.cursor() as cursor:
+            for name in names or definitions:
+                definition = definitions[name]
+                view = connection.ops.quote_name(name)
+                cursor.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS {definition['sql']}")
+                cursor.execute(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {connection.ops.quote_name(name + '_uniq')} "
+                    f"ON {view} ({definition['unique']})"
+                )
+
+    @staticmethod
+    def refresh(names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Обновляет представления без блокировки чтения и записывает время обновления.
+        """
+        durations = {}
+        for name in names or MaterializedViewService.definitions():
+            refreshed_at = timezone.now()
+            started = time.monotonic()
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {connection.ops.quote_name(name)}")
+                durations[name] = time.monotonic() - started
+                MaterializedViewRefresh.objects.update_or_create(
+                    name=name, defaults={"refreshed_at": refreshed_at, "duration": durations[name]}
+                )
+        return durations
+
+    @staticmethod
+    def is_fresh(model) -> bool:
+        max_staleness = getattr(settings, "DASS_ANALYTICS_MV_MAX_STALENESS", None)
+        if not max_staleness or connection.vendor != "postgresql":
+            return False
+        return MaterializedViewRefresh.objects.filter(
+            name=model._meta.db_table,
+            refreshed_at__gte=timezone.now() - timedelta(seconds=max_staleness),
+        ).exists()
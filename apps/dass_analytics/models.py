@@ -0,0 +1,191 @@
+from django.db import models
+from django.conf import settings
+
+from apps.manager.management.models import Team
+
+
+class DailyRollup(models.Model):
+    """
+    Суммы, суммы квадратов и количество результатов DASS-9 за день.
+    Среднее = sum / test_count, дисперсия = sq_sum / test_count - среднее².
+    """
+    date = models.DateField(verbose_name="Дата")
+    # связь по дате без столбца и внешнего ключа: ключи периодов берутся JOIN'ом календаря
+    calendar_day = models.ForeignObject(
+        "dass_analytics.CalendarDay", on_delete=models.DO_NOTHING, from_fields=["date"], to_fields=["date"],
+        related_name="+",
+    )
+    # не Positive: при вычитании во вставляемой строке UPSERT временно отрицательные значения
+    test_count = models.IntegerField(default=0, verbose_name="Количество прохождений")
+    depression_sum = models.BigIntegerField(default=0)
+    depression_sq_sum = models.BigIntegerField(default=0)
+    stress_sum = models.BigIntegerField(default=0)
+    stress_sq_sum = models.BigIntegerField(default=0)
+    anxiety_sum = models.BigIntegerField(default=0)
+    anxiety_sq_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class TeamDailyRollup(DailyRollup):
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="daily_rollups")
+
+    class Meta:
+        unique_together = ("team", "date")
+        verbose_name = "Дневной агрегат DASS-9 по команде"
+
+
+class ManagerDailyRollup(DailyRollup):
+    manager = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="dass_daily_rollups"
+    )
+
+    class Meta:
+        unique_together = ("manager", "date")
+        verbose_name = "Дневной агрегат DASS-9 по руководителю"
+
+
+class TeamDailySketch(models.Model):
+    """
+    HyperLogLog-скетч сотрудников команды, прошедших тест за день (регистры, сжатые zlib).
+    Скетчи объединяются поэлементным максимумом, поэтому уникальных участников
+    за любой диапазон дней можно оценить без повторного чтения результатов.
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="daily_sketches")
+    date = models.DateField(verbose_name="Дата")
+    # связь по дате без столбца и внешнего ключа: ключи периодов берутся JOIN'ом календаря
+    calendar_day = models.ForeignObject(
+        "dass_analytics.CalendarDay", on_delete=models.DO_NOTHING, from_fields=["date"], to_fields=["date"],
+        related_name="+",
+    )
+    sketch = models.BinaryField()
+
+    class Meta:
+        unique_together = ("team", "date")
+        verbose_name = "Дневной HLL-скетч участников команды"
+
+
+class EmployeeTrendState(models.Model):
+    """
+    Скользящее состояние сотрудника: экспоненциально взвешенные среднее и дисперсия
+    по каждой подшкале и z-оценка последнего результата относительно предыдущего состояния.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="dass_trend_state"
+    )
+    results_count = models.PositiveIntegerField(default=0)
+    last_date = models.DateField(verbose_name="Дата последнего результата")
+    depression_mean = models.FloatField(default=0)
+    depression_var = models.FloatField(default=0)
+    depression_z = models.FloatField(null=True, blank=True)
+    stress_mean = models.FloatField(default=0)
+    stress_var = models.FloatField(default=0)
+    stress_z = models.FloatField(null=True, blank=True)
+    anxiety_mean = models.FloatField(default=0)
+    anxiety_var = models.FloatField(default=0)
+    anxiety_z = models.FloatField(null=True, blank=True)
+    # наибольшая из z-оценок последнего результата (рост баллов — ухудшение)
+    max_z = models.FloatField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Тренд DASS-9 сотрудника"
+
+
+class CalendarDay(models.Model):
+    """
+    Календарное измерение: для каждой даты — ключи и границы её недели (ISO), месяца,
+    квартала и года. Ключи — последовательные целые, соседние периоды отличаются на 1.
+    """
+    date = models.DateField(primary_key=True)
+    day_key = models.IntegerField(unique=True)
+    iso_year = models.PositiveSmallIntegerField()
+    iso_week = models.PositiveSmallIntegerField()
+    week_key = models.IntegerField(db_index=True)
+    week_start = models.DateField()
+    week_end = models.DateField()
+    month_key = models.IntegerField(db_index=True)
+    month_start = models.DateField()
+    month_end = models.DateField()
+    quarter_key = models.IntegerField(db_index=True)
+    quarter_start = models.DateField()
+    quarter_end = models.DateField()
+    year_key = models.IntegerField(db_index=True)
+    year_start = models.DateField()
+    year_end = models.DateField()
+
+    class Meta:
+        verbose_name = "Календарный день"
+
+
+class PeriodStats(models.Model):
+    """
+    Строка материализованного представления: суммы дневных агрегатов за неделю,
+    месяц, квартал или год (ключи — из календарного измерения).
+    """
+    period = models.CharField(max_length=10)
+    period_key = models.IntegerField()
+    period_start = models.DateField()
+    test_count = models.BigIntegerField()
+    depression_sum = models.BigIntegerField()
+    stress_sum = models.BigIntegerField()
+    anxiety_sum = models.BigIntegerField()
+
+    class Meta:
+        abstract = True
+
+
+class TeamPeriodStats(PeriodStats):
+    pk = models.CompositePrimaryKey("team", "period", "period_key")
+    team = models.ForeignKey(Team, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+
+    class Meta:
+        managed = False
+        db_table = "dass_team_period_stats"
+
+
+class ManagerPeriodStats(PeriodStats):
+    pk = models.CompositePrimaryKey("manager", "period", "period_key")
+    manager = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+
+    class Meta:
+        managed = False
+        db_table = "dass_manager_period_stats"
+
+
+class NoTeamDailyStats(models.Model):
+    """
+    Результаты по дням сотрудников руководителя, не состоявших в команде на дату результата.
+    """
+    pk = models.CompositePrimaryKey("manager", "date")
+    manager = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    date = models.DateField()
+    test_count = models.BigIntegerField()
+    depression_sum = models.BigIntegerField()
+    stress_sum = models.BigIntegerField()
+    anxiety_sum = models.BigIntegerField()
+
+    class Meta:
+        managed = False
+        db_table = "dass_no_team_daily_stats"
+
+
+class MaterializedViewRefresh(models.Model):
+    """
+    Время последнего обновления материализованного представления (момент начала REFRESH).
+    """
+    name = models.CharField(max_length=63, primary_key=True)
+    refreshed_at = models.DateTimeField()
+    duration = models.FloatField(verbose_name="Длительность обновления, сек")
+
+    class Meta:
+        verbose_name = "Обновление материализованного представления"
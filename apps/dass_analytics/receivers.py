@@ -0,0 +1,236 @@
+import threading
+from datetime import date
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete, pre_save, post_save, post_migrate
+from django.dispatch import receiver
+
+from apps.assessments.dass.models import Dass9Result
+from apps.assessments.dass.signals import results_created
+from apps.auth_user.models import User
+from apps.dass_analytics.cache import analytics_cache
+from apps.dass_analytics.calendar import load_calendar
+from apps.dass_analytics.rollups import DailyRollupService
+from apps.dass_analytics.sketches import SketchService
+from apps.dass_analytics.trends import TrendService
+from apps.manager.management.models import Team
+from apps.manager.management.services import TeamMembershipService
+
+_UNSET = object()
+# множество пользователей текущей транзакции, чьи тренды пересчитываются после коммита (по потоку)
+_pending_trend_rebuilds = threading.local()
+
+
+@receiver(results_created)
+def add_results_to_rollups(sender, results, **kwargs):
+    DailyRollupService.apply_results(results, sign=1)
+
+
+@receiver(results_created)
+def update_trends(sender, results, **kwargs):
+    TrendService.apply_results(results)
+
+
+@receiver(results_created)
+def add_results_to_sketches(sender, results, **kwargs):
+    SketchService.add_results(results)
+
+
+@receiver(post_delete, sender=Dass9Result)
+def refresh_sketches_on_delete(sender, instance, **kwargs):
+    # команды берутся из pre_delete: при каскадном удалении пользователя членства уже удалены
+    if "_rollup_team_ids" in instance.__dict__:
+        keys = [(team_id, instance.date) for team_id in _existing_teams(instance._rollup_team_ids)]
+    else:
+        keys = SketchService.team_days([{"user_id": instance.user_id, "date": instance.date}])
+    SketchService.refresh(keys)
+
+
+def _schedule_trend_rebuild(user_id):
+    """
+    Пересчёт тренда пользователя после коммита: один callback на транзакцию со своим множеством пользователей.
+    """
+    connection = transaction.get_connection()
+    pending = _pending_trend_rebuilds.__dict__
+    # список on_commit-хуков соединение заменяет новым при каждом коммите и откате,
+    # поэтому множество откатанной транзакции не переходит в следующую
+    if connection.in_atomic_block and pending.get("hooks") is connection.run_on_commit:
+        pending["user_ids"].add(user_id)
+        return
+    user_ids = {user_id}
+    if connection.in_atomic_block:
+        pending.update(hooks=connection.run_on_commit, user_ids=user_ids)
+    transaction.on_commit(lambda: TrendService.rebuild(user_ids=user_ids))
+
+
+@receiver(post_delete, sender=Dass9Result)
+def rebuild_trend_on_delete(sender, instance, **kwargs):
+    # удаление пачки (в т.ч. каскадом от пользователя) шлёт post_delete на каждую строку:
+    # пользователи копятся до коммита, и история каждого пересчитывается один раз
+    _schedule_trend_rebuild(instance.user_id)
+
+
+@receiver(pre_delete, sender=Dass9Result)
+def remember_result_teams(sender, instance, **kwargs):
+    # при удалении пользователя его строки членства удаляются каскадом (fast delete)
+    # раньше, чем придёт post_delete результата, поэтому команды запоминаются заранее
+    instance._rollup_team_ids = TeamMembershipService.teams_at_date(instance.user_id, instance.date)
+
+
+@receiver(pre_save, sender=Dass9Result)
+def remember_previous_result(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._rollup_previous_result = (
+        Dass9Result.objects.filter(pk=instance.pk)
+        .values("user_id", "date", "depression_score", "stress_score", "anxiety_score")
+        .first()
+    )
+
+
+@receiver(post_save, sender=Dass9Result)
+def apply_result_change(sender, instance, created, raw=False, **kwargs):
+    # вставка приходит через results_created; здесь — правка существующего результата через ORM (админка):
+    # старые значения вычитаются из агрегатов, новые добавляются, тренд пересчитывается по истории
+    previous = instance.__dict__.pop("_rollup_previous_result", None)
+    if raw or created or previous is None:
+        return
+    current = {
+        "user_id": instance.user_id,
+        "date": instance.date,
+        "depression_score": instance.depression_score,
+        "stress_score": instance.stress_score,
+        "anxiety_score": instance.anxiety_score,
+    }
+    if current == previous:
+        return
+    DailyRollupService.apply_results([previous], sign=-1)
+    DailyRollupService.apply_results([current], sign=1)
+    if (previous["user_id"], previous["date"]) != (current["user_id"], current["date"]):
+        SketchService.refresh(set(SketchService.team_days([previous, current])))
+    for user_id in {previous["user_id"], current["user_id"]}:
+        _schedule_trend_rebuild(user_id)
+    _bump_cache_versions(_managers_of_users({previous["user_id"], current["user_id"]}))
+
+
+def _existing_teams(team_ids):
+    # команды, удалённые тем же каскадом (например, вместе с руководителем), пропускаются
+    if not team_ids:
+        return []
+    return list(Team.objects.filter(id__in=team_ids).values_list("id", flat=True))
+
+
+def _deleted_result(instance) -> dict:
+    result = {
+        "user_id": instance.user_id,
+        "date": instance.date,
+        "depression_score": instance.depression_score,
+        "stress_score": instance.stress_score,
+        "anxiety_score": instance.anxiety_score,
+    }
+    if "_rollup_team_ids" in instance.__dict__:
+        result["team_ids"] = _existing_teams(instance._rollup_team_ids)
+    return result
+
+
+@receiver(post_delete, sender=Dass9Result)
+def remove_result_from_rollups(sender, instance, **kwargs):
+    DailyRollupService.apply_results([_deleted_result(instance)], sign=-1)
+
+
+def _membership_pairs(instance, pk_set, reverse):
+    if reverse:
+        # user.member_teams.add(team): instance — пользователь, pk_set — команды
+        return [(team_id, instance.pk) for team_id in pk_set]
+    return [(instance.pk, user_id) for user_id in pk_set]
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def update_rollups_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        if reverse:
+            instance._rollup_cleared_pairs = [
+                (team_id, instance.pk) for team_id in instance.member_teams.values_list("id", flat=True)
+            ]
+        else:
+            instance._rollup_cleared_pairs = [
+                (instance.pk, user_id) for user_id in instance.members.values_list("id", flat=True)
+            ]
+    elif action == "post_clear":
+        pairs = instance.__dict__.pop("_rollup_cleared_pairs", [])
+        DailyRollupService.apply_membership(pairs, sign=-1, since=date.today())
+        SketchService.apply_membership(pairs, since=date.today())
+    elif action in ("post_add", "post_remove") and pk_set:
+        pairs = _membership_pairs(instance, pk_set, reverse)
+        DailyRollupService.apply_membership(pairs, sign=1 if action == "post_add" else -1, since=date.today())
+        # скетчи пересчитываются по истории членства, которую уже обновил receiver приложения management
+        SketchService.apply_membership(pairs, since=date.today())
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_manager(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {"manager", "manager_id"} & set(update_fields):
+        return
+    instance._rollup_previous_manager_id = (
+        User.objects.filter(pk=instance.pk).values_list("manager_id", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=User)
+def move_manager_rollups(sender, instance, created, raw=False, **kwargs):
+    previous_manager_id = instance.__dict__.pop("_rollup_previous_manager_id", _UNSET)
+    if raw or created or previous_manager_id is _UNSET:
+        return
+    if previous_manager_id != instance.manager_id:
+        DailyRollupService.apply_manager_change(instance.pk, previous_manager_id, instance.manager_id)
+        _bump_cache_versions([previous_manager_id, instance.manager_id])
+
+
+def _bump_cache_versions(manager_ids):
+    # после коммита: иначе параллельный запрос закэширует старые данные под новой версией
+    manager_ids = list(manager_ids)
+    transaction.on_commit(lambda: analytics_cache.bump_versions(manager_ids))
+
+
+def _managers_of_users(user_ids):
+    return set(
+        User.objects.filter(id__in=user_ids, manager_id__isnull=False).values_list("manager_id", flat=True)
+    ) | set(
+        Team.objects.filter(members__id__in=user_ids).values_list("manager_id", flat=True)
+    )
+
+
+@receiver(results_created)
+def bump_cache_on_results(sender, results, **kwargs):
+    _bump_cache_versions(_managers_of_users({r["user_id"] for r in results}))
+
+
+@receiver(post_delete, sender=Dass9Result)
+def bump_cache_on_result_delete(sender, instance, **kwargs):
+    _bump_cache_versions(_managers_of_users([instance.user_id]))
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def bump_cache_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        _bump_cache_versions([instance.manager_id])
+    elif action == "pre_clear":
+        _bump_cache_versions(instance.member_teams.values_list("manager_id", flat=True))
+    elif pk_set:
+        _bump_cache_versions(Team.objects.filter(id__in=pk_set).values_list("manager_id", flat=True))
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def bump_cache_on_team_change(sender, instance, **kwargs):
+    _bump_cache_versions([instance.manager_id])
+
+
+@receiver(post_migrate)
+def fill_calendar(sender, app_config=None, using="default", **kwargs):
+    if app_config is not None and app_config.name == "apps.dass_analytics":
+        load_calendar()
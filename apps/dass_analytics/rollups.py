@@ -0,0 +1,217 @@
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import F, Count, Q, Sum
+
+from apps.assessments.dass.models import Dass9Result
+from apps.auth_user.models import User
+from apps.dass_analytics.models import TeamDailyRollup, ManagerDailyRollup
+from apps.manager.management.models import TeamMembershipPeriod
+from apps.manager.management.services import TeamMembershipService
+
+SUBSCALES = ("depression", "stress", "anxiety")
+ROLLUP_FIELDS = (
+    "test_count",
+    "depression_sum", "depression_sq_sum",
+    "stress_sum", "stress_sq_sum",
+    "anxiety_sum", "anxiety_sq_sum",
+)
+UPSERT_CHUNK_SIZE = 1000
+
+
+class DailyRollupService:
+    """
+    Инкрементальное ведение дневных агрегатов DASS-9 по командам и руководителям.
+    """
+
+    @staticmethod
+    def _row_delta(result: Dict, sign: int) -> List[int]:
+        delta = [sign]
+        for subscale in SUBSCALES:
+            score = result[f"{subscale}_score"]
+            delta += [sign * score, sign * score * score]
+        return delta
+
+    @staticmethod
+    def _upsert(model, key_field: str, deltas: Dict[Tuple, List[int]]) -> None:
+        """
+        Прибавляет дельты к строкам агрегата одним INSERT ... ON CONFLICT DO UPDATE.
+        """
+        if not deltas:
+            return
+        table = connection.ops.quote_name(model._meta.db_table)
+        key_column = connection.ops.quote_name(model._meta.get_field(key_field).column)
+        date_column = connection.ops.quote_name("date")
+        value_columns = [connection.ops.quote_name(f) for f in ROLLUP_FIELDS]
+        placeholders = "(" + ", ".join(["%s"] * (2 + len(ROLLUP_FIELDS))) + ")"
+
+        updates = ", ".join(f"{c} = {table}.{c} + EXCLUDED.{c}" for c in value_columns)
+        key_prep = model._meta.get_field(key_field).get_db_prep_value
+        items = list(deltas.items())
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), UPSERT_CHUNK_SIZE):
+                chunk = items[start:start + UPSERT_CHUNK_SIZE]
+                params = []
+                for (key, day), delta in chunk:
+                    params += [key_prep(key, connection), day, *delta]
+                cursor.execute(
+                    f"INSERT INTO {table} ({key_column}, {date_column}, {', '.join(value_columns)}) "
+                    f"VALUES {', '.join([placeholders] * len(chunk))} "
+                    f"ON CONFLICT ({key_column}, {date_column}) DO UPDATE SET {updates}",
+                    params,
+                )
+
+    @staticmethod
+    def _accumulate(target: Dict[Tuple, List[int]], key: Tuple, delta: List[int]) -> None:
+        current = target.get(key)
+        if current is None:
+            target[key] = list(delta)
+        else:
+            for i, value in enumerate(delta):
+                current[i] += value
+
+    @staticmethod
+    def apply_results(results: List[Dict], sign: int = 1) -> None:
+        """
+        Добавляет (sign=1) или вычитает (sign=-1) результаты из агрегатов
+        команд пользователя и его руководителя.
+        Если у результата есть ключ team_ids (снимок членства, сделанный до удаления),
+        команды берутся из него, а не из истории членства.
+        """
+        if not results:
+            return
+        user_ids = {r["user_id"] for r in results}
+
+        # команды берутся по истории членства на дату результата
+        periods_by_user = defaultdict(list)
+        for user_id, team_id, valid_from, valid_to in TeamMembershipPeriod.objects.filter(user_id__in=user_ids) \
+                .values_list("user_id", "team_id", "valid_from", "valid_to"):
+            periods_by_user[user_id].append((team_id, valid_from, valid_to))
+        manager_by_user = dict(
+            User.objects.filter(id__in=user_ids, manager_id__isnull=False).values_list("id", "manager_id")
+        )
+
+        team_deltas: Dict[Tuple, List[int]] = {}
+        manager_deltas: Dict[Tuple, List[int]] = {}
+        for r in results:
+            delta = DailyRollupService._row_delta(r, sign)
+            if "team_ids" in r:
+                team_ids = r["team_ids"]
+            else:
+                team_ids = [
+                    team_id for team_id, valid_from, valid_to in periods_by_user.get(r["user_id"], ())
+                    if valid_from <= r["date"] and (valid_to is None or r["date"] < valid_to)
+                ]
+            for team_id in team_ids:
+                DailyRollupService._accumulate(team_deltas, (team_id, r["date"]), delta)
+            manager_id = manager_by_user.get(r["user_id"])
+            if manager_id:
+                DailyRollupService._accumulate(manager_deltas, (manager_id, r["date"]), delta)
+
+        with transaction.atomic():
+            DailyRollupService._upsert(TeamDailyRollup, "team", team_deltas)
+            DailyRollupService._upsert(ManagerDailyRollup, "manager", manager_deltas)
+
+    @staticmethod
+    def _user_history_deltas(user_ids: Iterable, sign: int, since: Optional[date] = None) -> Dict:
+        """
+        Дельты истории пользователей (с даты since, если задана), сгруппированные по user_id
+        (у пользователя не больше одного результата в день).
+        """
+        deltas = {}
+        results = Dass9Result.objects.filter(user_id__in=list(user_ids))
+        if since:
+            results = results.filter(date__gte=since)
+        rows = (
+            results
+            .values_list(
+                "user_id", "date",
+                "depression_score", "stress_score", "anxiety_score",
+            )
+        )
+        for user_id, day, depression, stress, anxiety in rows.iterator(chunk_size=2000):
+            deltas.setdefault(user_id, []).append(
+                (day, DailyRollupService._row_delta(
+                    {"depression_score": depression, "stress_score": stress, "anxiety_score": anxiety}, sign
+                ))
+            )
+        return deltas
+
+    @staticmethod
+    def apply_membership(team_user_pairs: Iterable[Tuple], sign: int, since: date) -> None:
+        """
+        Добавляет в агрегат команды (sign=1) или убирает из него (sign=-1) результаты
+        пользователей начиная с даты изменения состава: прошлые результаты остаются
+        в командах, где пользователь состоял на их дату.
+        """
+        pairs = list(team_user_pairs)
+        if not pairs:
+            return
+        history = DailyRollupService._user_history_deltas({user_id for _, user_id in pairs}, sign, since)
+
+        team_deltas: Dict[Tuple, List[int]] = {}
+        for team_id, user_id in pairs:
+            for day, delta in history.get(user_id, ()):
+                DailyRollupService._accumulate(team_deltas, (team_id, day), delta)
+        DailyRollupService._upsert(TeamDailyRollup, "team", team_deltas)
+
+    @staticmethod
+    def apply_manager_change(user_id, old_manager_id, new_manager_id) -> None:
+        """
+        Переносит историю пользователя между агрегатами руководителей.
+        """
+        for manager_id, sign in ((old_manager_id, -1), (new_manager_id, 1)):
+            if not manager_id:
+                continue
+            manager_deltas: Dict[Tuple, List[int]] = {}
+            for day, delta in DailyRollupService._user_history_deltas([user_id], sign).get(user_id, ()):
+                DailyRollupService._accumulate(manager_deltas, (manager_id, day), delta)
+            DailyRollupService._upsert(ManagerDailyRollup, "manager", manager_deltas)
+
+    @staticmethod
+    def _grouped_rows(key_path: str, condition: Q = Q()):
+        annotations = {"test_count": Count("id")}
+        for subscale in SUBSCALES:
+            field = f"{subscale}_score"
+            annotations[f"{subscale}_sum"] = Sum(field)
+            annotations[f"{subscale}_sq_sum"] = Sum(F(field) * F(field))
+
+        rows = (
+            # одним filter(), чтобы условие и ключ шли по одному JOIN
+            Dass9Result.objects.filter(Q(**{f"{key_path}__isnull": False}) & condition)
+            .values(key_path, "date")
+            .annotate(**annotations)
+            .order_by()
+        )
+        for row in rows.iterator(chunk_size=2000):
+            key = row.pop(key_path)
+            day = row.pop("date")
+            yield key, day, row
+
+    @staticmethod
+    def rebuild() -> Dict[str, int]:
+        """
+        Пересчитывает агрегаты с нуля по сырым результатам.
+        """
+        with transaction.atomic():
+            TeamDailyRollup.objects.all().delete()
+            ManagerDailyRollup.objects.all().delete()
+
+            periods = "user__team_membership_periods"
+            team_rows = DailyRollupService._grouped_rows(f"{periods}__team", TeamMembershipService.covers_date(periods))
+            TeamDailyRollup.objects.bulk_create(
+                (TeamDailyRollup(team_id=key, date=day, **values) for key, day, values in team_rows),
+                batch_size=2000,
+            )
+            manager_rows = DailyRollupService._grouped_rows("user__manager")
+            ManagerDailyRollup.objects.bulk_create(
+                (ManagerDailyRollup(manager_id=key, date=day, **values) for key, day, values in manager_rows),
+                batch_size=2000,
+            )
+        return {
+            "team_rows": TeamDailyRollup.objects.count(),
+            "manager_rows": ManagerDailyRollup.objects.count(),
+        }
@@ -1,5 +1,11 @@
 from ninja import Schema
+from datetime import date
+from uuid import UUID
 from typing import Optional, Literal, List
+from apps.manager.management.schemas import TeamDass9ColumnsOut
+
+# календарные периоды аналитики (совпадают с calendar.PERIODS)
+Period = Literal["day", "week", "month", "quarter", "year"]
 
 class ChangeSchema(Schema):
     direction: Literal["up", "down", "neutral"]
@@ -12,16 +18,20 @@ class MetricSchema(Schema):
     change: ChangeSchema
 
 class MentalStatisticsOut(Schema):
-    period: Literal["day", "week", "month", "year"]
+    period: Period
     statistics: List[MetricSchema]
 
+class MentalStatisticsMultiOut(Schema):
+    periods: List[MentalStatisticsOut]
+
 class PeriodData(Schema):
     start: str
     end: str
     test_count: int
+    message: Optional[str] = None
 
 class TestCountOut(Schema):
-    period: Literal["day", "week", "month", "year"]
+    period: Period
     periods: List[PeriodData]
 
 class CountChangeSchema(Schema):
@@ -36,9 +46,85 @@ class TeamTestComparisonSchema(Schema):
     change: CountChangeSchema
 
 class TeamsTestComparisonOut(Schema):
-    period: Literal["day", "week", "month", "year"]
+    period: Period
     teams: List[TeamTestComparisonSchema]
 
 class TeamsTestComparisonIn(Schema):
-    period: Literal["day", "week", "month", "year"] = "week"
-    team_ids: Optional[List[str]] = None
\ No newline at end of file
+    period: Period = "week"
+    team_ids: Optional[List[str]] = None
+
+class TimeSeriesOut(Schema):
+    granularity: Literal["day", "week", "month", "quarter"]
+    buckets: List[date]
+    test_count: List[int]
+    depression: List[Optional[float]]
+    stress: List[Optional[float]]
+    anxiety: List[Optional[float]]
+
+class SubscaleDistributionSchema(Schema):
+    count: int
+    median: Optional[float]
+    p75: Optional[float]
+    p90: Optional[float]
+    histogram: List[int]
+
+class DistributionOut(Schema):
+    bins: List[int]
+    depression: SubscaleDistributionSchema
+    stress: SubscaleDistributionSchema
+    anxiety: SubscaleDistributionSchema
+
+class AtRiskEmployeeSchema(Schema):
+    user_id: UUID
+    username: str
+    full_name: Optional[str]
+    max_band: int
+    depression_band: int
+    stress_band: int
+    anxiety_band: int
+    results_count: int
+    last_date: date
+
+class AtRiskEmployeesOut(Schema):
+    from_date: date
+    to_date: date
+    min_band: int
+    employees: List[AtRiskEmployeeSchema]
+
+class TrendAlertSchema(Schema):
+    user_id: UUID
+    username: str
+    full_name: Optional[str]
+    last_date: date
+    results_count: int
+    depression_z: Optional[float]
+    stress_z: Optional[float]
+    anxiety_z: Optional[float]
+    max_z: float
+
+class TrendAlertsOut(Schema):
+    threshold: float
+    alerts: List[TrendAlertSchema]
+
+class DashboardOut(Schema):
+    ips_overview: Optional[MentalStatisticsOut] = None
+    test_count: Optional[TestCountOut] = None
+    test_count_common: Optional[TeamsTestComparisonOut] = None
+    all_teams_dass9_results: Optional[List[TeamDass9ColumnsOut]] = None
+
+class ParticipationPeriodSchema(Schema):
+    start: date
+    end: date
+    participants: int
+    members: int
+    rate: Optional[float]
+
+class TeamParticipationSchema(Schema):
+    team_id: str
+    team_name: str
+    periods: List[ParticipationPeriodSchema]
+
+class ParticipationOut(Schema):
+    period: Period
+    mode: Literal["exact", "approx"]
+    teams: List[TeamParticipationSchema]
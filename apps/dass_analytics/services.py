@@ -1,12 +1,20 @@
+from collections import defaultdict
 from datetime import date, timedelta
 from typing import Dict, Optional, List
-from django.db.models import Avg, F
+from django.db.models import Count, F, Max, Sum, Q
 from django.shortcuts import get_object_or_404
 
 from apps.assessments.dass.models import Dass9Result
+from apps.assessments.dass.services import Dass9Service
 from apps.auth_user.models import User
+from apps.dass_analytics.matviews import MV_PERIODS, MaterializedViewService
+from apps.dass_analytics.models import TeamDailyRollup, ManagerDailyRollup, TeamPeriodStats, ManagerPeriodStats, TeamDailySketch
+from apps.dass_analytics.sketches import HyperLogLog
+from apps.dass_analytics.trends import TrendService
+from apps.dass_analytics.calendar import calendar, period_key_expression
 from apps.dass_analytics.utils import DassAnalyticsUtils
-from apps.manager.management.models import Team
+from apps.manager.management.models import Team, TeamMembershipPeriod
+from apps.manager.management.services import TeamMembershipService
 
 
 class StatisticsService:
@@ -25,34 +33,90 @@ class StatisticsService:
             direction = "neutral"
         return {"direction": direction, "percent": round(percent, 2)}
 
+    @staticmethod
+    def _rollup_qs(manager_id: str, team_id: Optional[str] = None):
+        """
+        Дневные агрегаты по команде (с проверкой владельца) или по всем сотрудникам руководителя.
+        """
+        if team_id:
+            team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
+            return TeamDailyRollup.objects.filter(team=team)
+        return ManagerDailyRollup.objects.filter(manager_id=manager_id)
+
+    @staticmethod
+    def _period_stats_qs(manager_id: str, team_id: Optional[str], period: str):
+        """
+        Недельные/месячные/квартальные/годовые суммы из материализованного представления,
+        если оно достаточно свежее; иначе None. Владелец команды проверяется в _rollup_qs.
+        """
+        model = TeamPeriodStats if team_id else ManagerPeriodStats
+        if period not in MV_PERIODS or not MaterializedViewService.is_fresh(model):
+            return None
+        if team_id:
+            return TeamPeriodStats.objects.filter(team_id=team_id, period=period)
+        return ManagerPeriodStats.objects.filter(manager_id=manager_id, period=period)
+
+    @staticmethod
+    def _windowed_averages(rollup_qs, windows: Dict[str, tuple]) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        Средние по нескольким окнам дат за один проход: условная агрегация
+        (SUM ... FILTER (WHERE date BETWEEN ...)) в одном запросе.
+        """
+        aggregates = {}
+        for name, (start, end) in windows.items():
+            in_window = Q(date__range=[start, end])
+            aggregates[f"{name}__count"] = Sum("test_count", filter=in_window)
+            for subscale in ("anxiety", "depression", "stress"):
+                aggregates[f"{name}__{subscale}"] = Sum(f"{subscale}_sum", filter=in_window)
+
+        first_day = min(start for start, _ in windows.values())
+        last_day = max(end for _, end in windows.values())
+        totals = rollup_qs.filter(date__range=[first_day, last_day]).aggregate(**aggregates)
+
+        result = {}
+        for name in windows:
+            count = totals[f"{name}__count"]
+            result[name] = {
+                f"avg_{subscale}": totals[f"{name}__{subscale}"] / count if count else None
+                for subscale in ("anxiety", "depression", "stress")
+            }
+        return result
+
     @staticmethod
     def get_ips_overview(manager_id: str,
                               team_id: Optional[str] = None,
                               period: str = "day") -> Dict[str, any]:
-        start, end, prev_start, prev_end = DassAnalyticsUtils.get_current_and_previous_period_dates(period)
+        return StatisticsService.get_ips_overviews(manager_id, team_id, periods=[period])[0]
 
-        if team_id:
-            team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
-            member_ids = team.members.values_list("id", flat=True)
-        else:
-            member_ids = User.objects.filter(manager_id=manager_id).values_list("id", flat=True)
+    @staticmethod
+    def get_ips_overviews(manager_id: str,
+                          team_id: Optional[str] = None,
+                          periods: List[str] = ("day",)) -> List[Dict[str, any]]:
+        """
+        Статистика IPS и подшкал с динамикой для нескольких периодов.
+        Текущие и предыдущие окна всех периодов считаются одним запросом.
+        """
+        windows = {}
+        for period in periods:
+            start, end, prev_start, prev_end = DassAnalyticsUtils.get_current_and_previous_period_dates(period)
+            windows[f"{period}_curr"] = (start, end)
+            windows[f"{period}_prev"] = (prev_start, prev_end)
 
-        # Текущий и предыдущий периоды
-        qs = Dass9Result.objects.filter(user_id__in=member_ids, date__range=[start, end])
-        prev_qs = Dass9Result.objects.filter(user_id__in=member_ids, date__range=[prev_start, prev_end])
+        rollup_qs = StatisticsService._rollup_qs(manager_id, team_id)
+        averages = StatisticsService._windowed_averages(rollup_qs, windows)
 
-        # Средние значения
-        curr_avg = qs.aggregate(
-            avg_anxiety=Avg("anxiety_score"),
-            avg_depression=Avg("depression_score"),
-            avg_stress=Avg("stress_score")
-        )
-        prev_avg = prev_qs.aggregate(
-            avg_anxiety=Avg("anxiety_score"),
-            avg_depression=Avg("depression_score"),
-            avg_stress=Avg("stress_score")
-        )
+        return [
+            {
+                "period": period,
+                "statistics": StatisticsService._build_statistics(
+                    averages[f"{period}_curr"], averages[f"{period}_prev"]
+                ),
+            }
+            for period in periods
+        ]
 
+    @staticmethod
+    def _build_statistics(curr_avg: Dict, prev_avg: Dict) -> List[Dict]:
         def safe_value(val): return val or 0.0
 
         curr_anxiety = safe_value(curr_avg["avg_anxiety"])
@@ -95,31 +159,40 @@ class StatisticsService:
             },
         ]
 
-        return {
-            "period": period,
-            "statistics": stats
-        }
+        return stats
 
     @staticmethod
     def get_test_count(manager_id: str,
                        team_id: str,
-                       period: str = "week") -> Dict[str, any]:
+                       period: str = "week",
+                       buckets: int = 4) -> Dict[str, any]:
         """
-        Возвращает количество прохождений теста DASS9 за последние 4 периода
-        (дня, недели, месяца или года) для выбранной команды.
+        Возвращает количество прохождений теста DASS9 за последние `buckets` периодов
+        (дней, недель, месяцев или лет) для выбранной команды.
+        Все периоды считаются одним GROUP BY запросом, пустые дополняются нулями.
         Если данных нет — добавляется сообщение.
         """
-        team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
-        member_ids = team.members.values_list("id", flat=True)
+        rollup_qs = StatisticsService._rollup_qs(manager_id, team_id)
+        bounds = DassAnalyticsUtils.get_period_buckets(period, buckets)
+
+        stats_qs = StatisticsService._period_stats_qs(manager_id, team_id, period)
+        if stats_qs is not None:
+            keys = [calendar.key(start, period) for start, _ in bounds]
+            counts = dict(stats_qs.filter(period_key__in=keys).values_list("period_key", "test_count"))
+        else:
+            counts = dict(
+                rollup_qs.filter(date__range=[bounds[-1][0], bounds[0][1]])
+                .annotate(period_key=period_key_expression(period))
+                .values("period_key")
+                .annotate(n=Sum("test_count"))
+                .order_by()
+                .values_list("period_key", "n")
+            )
 
         periods: List[Dict] = []
 
-        for offset in range(4):
-            start, end = DassAnalyticsUtils.get_period_dates(period, offset)
-            count = Dass9Result.objects.filter(
-                user_id__in=member_ids,
-                date__range=[start, end]
-            ).count()
+        for start, end in bounds:
+            count = counts.get(calendar.key(start, period)) or 0
 
             entry = {
                 "start": start.isoformat(),
@@ -145,24 +218,23 @@ class StatisticsService:
         Возвращает количество прохождений теста DASS9 по всем (или выбранным) командам
         за текущий и предыдущий периоды, с процентом изменения.
         """
+        start, end, prev_start, prev_end = DassAnalyticsUtils.get_current_and_previous_period_dates(period)
+
+        # одним запросом: LEFT JOIN команд с дневными агрегатами и условные суммы по окнам,
+        # команды без результатов тоже попадают в выборку
         teams_qs = Team.objects.filter(manager_id=manager_id)
         if team_ids:
             teams_qs = teams_qs.filter(id__in=team_ids)
-
-        teams = list(teams_qs)
-        start, end, prev_start, prev_end = DassAnalyticsUtils.get_current_and_previous_period_dates(period)
+        teams = teams_qs.annotate(
+            curr_count=Sum("daily_rollups__test_count", filter=Q(daily_rollups__date__range=[start, end])),
+            prev_count=Sum("daily_rollups__test_count", filter=Q(daily_rollups__date__range=[prev_start, prev_end])),
+        ).order_by("name", "id")
 
         results = []
 
         for team in teams:
-            member_ids = team.members.values_list("id", flat=True)
-
-            curr_count = Dass9Result.objects.filter(
-                user_id__in=member_ids, date__range=[start, end]
-            ).count()
-            prev_count = Dass9Result.objects.filter(
-                user_id__in=member_ids, date__range=[prev_start, prev_end]
-            ).count()
+            curr_count = team.curr_count or 0
+            prev_count = team.prev_count or 0
 
             # Вычисляем направление и процент
             if prev_count == 0:
@@ -187,4 +259,277 @@ class StatisticsService:
         return {
             "period": period,
             "teams": results
-        }
\ No newline at end of file
+        }
+    @staticmethod
+    def get_time_series(manager_id: str,
+                        team_id: Optional[str],
+                        granularity: str,
+                        from_date: date,
+                        to_date: date) -> Dict[str, any]:
+        """
+        Временной ряд средних DASS-9 по интервалам day | week | month | quarter.
+
+        Группировка делается в БД по ключам периодов календарной таблицы (или читается
+        из материализованного представления, если оно свежее), средние взвешены:
+        сумма баллов / количество тестов за интервал. Крайние интервалы в обоих случаях
+        считаются только по дням внутри [from_date, to_date]. Пустые интервалы дополняются
+        (test_count = 0, средние = null). Ответ — параллельные массивы.
+        """
+        rollup_qs = StatisticsService._rollup_qs(manager_id, team_id)
+        stats_qs = StatisticsService._period_stats_qs(manager_id, team_id, granularity)
+        rows = []
+        rollup_window = Q(date__range=[from_date, to_date])
+        if stats_qs is not None:
+            # из представления берутся только интервалы, целиком лежащие в [from_date, to_date];
+            # крайние неполные интервалы досчитываются по дневным агрегатам, как без представления
+            first = calendar.key(from_date, granularity)
+            last = calendar.key(to_date, granularity)
+            if calendar.bounds(granularity, first)[0] < from_date:
+                first += 1
+            if calendar.bounds(granularity, last)[1] > to_date:
+                last -= 1
+            if first <= last:
+                rows.extend(stats_qs.filter(period_key__range=[first, last]).values(
+                    "period_key", n=F("test_count"), depression=F("depression_sum"),
+                    stress=F("stress_sum"), anxiety=F("anxiety_sum"),
+                ))
+                interior_start = calendar.bounds(granularity, first)[0]
+                interior_end = calendar.bounds(granularity, last)[1]
+                edges = Q()
+                if from_date < interior_start:
+                    edges |= Q(date__gte=from_date, date__lt=interior_start)
+                if interior_end < to_date:
+                    edges |= Q(date__gt=interior_end, date__lte=to_date)
+                rollup_window = edges or None
+        if rollup_window is not None:
+            rows.extend(
+                rollup_qs.filter(rollup_window)
+                .annotate(period_key=period_key_expression(granularity))
+                .values("period_key")
+                .annotate(
+                    n=Sum("test_count"),
+                    depression=Sum("depression_sum"),
+                    stress=Sum("stress_sum"),
+                    anxiety=Sum("anxiety_sum"),
+                )
+                .order_by()
+            )
+        by_bucket = {calendar.bounds(granularity, row["period_key"])[0]: row for row in rows}
+
+        series = {"buckets": [], "test_count": [], "depression": [], "stress": [], "anxiety": []}
+        for bucket in DassAnalyticsUtils.series_buckets(from_date, to_date, granularity):
+            row = by_bucket.get(bucket)
+            count = row["n"] if row else 0
+            series["buckets"].append(bucket)
+            series["test_count"].append(count)
+            for subscale in ("depression", "stress", "anxiety"):
+                series[subscale].append(round(row[subscale] / count, 2) if count else None)
+
+        return {"granularity": granularity, **series}
+
+    @staticmethod
+    def get_distribution(manager_id: str,
+                         team_id: Optional[str],
+                         from_date: Optional[date] = None,
+                         to_date: Optional[date] = None) -> Dict[str, any]:
+        """
+        Распределение баллов по подшкалам: медиана, p75, p90 и гистограмма по значениям 0..9.
+
+        Баллы — целые числа 0..9, поэтому гистограмма по каждому значению точна и полностью
+        описывает распределение: все счётчики считаются одним проходом (COUNT ... FILTER),
+        а перцентили (как percentile_cont) вычисляются по гистограмме.
+        """
+        if team_id:
+            team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
+            results = TeamMembershipService.team_results(team)
+        else:
+            results = Dass9Result.objects.filter(user__manager_id=manager_id)
+        if from_date:
+            results = results.filter(date__gte=from_date)
+        if to_date:
+            results = results.filter(date__lte=to_date)
+
+        bins = range(Dass9Service.MAX_SCORE + 1)
+        subscales = ("depression", "stress", "anxiety")
+        counts = results.aggregate(**{
+            f"{subscale}_{value}": Count("id", filter=Q(**{f"{subscale}_score": value}))
+            for subscale in subscales
+            for value in bins
+        })
+
+        distribution = {}
+        for subscale in subscales:
+            histogram = [counts[f"{subscale}_{value}"] for value in bins]
+            distribution[subscale] = {
+                "count": sum(histogram),
+                "median": DassAnalyticsUtils.percentile_from_histogram(histogram, 0.5),
+                "p75": DassAnalyticsUtils.percentile_from_histogram(histogram, 0.75),
+                "p90": DassAnalyticsUtils.percentile_from_histogram(histogram, 0.9),
+                "histogram": histogram,
+            }
+
+        return {"bins": list(bins), **distribution}
+
+    @staticmethod
+    def get_at_risk_employees(manager_id: str,
+                              team_id: Optional[str],
+                              from_date: date,
+                              to_date: date,
+                              min_band: int = Dass9Result.SeverityBand.SEVERE) -> Dict[str, any]:
+        """
+        Сотрудники, у которых в окне дат была степень выраженности не ниже min_band
+        хотя бы по одной подшкале. Выборка результатов идёт по частичному индексу
+        dass9result_at_risk_idx (date, user) с сохранёнными степенями.
+        Для команды учитываются результаты, сохранённые в период членства в ней.
+        """
+        if team_id:
+            team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
+            scope = TeamMembershipService.member_at_date(team=team)
+        else:
+            scope = Q(user_id__in=User.objects.filter(manager_id=manager_id).values("id"))
+
+        rows = list(
+            Dass9Result.objects.filter(
+                scope,
+                date__range=[from_date, to_date],
+                max_band__gte=max(min_band, Dass9Result.AT_RISK_BAND),
+            )
+            .values("user_id")
+            .annotate(
+                max_band=Max("max_band"),
+                depression_band=Max("depression_band"),
+                stress_band=Max("stress_band"),
+                anxiety_band=Max("anxiety_band"),
+                results_count=Count("*"),
+                last_date=Max("date"),
+            )
+            .order_by("-max_band", "-last_date")
+        )
+        users = User.objects.in_bulk([row["user_id"] for row in rows])
+
+        return {
+            "from_date": from_date,
+            "to_date": to_date,
+            "min_band": min_band,
+            "employees": [
+                {
+                    **row,
+                    "username": users[row["user_id"]].username,
+                    "full_name": users[row["user_id"]].full_name,
+                }
+                for row in rows
+            ],
+        }
+
+    @staticmethod
+    def get_trend_alerts(manager_id: str,
+                         team_id: Optional[str],
+                         threshold: float,
+                         since: date) -> Dict[str, any]:
+        """
+        Сотрудники, у которых последний результат резко вырос относительно их собственной
+        базовой линии (EWMA): z-оценка по какой-либо подшкале не ниже threshold.
+        Для команды — сотрудники, состоявшие в ней на дату последнего результата.
+        """
+        if team_id:
+            team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
+            scope = TeamMembershipService.member_at_date(date_ref="last_date", team=team)
+        else:
+            scope = Q(user_id__in=User.objects.filter(manager_id=manager_id).values("id"))
+
+        return {
+            "threshold": threshold,
+            "alerts": [
+                {
+                    "user_id": state.user_id,
+                    "username": state.user.username,
+                    "full_name": state.user.full_name,
+                    "last_date": state.last_date,
+                    "results_count": state.results_count,
+                    "depression_z": state.depression_z,
+                    "stress_z": state.stress_z,
+                    "anxiety_z": state.anxiety_z,
+                    "max_z": state.max_z,
+                }
+                for state in TrendService.get_alerts(scope, threshold, since)
+            ],
+        }
+
+    @staticmethod
+    def get_participation(manager_id: str,
+                          team_id: Optional[str],
+                          period: str = "week",
+                          buckets: int = 4,
+                          mode: str = "exact") -> Dict[str, any]:
+        """
+        Доля участников команды, прошедших тест в каждом из последних `buckets` периодов:
+        уникальные участники / число сотрудников, состоявших в команде в этом периоде.
+
+        mode="exact" — COUNT(DISTINCT user) по результатам одним GROUP BY;
+        mode="approx" — объединение дневных HLL-скетчей команд без чтения результатов.
+        """
+        if team_id:
+            teams = [get_object_or_404(Team, id=team_id, manager_id=manager_id)]
+        else:
+            teams = list(Team.objects.filter(manager_id=manager_id).order_by("name", "id"))
+        team_ids = [team.id for team in teams]
+        bounds = DassAnalyticsUtils.get_period_buckets(period, buckets)
+        start, end = bounds[-1][0], bounds[0][1]
+
+        participants: Dict[tuple, float] = {}
+        if mode == "approx":
+            sketches: Dict[tuple, HyperLogLog] = {}
+            rows = (
+                TeamDailySketch.objects.filter(team_id__in=team_ids, date__range=[start, end])
+                .annotate(period_key=period_key_expression(period))
+                .values_list("team_id", "period_key", "sketch")
+            )
+            for key_team, period_key, sketch in rows.iterator(chunk_size=2000):
+                day_sketch = HyperLogLog.from_bytes(sketch)
+                merged = sketches.get((key_team, period_key))
+                sketches[(key_team, period_key)] = merged.merge(day_sketch) if merged else day_sketch
+            participants = {key: sketch.estimate() for key, sketch in sketches.items()}
+        else:
+            periods = "user__team_membership_periods"
+            rows = (
+                Dass9Result.objects.filter(
+                    TeamMembershipService.covers_date(periods)
+                    & Q(**{f"{periods}__team_id__in": team_ids}, date__range=[start, end])
+                )
+                .annotate(period_key=period_key_expression(period))
+                .values(f"{periods}__team", "period_key")
+                .annotate(n=Count("user_id", distinct=True))
+                .order_by()
+                .values_list(f"{periods}__team", "period_key", "n")
+            )
+            participants = {(key_team, period_key): n for key_team, period_key, n in rows}
+
+        # участники команды в периоде — все, чьё членство пересекается с периодом
+        memberships = defaultdict(list)
+        for key_team, user_id, valid_from, valid_to in TeamMembershipPeriod.objects.filter(
+            Q(valid_to__isnull=True) | Q(valid_to__gt=start),
+            team_id__in=team_ids,
+            valid_from__lte=end,
+        ).values_list("team_id", "user_id", "valid_from", "valid_to"):
+            memberships[key_team].append((user_id, valid_from, valid_to))
+
+        result = []
+        for team in teams:
+            team_periods = []
+            for period_start, period_end in reversed(bounds):
+                members = len({
+                    user_id for user_id, valid_from, valid_to in memberships[team.id]
+                    if valid_from <= period_end and (valid_to is None or valid_to > period_start)
+                })
+                # оценка HLL может немного превышать число участников
+                count = min(round(participants.get((team.id, calendar.key(period_start, period)), 0)), members)
+                team_periods.append({
+                    "start": period_start,
+                    "end": period_end,
+                    "participants": count,
+                    "members": members,
+                    "rate": round(count / members, 4) if members else None,
+                })
+            result.append({"team_id": str(team.id), "team_name": team.name, "periods": team_periods})
+
+        return {"period": period, "mode": mode, "teams": result}
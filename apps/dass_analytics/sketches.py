@@ -0,0 +1,246 @@
+import hashlib
+import math
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+from datetime import date
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from apps.assessments.dass.models import Dass9Result
+from apps.dass_analytics.models import TeamDailySketch
+from apps.manager.management.models import TeamMembershipPeriod
+from apps.manager.management.services import TeamMembershipService
+
+SKETCH_CHUNK_SIZE = 2000
+# 2^-r для всех возможных значений регистра (64-битный хэш)
+_INVERSE_POWERS = [2.0 ** -r for r in range(66)]
+
+
+@lru_cache(maxsize=None)
+def _high_bits(size: int) -> int:
+    # старший бит в каждом из size байтов
+    return int.from_bytes(b"\x80" * size, "little")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog с 2^precision однобайтовыми регистрами и 64-битным хэшем (blake2b).
+
+    Относительная ошибка оценки ≈ 1.04 / sqrt(2^precision); для малых множеств
+    используется линейный подсчёт, поэтому команды из десятков человек считаются почти точно.
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[bytearray] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision должна быть от 4 до 16")
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, value) -> None:
+        raw = value.bytes if hasattr(value, "bytes") else str(value).encode()
+        hashed = int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big")
+        rest_bits = 64 - self.precision
+        index = hashed >> rest_bits
+        rest = hashed & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Нельзя объединить скетчи разной точности")
+        # поэлементный максимум сразу по всем регистрам на длинных целых: регистры < 128,
+        # поэтому (a | 0x80) - b не занимает из соседнего байта, а старший бит байта = (a >= b)
+        size = len(self.registers)
+        a = int.from_bytes(self.registers, "little")
+        b = int.from_bytes(other.registers, "little")
+        high = _high_bits(size)
+        a_wins = ((((a | high) - b) & high) >> 7) * 0xFF
+        self.registers = bytearray(((a & a_wins) | (b & ~a_wins)).to_bytes(size, "little"))
+        return self
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        raw = alpha * m * m / sum(_INVERSE_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        registers = bytearray(zlib.decompress(bytes(data)))
+        return cls(len(registers).bit_length() - 1, registers)
+
+
+class SketchService:
+    """
+    Ведение дневных HLL-скетчей участников команд.
+
+    Новые результаты добавляются в скетч (объединение). Удалить пользователя из скетча
+    нельзя, поэтому при удалении результатов и изменении состава затронутые
+    (команда, день) пересчитываются по сырым результатам. Обновления одного
+    скетча сериализуются блокировкой его строки, разные дни и команды не ждут друг друга.
+    При смене DASS_HLL_PRECISION скетчи нужно пересобрать (rebuild_dass_sketches).
+    """
+
+    @staticmethod
+    def _new() -> HyperLogLog:
+        return HyperLogLog(getattr(settings, "DASS_HLL_PRECISION", 12))
+
+    @staticmethod
+    def team_days(results: Iterable[Dict]) -> Dict[Tuple, Set]:
+        """
+        (команда, день) -> пользователи результатов, по истории членства на дату результата.
+        """
+        results = list(results)
+        periods_by_user = defaultdict(list)
+        for user_id, team_id, valid_from, valid_to in TeamMembershipPeriod.objects.filter(
+            user_id__in={r["user_id"] for r in results}
+        ).values_list("user_id", "team_id", "valid_from", "valid_to"):
+            periods_by_user[user_id].append((team_id, valid_from, valid_to))
+
+        users = defaultdict(set)
+        for r in results:
+            for team_id, valid_from, valid_to in periods_by_user.get(r["user_id"], ()):
+                if valid_from <= r["date"] and (valid_to is None or r["date"] < valid_to):
+                    users[(team_id, r["date"])].add(r["user_id"])
+        return users
+
+    @staticmethod
+    def _lock_sketches(keys: Iterable[Tuple]) -> Dict[Tuple, HyperLogLog]:
+        """
+        Блокирует строки скетчей (команда, день), недостающие создаёт пустыми (UPSERT),
+        и возвращает текущие скетчи. Строки блокируются в одном порядке — без взаимных блокировок.
+        """
+        keys = sorted(set(keys))
+        empty = SketchService._new().to_bytes()
+        TeamDailySketch.objects.bulk_create(
+            [TeamDailySketch(team_id=team_id, date=day, sketch=empty) for team_id, day in keys],
+            batch_size=SKETCH_CHUNK_SIZE,
+            ignore_conflicts=True,
+        )
+        rows = (
+            TeamDailySketch.objects.select_for_update()
+            .filter(team_id__in={team_id for team_id, _ in keys}, date__in={day for _, day in keys})
+            .order_by("team_id", "date")
+            .values_list("team_id", "date", "sketch")
+        )
+        keys = set(keys)
+        return {
+            (team_id, day): HyperLogLog.from_bytes(sketch)
+            for team_id, day, sketch in rows if (team_id, day) in keys
+        }
+
+    @staticmethod
+    def _save(sketches: Dict[Tuple, HyperLogLog]) -> None:
+        TeamDailySketch.objects.bulk_create(
+            [
+                TeamDailySketch(team_id=team_id, date=day, sketch=sketch.to_bytes())
+                for (team_id, day), sketch in sketches.items()
+            ],
+            batch_size=SKETCH_CHUNK_SIZE,
+            update_conflicts=True,
+            unique_fields=["team", "date"],
+            update_fields=["sketch"],
+        )
+
+    @staticmethod
+    def add_results(results: Iterable[Dict]) -> None:
+        users = SketchService.team_days(results)
+        if not users:
+            return
+        with transaction.atomic():
+            sketches = SketchService._lock_sketches(users)
+            for key, user_ids in users.items():
+                sketch = sketches.setdefault(key, SketchService._new())
+                for user_id in user_ids:
+                    sketch.add(user_id)
+            SketchService._save(sketches)
+
+    @staticmethod
+    def _member_rows(condition: Q = Q()):
+        """
+        (команда, день, пользователь) для результатов, сохранённых в период членства.
+        """
+        periods = "user__team_membership_periods"
+        return (
+            Dass9Result.objects.filter(TeamMembershipService.covers_date(periods) & condition)
+            .values_list(f"{periods}__team", "date", "user_id")
+        )
+
+    @staticmethod
+    def refresh(keys: Iterable[Tuple]) -> None:
+        """
+        Пересчитывает скетчи (команда, день) по сырым результатам; пустые удаляются.
+        """
+        keys = set(keys)
+        if not keys:
+            return
+        team_ids = {team_id for team_id, _ in keys}
+        days = {day for _, day in keys}
+        with transaction.atomic():
+            SketchService._lock_sketches(keys)
+            sketches: Dict[Tuple, HyperLogLog] = {}
+            rows = SketchService._member_rows(
+                Q(user__team_membership_periods__team_id__in=team_ids, date__in=days)
+            )
+            for team_id, day, user_id in rows.iterator(chunk_size=SKETCH_CHUNK_SIZE):
+                if (team_id, day) in keys:
+                    sketches.setdefault((team_id, day), SketchService._new()).add(user_id)
+
+            empty = Q()
+            for team_id, day in keys - sketches.keys():
+                empty |= Q(team_id=team_id, date=day)
+            if empty:
+                TeamDailySketch.objects.filter(empty).delete()
+            SketchService._save(sketches)
+
+    @staticmethod
+    def apply_membership(team_user_pairs: Iterable[Tuple], since: date) -> None:
+        """
+        Пересчитывает дни команд, на которые повлияло изменение состава начиная с since.
+        """
+        pairs = list(team_user_pairs)
+        if not pairs:
+            return
+        days_by_user = defaultdict(set)
+        for user_id, day in Dass9Result.objects.filter(
+            user_id__in={user_id for _, user_id in pairs}, date__gte=since
+        ).values_list("user_id", "date"):
+            days_by_user[user_id].add(day)
+        SketchService.refresh(
+            (team_id, day) for team_id, user_id in pairs for day in days_by_user.get(user_id, ())
+        )
+
+    @staticmethod
+    def rebuild() -> Dict[str, int]:
+        """
+        Пересобирает все скетчи одним потоковым проходом, отсортированным по (команда, день).
+        """
+        saved = 0
+        pending: Dict[Tuple, HyperLogLog] = {}
+        key, sketch = None, None
+        with transaction.atomic():
+            TeamDailySketch.objects.all().delete()
+            rows = SketchService._member_rows().order_by("user__team_membership_periods__team", "date")
+            for team_id, day, user_id in rows.iterator(chunk_size=SKETCH_CHUNK_SIZE):
+                if (team_id, day) != key:
+                    if len(pending) >= SKETCH_CHUNK_SIZE:
+                        SketchService._save(pending)
+                        saved += len(pending)
+                        pending = {}
+                    key, sketch = (team_id, day), SketchService._new()
+                    pending[key] = sketch
+                sketch.add(user_id)
+            SketchService._save(pending)
+            saved += len(pending)
+        return {"sketches": saved}
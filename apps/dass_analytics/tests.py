@@ -0,0 +1,761 @@
+import asyncio
+import json
+import random
+import threading
+from datetime import date, timedelta
+from typing import get_args
+from unittest import mock, skipUnless
+
+from django.db import IntegrityError, connection, transaction
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from apps.assessments.dass.models import Dass9Result
+from apps.assessments.dass.services import Dass9Service
+from apps.auth_user.models import User
+from apps.auth_user.services import create_access_token
+from apps.dass_analytics.cache import analytics_cache
+from apps.dass_analytics.calendar import PERIODS, calendar
+from apps.dass_analytics.dashboard import PANELS
+from apps.dass_analytics.matviews import MaterializedViewService
+from apps.dass_analytics.models import (
+    CalendarDay, EmployeeTrendState, ManagerDailyRollup, TeamDailyRollup, TeamDailySketch,
+)
+from apps.dass_analytics.rollups import DailyRollupService
+from apps.dass_analytics.schemas import DashboardOut, Period, TestCountOut
+from apps.dass_analytics.services import StatisticsService
+from apps.dass_analytics.sketches import HyperLogLog, SketchService
+from apps.dass_analytics.trends import TrendService
+from apps.dass_analytics.utils import DassAnalyticsUtils
+from apps.manager.management.models import Team, TeamMembershipPeriod
+from apps.manager.management.services import Dass9TeamService
+
+
+def _team_with_history(manager, name: str, members, since: date = date(2000, 1, 1)) -> Team:
+    """
+    Команда, в которой сотрудники состоят с since: иначе результаты прошлых дат не относятся к команде.
+    Результаты нужно сохранять после создания команды.
+    """
+    team = Team.objects.create(name=name, manager=manager)
+    team.members.add(*members)
+    TeamMembershipPeriod.objects.filter(team=team).update(valid_from=since)
+    return team
+
+
+def _auth(user) -> dict:
+    return {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(user.id.int, user.is_manager)}"}
+
+
+class TeamsTestComparisonQueryCountTests(TestCase):
+    """
+    Сравнение команд считается одним запросом независимо от числа команд.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+
+    def _create_teams(self, count: int) -> None:
+        existing = Team.objects.count()
+        for index in range(existing, existing + count):
+            team = Team.objects.create(name=f"team-{index}", manager=self.manager)
+            employee = User.objects.create_user(f"employee-{index}", None, None, manager=self.manager)
+            team.members.add(employee)
+            Dass9Service.save_results_batch(employee.id, [
+                {"date": date.today() - timedelta(days=days), "depression": 1, "stress": 2, "anxiety": 3}
+                for days in (0, 8)
+            ])
+
+    def test_query_count_does_not_depend_on_team_count(self):
+        for total in (1, 25):
+            with self.subTest(teams=total):
+                self._create_teams(total - Team.objects.count())
+                with self.assertNumQueries(1):
+                    result = StatisticsService.get_teams_test_comparison(self.manager.id, period="week")
+                self.assertEqual(len(result["teams"]), total)
+                self.assertTrue(all(team["current_count"] == 1 for team in result["teams"]))
+
+
+class TrendRebuildOnDeleteTests(TestCase):
+    """
+    Удаление многих результатов пересчитывает тренд каждого пользователя один раз, после коммита.
+    """
+
+    def test_bulk_delete_rebuilds_each_user_once(self):
+        users = [User.objects.create_user(f"employee-{index}", None, None) for index in range(2)]
+        for user in users:
+            Dass9Service.save_results_batch(user.id, [
+                {"date": date.today() - timedelta(days=days), "depression": 1, "stress": 2, "anxiety": 3}
+                for days in range(5)
+            ])
+
+        with mock.patch.object(TrendService, "rebuild") as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                Dass9Result.objects.filter(user__in=users).delete()
+                rebuild.assert_not_called()
+
+        rebuild.assert_called_once()
+        self.assertEqual(set(rebuild.call_args.kwargs["user_ids"]), {user.id for user in users})
+
+    def test_rolled_back_delete_is_not_rebuilt(self):
+        users = [User.objects.create_user(f"employee-{index}", None, None) for index in range(2)]
+        for user in users:
+            Dass9Service.save_results_batch(user.id, [
+                {"date": date.today(), "depression": 1, "stress": 2, "anxiety": 3}
+            ])
+
+        with mock.patch.object(TrendService, "rebuild") as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        Dass9Result.objects.filter(user=users[0]).delete()
+                        raise IntegrityError
+                except IntegrityError:
+                    pass
+                Dass9Result.objects.filter(user=users[1]).delete()
+
+        rebuild.assert_called_once_with(user_ids={users[1].id})
+
+
+class CalendarBucketPropertyTests(SimpleTestCase):
+    """
+    Свойства периодов календаря на случайных датах, сдвигах и гранулярностях:
+    соседние периоды стыкуются без зазоров, ключ и границы взаимно обратны.
+    """
+
+    SAMPLES = 2000
+
+    def test_adjacent_buckets_are_contiguous_and_round_trip(self):
+        rng = random.Random(20240101)
+        span = (calendar.end - calendar.start).days
+        for _ in range(self.SAMPLES):
+            period = rng.choice(PERIODS)
+            offset = rng.randint(0, 60)
+            day = calendar.start + timedelta(days=rng.randint(0, span))
+            # предыдущий период должен целиком лежать в календаре
+            if calendar.key(day, period) - offset - 1 <= calendar.key(calendar.start, period):
+                continue
+            with self.subTest(day=day, period=period, offset=offset):
+                start, end = calendar.period(day, period, offset)
+                prev_start, prev_end = calendar.period(day, period, offset + 1)
+
+                self.assertEqual(prev_end + timedelta(days=1), start)
+                self.assertLessEqual(prev_start, prev_end)
+                self.assertLessEqual(start, end)
+                key = calendar.key(day, period) - offset
+                self.assertEqual(calendar.key(start, period), key)
+                self.assertEqual(calendar.key(end, period), key)
+                self.assertEqual(calendar.bounds(period, key), (start, end))
+                if offset == 0:
+                    self.assertTrue(start <= day <= end)
+
+
+class CalendarTableTests(TestCase):
+    """
+    Ключи календарной таблицы (по ним идёт JOIN в запросах) совпадают с календарём в памяти.
+    """
+
+    def test_table_keys_match_in_memory_calendar(self):
+        rng = random.Random(7)
+        span = (calendar.end - calendar.start).days
+        days = {calendar.start + timedelta(days=rng.randint(0, span)) for _ in range(200)}
+        rows = CalendarDay.objects.in_bulk(days)
+        self.assertEqual(set(rows), days)
+        for day, row in rows.items():
+            for period in PERIODS:
+                self.assertEqual(getattr(row, f"{period}_key"), calendar.key(day, period), (day, period))
+
+
+@skipUnless(connection.vendor == "postgresql", "материализованные представления есть только в Postgres")
+class TimeSeriesMaterializedViewTests(TestCase):
+    """
+    Временной ряд из материализованного представления совпадает с рядом по дневным агрегатам,
+    в том числе для крайних интервалов, лишь частично попадающих в [from_date, to_date].
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        for index in range(3):
+            employee = User.objects.create_user(f"employee-{index}", None, None, manager=self.manager)
+            Dass9Service.save_results_batch(employee.id, [
+                {"date": date.today() - timedelta(days=days), "depression": (days + index) % 10,
+                 "stress": days % 7, "anxiety": index}
+                for days in range(index, 120, 2)
+            ])
+        MaterializedViewService.create()
+        MaterializedViewService.refresh()
+
+    def test_view_and_rollups_agree_on_edge_buckets(self):
+        to_date = date.today() - timedelta(days=3)
+        for granularity in ("week", "month"):
+            for from_date in (to_date - timedelta(days=40), to_date - timedelta(days=100)):
+                with self.subTest(granularity=granularity, from_date=from_date):
+                    with override_settings(DASS_ANALYTICS_MV_MAX_STALENESS=3600):
+                        from_view = StatisticsService.get_time_series(
+                            self.manager.id, None, granularity, from_date, to_date
+                        )
+                    with override_settings(DASS_ANALYTICS_MV_MAX_STALENESS=None):
+                        from_rollups = StatisticsService.get_time_series(
+                            self.manager.id, None, granularity, from_date, to_date
+                        )
+                    self.assertEqual(from_view, from_rollups)
+
+
+class HyperLogLogMergeTests(SimpleTestCase):
+    """
+    Объединение скетчей на длинных целых совпадает с поэлементным максимумом регистров.
+    """
+
+    def test_merge_is_elementwise_max(self):
+        rng = random.Random(12)
+        for precision in (4, 10, 12, 16):
+            size = 1 << precision
+            with self.subTest(precision=precision):
+                left = bytearray(rng.choice((0, rng.randint(0, 64 - precision + 1))) for _ in range(size))
+                right = bytearray(rng.randint(0, 64 - precision + 1) for _ in range(size))
+                expected = bytearray(map(max, left, right))
+                merged = HyperLogLog(precision, bytearray(left)).merge(HyperLogLog(precision, right))
+                self.assertEqual(merged.registers, expected)
+
+
+class SketchUserDeleteTests(TestCase):
+    """
+    После удаления пользователя (каскадом удаляются его результаты и членства)
+    дневные скетчи команды совпадают с пересобранными с нуля.
+    """
+
+    def _sketches(self):
+        return {
+            (team_id, day): round(HyperLogLog.from_bytes(sketch).estimate())
+            for team_id, day, sketch in TeamDailySketch.objects.values_list("team_id", "date", "sketch")
+        }
+
+    def test_user_delete_removes_user_from_sketches(self):
+        manager = User.objects.create_user("manager", None, None, is_manager=True)
+        team = Team.objects.create(name="team", manager=manager)
+        employees = [User.objects.create_user(f"employee-{index}", None, None, manager=manager) for index in range(3)]
+        team.members.add(*employees)
+        for employee in employees:
+            Dass9Service.save_results_batch(employee.id, [
+                {"date": date.today(), "depression": 1, "stress": 2, "anxiety": 3}
+            ])
+        self.assertEqual(self._sketches(), {(team.id, date.today()): 3})
+
+        employees[0].delete()
+
+        self.assertEqual(self._sketches(), {(team.id, date.today()): 2})
+        SketchService.rebuild()
+        self.assertEqual(self._sketches(), {(team.id, date.today()): 2})
+
+
+
+class OrmResultWriteTests(TestCase):
+    """
+    Результаты, записанные через ORM (create/save/админка), попадают в агрегаты, тренды и скетчи
+    так же, как вставленные сервисом: производные данные совпадают с пересобранными с нуля.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.team = Team.objects.create(name="team", manager=self.manager)
+        self.employee = User.objects.create_user("employee", None, None, manager=self.manager)
+        self.team.members.add(self.employee)
+
+    def _derived_state(self):
+        rollup_fields = ("date", "test_count", "depression_sum", "depression_sq_sum", "stress_sum", "anxiety_sum")
+        return {
+            "team": list(TeamDailyRollup.objects.order_by("team_id", "date").values_list("team_id", *rollup_fields)),
+            "manager": list(
+                ManagerDailyRollup.objects.order_by("manager_id", "date").values_list("manager_id", *rollup_fields)
+            ),
+            "sketches": sorted(TeamDailySketch.objects.values_list("team_id", "date", "sketch")),
+            "trends": list(
+                EmployeeTrendState.objects.order_by("user_id")
+                .values_list("user_id", "results_count", "last_date", "depression_mean", "stress_mean")
+            ),
+        }
+
+    def _assert_matches_rebuild(self):
+        state = self._derived_state()
+        DailyRollupService.rebuild()
+        SketchService.rebuild()
+        TrendService.rebuild()
+        self.assertEqual(state, self._derived_state())
+
+    def test_orm_create_updates_derived_state(self):
+        Dass9Service.save_results_batch(self.employee.id, [
+            {"date": date.today() - timedelta(days=1), "depression": 1, "stress": 2, "anxiety": 3},
+        ])
+        version = analytics_cache.get_version(self.manager.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = Dass9Result.objects.create(user=self.employee, depression_score=5, stress_score=4, anxiety_score=0)
+
+        self.assertEqual(result.max_band, Dass9Result.SeverityBand.MODERATE)
+        rollup = TeamDailyRollup.objects.get(team=self.team, date=date.today())
+        self.assertEqual((rollup.test_count, rollup.depression_sum), (1, 5))
+        self.assertEqual(EmployeeTrendState.objects.get(user=self.employee).results_count, 2)
+        self.assertTrue(TeamDailySketch.objects.filter(team=self.team, date=date.today()).exists())
+        self.assertGreater(analytics_cache.get_version(self.manager.id), version)
+        self._assert_matches_rebuild()
+
+    def test_service_insert_is_counted_once(self):
+        Dass9Service.save_result({"user_id": self.employee.id.int}, depression=2, stress=2, anxiety=2)
+
+        rollup = TeamDailyRollup.objects.get(team=self.team, date=date.today())
+        self.assertEqual(rollup.test_count, 1)
+        self._assert_matches_rebuild()
+
+    def test_orm_score_update_updates_derived_state(self):
+        result = Dass9Result.objects.create(user=self.employee, depression_score=1, stress_score=1, anxiety_score=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result.depression_score = 8
+            result.save()
+
+        rollup = ManagerDailyRollup.objects.get(manager=self.manager, date=date.today())
+        self.assertEqual((rollup.test_count, rollup.depression_sum), (1, 8))
+        self._assert_matches_rebuild()
+
+
+class IpsOverviewPeriodTests(TestCase):
+    """
+    /ips_overview принимает все календарные периоды и отклоняет неизвестные до расчёта.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.manager.id.int, True)}"}
+
+    def _get(self, query: str):
+        return self.client.get(f"/api/dass_analytics/ips_overview?{query}", **self.headers)
+
+    def test_schema_periods_match_calendar(self):
+        self.assertEqual(get_args(Period), PERIODS)
+
+    def test_every_calendar_period_is_served(self):
+        for period in PERIODS:
+            with self.subTest(period=period):
+                response = self._get(f"period={period}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["period"], period)
+
+        response = self._get("periods=quarter&periods=day&periods=quarter")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p["period"] for p in response.json()["periods"]], ["quarter", "day"])
+
+    def test_unknown_period_is_rejected(self):
+        for query in ("period=fortnight", "periods=day&periods=fortnight"):
+            with self.subTest(query=query):
+                self.assertEqual(self._get(query).status_code, 422)
+
+
+@override_settings(DASS_ANALYTICS_MAX_BUCKETS=10)
+class TestCountBucketsTests(TestCase):
+    """
+    /test_count: N последовательных календарных периодов одним сгруппированным запросом.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        employees = [User.objects.create_user(f"employee-{i}", None, None, manager=self.manager) for i in range(2)]
+        self.team = _team_with_history(self.manager, "team", employees)
+        self.dates = {
+            employees[0]: [date.today() - timedelta(days=days) for days in (0, 7, 8, 30)],
+            employees[1]: [date.today() - timedelta(days=days) for days in (1, 15, 60)],
+        }
+        for employee, days in self.dates.items():
+            Dass9Service.save_results_batch(employee.id, [
+                {"date": day, "depression": 1, "stress": 1, "anxiety": 1} for day in days
+            ])
+
+    def _get(self, **params):
+        return self.client.get("/api/dass_analytics/test_count", {"team_id": self.team.id, **params}, **_auth(self.manager))
+
+    def test_buckets_are_contiguous_and_counted(self):
+        all_dates = [day for days in self.dates.values() for day in days]
+        for period, buckets in (("day", 3), ("week", 6), ("month", 4), ("quarter", 2)):
+            with self.subTest(period=period):
+                response = self._get(period=period, buckets=buckets)
+                self.assertEqual(response.status_code, 200)
+                periods = response.json()["periods"]
+
+                expected = [
+                    (start, end, sum(start <= day <= end for day in all_dates))
+                    for start, end in reversed(DassAnalyticsUtils.get_period_buckets(period, buckets))
+                ]
+                self.assertEqual(
+                    [(date.fromisoformat(p["start"]), date.fromisoformat(p["end"]), p["test_count"]) for p in periods],
+                    expected,
+                )
+                for previous, current in zip(periods, periods[1:]):
+                    self.assertEqual(date.fromisoformat(previous["end"]) + timedelta(days=1),
+                                     date.fromisoformat(current["start"]))
+                for p in periods:
+                    self.assertEqual(p["message"] is not None, p["test_count"] == 0)
+
+    def test_counts_with_one_grouped_query(self):
+        for buckets in (1, 10):
+            with self.subTest(buckets=buckets):
+                # владелец команды + один GROUP BY по ключам периодов
+                with self.assertNumQueries(2):
+                    StatisticsService.get_test_count(self.manager.id, self.team.id, period="day", buckets=buckets)
+
+    def test_bucket_limit_and_foreign_team(self):
+        self.assertEqual(self._get(buckets=11).status_code, 400)
+        self.assertEqual(self._get(buckets=0).status_code, 422)
+
+        other = User.objects.create_user("other", None, None, is_manager=True)
+        response = self.client.get(
+            "/api/dass_analytics/test_count", {"team_id": self.team.id}, **_auth(other)
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DASS_ANALYTICS_MV_MAX_STALENESS=None, DASS_ANALYTICS_MAX_SERIES_POINTS=60)
+class TimeSeriesTests(TestCase):
+    """
+    /time_series: взвешенные средние по интервалам, пустые интервалы и крайние интервалы по дням диапазона.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.employees = [User.objects.create_user(f"employee-{i}", None, None, manager=self.manager) for i in range(2)]
+        self.team = _team_with_history(self.manager, "team", self.employees[:1])
+        self.today = date.today()
+        self.results = []
+        for index, employee in enumerate(self.employees):
+            items = [
+                {"date": self.today - timedelta(days=days), "depression": (days + index) % 10,
+                 "stress": (2 * days) % 10, "anxiety": index}
+                for days in range(index, 70, 3) if days not in range(20, 35)
+            ]
+            Dass9Service.save_results_batch(employee.id, items)
+            self.results += [(employee, item) for item in items]
+
+    def _get(self, **params):
+        return self.client.get("/api/dass_analytics/time_series", params, **_auth(self.manager))
+
+    def _expected(self, granularity, from_date, to_date, members):
+        by_bucket = {}
+        for employee, item in self.results:
+            if employee in members and from_date <= item["date"] <= to_date:
+                bucket = calendar.period(item["date"], granularity)[0]
+                by_bucket.setdefault(bucket, []).append(item)
+        series = {"test_count": [], "depression": [], "stress": [], "anxiety": []}
+        for bucket in DassAnalyticsUtils.series_buckets(from_date, to_date, granularity):
+            items = by_bucket.get(bucket, [])
+            series["test_count"].append(len(items))
+            for subscale in ("depression", "stress", "anxiety"):
+                series[subscale].append(
+                    round(sum(item[subscale] for item in items) / len(items), 2) if items else None
+                )
+        return series
+
+    def test_series_matches_raw_results(self):
+        from_date, to_date = self.today - timedelta(days=60), self.today - timedelta(days=3)
+        for granularity in ("day", "week", "month"):
+            for team_id, members in ((None, self.employees), (self.team.id, self.employees[:1])):
+                with self.subTest(granularity=granularity, team=bool(team_id)):
+                    params = {"granularity": granularity, "from_date": from_date, "to_date": to_date}
+                    if team_id:
+                        params["team_id"] = team_id
+                    response = self._get(**params)
+                    self.assertEqual(response.status_code, 200)
+                    body = response.json()
+
+                    self.assertEqual(body["buckets"], [
+                        bucket.isoformat() for bucket in DassAnalyticsUtils.series_buckets(from_date, to_date, granularity)
+                    ])
+                    self.assertEqual(
+                        {key: body[key] for key in ("test_count", "depression", "stress", "anxiety")},
+                        self._expected(granularity, from_date, to_date, members),
+                    )
+
+    def test_gap_is_filled_with_empty_buckets(self):
+        body = self._get(
+            granularity="day", from_date=self.today - timedelta(days=33), to_date=self.today - timedelta(days=21)
+        ).json()
+        self.assertEqual(body["test_count"], [0] * 13)
+        self.assertEqual(body["depression"], [None] * 13)
+
+    def test_invalid_ranges(self):
+        self.assertEqual(self._get(from_date=self.today, to_date=self.today - timedelta(days=1)).status_code, 400)
+        self.assertEqual(self._get(granularity="day", from_date=self.today - timedelta(days=60)).status_code, 400)
+        self.assertEqual(self._get(granularity="year").status_code, 422)
+
+        other = User.objects.create_user("other", None, None, is_manager=True)
+        response = self.client.get("/api/dass_analytics/time_series", {"team_id": self.team.id}, **_auth(other))
+        self.assertEqual(response.status_code, 404)
+
+
+class PercentileFromHistogramTests(SimpleTestCase):
+    """
+    Перцентиль по гистограмме совпадает с percentile_cont по исходным значениям.
+    """
+
+    @staticmethod
+    def _percentile_cont(values, p):
+        values = sorted(values)
+        position = p * (len(values) - 1)
+        lower = int(position)
+        if lower + 1 >= len(values):
+            return float(values[lower])
+        return values[lower] + (values[lower + 1] - values[lower]) * (position - lower)
+
+    def test_matches_percentile_cont_on_random_samples(self):
+        rng = random.Random(17)
+        for _ in range(500):
+            values = [rng.randint(0, 9) for _ in range(rng.randint(1, 40))]
+            histogram = [values.count(value) for value in range(10)]
+            for p in (0.0, 0.5, 0.75, 0.9, 1.0):
+                self.assertAlmostEqual(
+                    DassAnalyticsUtils.percentile_from_histogram(histogram, p),
+                    self._percentile_cont(values, p),
+                    msg=(values, p),
+                )
+
+    def test_empty_histogram(self):
+        self.assertIsNone(DassAnalyticsUtils.percentile_from_histogram([0] * 10, 0.5))
+
+
+class DistributionTests(TestCase):
+    """
+    /distribution: гистограммы и перцентили подшкал; для команды — только результаты периода членства.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.employee = User.objects.create_user("employee", None, None, manager=self.manager)
+        self.today = date.today()
+        # в команде с 5 дней назад: более ранние результаты к команде не относятся
+        self.team = _team_with_history(self.manager, "team", [self.employee], since=self.today - timedelta(days=5))
+        self.depression = [0, 1, 1, 3, 5, 8, 9, 9, 2, 4]
+        Dass9Service.save_results_batch(self.employee.id, [
+            {"date": self.today - timedelta(days=days), "depression": score, "stress": 9 - score, "anxiety": 4}
+            for days, score in enumerate(self.depression)
+        ])
+
+    def _get(self, **params):
+        return self.client.get("/api/dass_analytics/distribution", params, **_auth(self.manager))
+
+    def test_manager_distribution(self):
+        body = self._get().json()
+
+        self.assertEqual(body["bins"], list(range(10)))
+        depression = body["depression"]
+        self.assertEqual(depression["histogram"], [self.depression.count(value) for value in range(10)])
+        self.assertEqual(depression["count"], 10)
+        self.assertEqual(depression["median"], 3.5)
+        self.assertAlmostEqual(depression["p90"], 9.0)
+        self.assertEqual(body["anxiety"]["histogram"], [0, 0, 0, 0, 10, 0, 0, 0, 0, 0])
+        self.assertEqual((body["anxiety"]["median"], body["anxiety"]["p75"]), (4.0, 4.0))
+
+    def test_team_distribution_uses_membership_at_result_date(self):
+        body = self._get(team_id=self.team.id).json()
+
+        self.assertEqual(body["depression"]["histogram"], [self.depression[:6].count(v) for v in range(10)])
+        self.assertEqual(body["depression"]["count"], 6)
+
+    def test_date_filter_and_empty_window(self):
+        body = self._get(from_date=self.today - timedelta(days=1)).json()
+        self.assertEqual(body["depression"]["count"], 2)
+        self.assertEqual(body["depression"]["median"], 0.5)
+
+        body = self._get(from_date=self.today + timedelta(days=1)).json()
+        self.assertEqual(body["stress"]["count"], 0)
+        self.assertIsNone(body["stress"]["median"])
+
+
+class AtRiskEmployeesTests(TestCase):
+    """
+    /at_risk: сотрудники со степенью не ниже min_band за окно дат, по частичному индексу.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.today = date.today()
+        self.severe, self.moderate, self.calm, self.old = (
+            User.objects.create_user(name, None, None, manager=self.manager, full_name=name.title())
+            for name in ("severe", "moderate", "calm", "old")
+        )
+        self._save(self.severe, 1, 9, 0, 3)
+        self._save(self.severe, 3, 0, 5, 0)
+        self._save(self.moderate, 0, 5, 6, 1)
+        self._save(self.calm, 0, 1, 2, 0)
+        self._save(self.old, 10, 9, 9, 9)
+        other_manager = User.objects.create_user("other", None, None, is_manager=True)
+        self._save(User.objects.create_user("stranger", None, None, manager=other_manager), 0, 9, 9, 9)
+
+    def _save(self, user, days_ago, depression, stress, anxiety):
+        Dass9Service.save_results_batch(user.id, [{
+            "date": self.today - timedelta(days=days_ago),
+            "depression": depression, "stress": stress, "anxiety": anxiety,
+        }])
+
+    def _get(self, **params):
+        return self.client.get("/api/dass_analytics/at_risk", params, **_auth(self.manager))
+
+    def test_default_window_lists_severe_only(self):
+        body = self._get().json()
+
+        self.assertEqual(body["min_band"], Dass9Result.SeverityBand.SEVERE)
+        self.assertEqual(body["from_date"], (self.today - timedelta(days=6)).isoformat())
+        self.assertEqual([employee["username"] for employee in body["employees"]], ["severe"])
+        severe = body["employees"][0]
+        self.assertEqual(severe["full_name"], "Severe")
+        # только результаты не ниже min_band: второй результат (умеренный стресс) не учитывается
+        self.assertEqual(severe["results_count"], 1)
+        self.assertEqual(
+            (severe["max_band"], severe["depression_band"], severe["stress_band"], severe["anxiety_band"]),
+            (3, 3, 0, 1),
+        )
+
+    def test_moderate_band_and_ordering(self):
+        body = self._get(min_band=Dass9Result.SeverityBand.MODERATE).json()
+
+        self.assertEqual([employee["username"] for employee in body["employees"]], ["severe", "moderate"])
+        self.assertEqual(body["employees"][0]["results_count"], 2)
+        self.assertEqual(body["employees"][0]["stress_band"], Dass9Result.SeverityBand.MODERATE)
+
+    def test_window_and_band_validation(self):
+        body = self._get(from_date=self.today - timedelta(days=30)).json()
+        self.assertEqual({employee["username"] for employee in body["employees"]}, {"severe", "old"})
+        self.assertEqual(self._get(min_band=Dass9Result.SeverityBand.MILD).status_code, 422)
+
+    @skipUnless(connection.vendor == "postgresql", "план запроса проверяется в Postgres")
+    def test_results_are_read_from_partial_index(self):
+        queryset = Dass9Result.objects.filter(
+            date__range=[self.today - timedelta(days=6), self.today],
+            max_band__gte=Dass9Result.SeverityBand.SEVERE,
+        ).values("user_id", "max_band", "depression_band", "stress_band", "anxiety_band")
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+        self.assertIn("dass9result_at_risk_idx", plan)
+
+
+class TeamScopeAtDateTests(TestCase):
+    """
+    /at_risk и /alerts по команде учитывают состав команды на дату результата, а не текущий.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.today = date.today()
+        self.joined, self.left, self.outsider = (
+            User.objects.create_user(name, None, None, manager=self.manager) for name in ("joined", "left", "outsider")
+        )
+        self.team = Team.objects.create(name="team", manager=self.manager)
+        # joined — в команде три дня, left — была в команде до вчерашнего дня и вышла
+        self.team.members.add(self.joined)
+        TeamMembershipPeriod.objects.filter(team=self.team).update(valid_from=self.today - timedelta(days=3))
+        TeamMembershipPeriod.objects.create(
+            team=self.team, user=self.left, valid_from=date(2000, 1, 1), valid_to=self.today - timedelta(days=1)
+        )
+        for user, days_ago in ((self.joined, 5), (self.left, 2), (self.outsider, 1)):
+            Dass9Service.save_results_batch(user.id, [
+                {"date": self.today - timedelta(days=days_ago), "depression": 9, "stress": 9, "anxiety": 9}
+            ])
+
+    def _get(self, path, **params):
+        return self.client.get(f"/api/dass_analytics/{path}", {"team_id": self.team.id, **params}, **_auth(self.manager))
+
+    def test_at_risk_uses_membership_at_result_date(self):
+        body = self._get("at_risk").json()
+        self.assertEqual([employee["username"] for employee in body["employees"]], ["left"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Dass9Service.save_results_batch(self.joined.id, [
+                {"date": self.today, "depression": 9, "stress": 0, "anxiety": 0}
+            ])
+        body = self._get("at_risk").json()
+        self.assertEqual([employee["username"] for employee in body["employees"]], ["joined", "left"])
+        self.assertEqual(body["employees"][0]["results_count"], 1)
+
+    def test_alerts_use_membership_at_last_result_date(self):
+        EmployeeTrendState.objects.update(max_z=5.0)
+
+        body = self._get("alerts", threshold=2).json()
+        self.assertEqual([alert["username"] for alert in body["alerts"]], ["left"])
+
+        # без команды — все сотрудники руководителя
+        body = self.client.get("/api/dass_analytics/alerts", {"threshold": 2}, **_auth(self.manager)).json()
+        self.assertEqual(sorted(alert["username"] for alert in body["alerts"]), ["joined", "left", "outsider"])
+
+
+@override_settings(DASS_ANALYTICS_MAX_BUCKETS=10)
+class DashboardEndpointTests(TransactionTestCase):
+    """
+    /dashboard: панели считаются параллельно в пуле потоков (у каждого потока своё соединение)
+    и совпадают с ответами отдельных эндпоинтов.
+    """
+
+    def setUp(self):
+        self.client = AsyncClient()
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        employees = [User.objects.create_user(f"employee-{i}", None, None, manager=self.manager) for i in range(2)]
+        self.team = _team_with_history(self.manager, "team", employees[:1])
+        for index, employee in enumerate(employees):
+            Dass9Service.save_results_batch(employee.id, [
+                {"date": date.today() - timedelta(days=days), "depression": index + days % 3, "stress": 2, "anxiety": 1}
+                for days in range(0, 20, 2)
+            ])
+
+    def _get(self, query: str = "", user=None):
+        user = user or self.manager
+        return asyncio.run(self.client.get(
+            f"/api/dass_analytics/dashboard?{query}",
+            headers={"Authorization": f"Bearer {create_access_token(user.id.int, user.is_manager)}"},
+        ))
+
+    def test_panels_match_individual_services(self):
+        response = self._get(f"period=month&team_id={self.team.id}&buckets=3")
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(set(body), set(PANELS))
+        expected = {
+            "ips_overview": StatisticsService.get_ips_overview(self.manager.id, period="month"),
+            "test_count": StatisticsService.get_test_count(self.manager.id, str(self.team.id), "month", 3),
+            "test_count_common": StatisticsService.get_teams_test_comparison(self.manager.id, period="month"),
+            "all_teams_dass9_results": Dass9TeamService.get_all_teams_results(self.manager.id),
+        }
+        self.assertEqual(body, json.loads(DashboardOut(**expected).model_dump_json()))
+
+    def test_selected_panels_only(self):
+        body = self._get("panels=test_count&panels=ips_overview&panels=test_count").json()
+
+        self.assertEqual({panel for panel, value in body.items() if value is not None}, {"ips_overview", "test_count"})
+        # без team_id — все сотрудники руководителя
+        expected = StatisticsService.get_test_count(self.manager.id, None, "week", 4)
+        self.assertEqual(body["test_count"]["periods"], json.loads(TestCountOut(**expected).model_dump_json())["periods"])
+        self.assertEqual(sum(period["test_count"] for period in body["test_count"]["periods"]),
+                         Dass9Result.objects.filter(date__gte=expected["periods"][0]["start"]).count())
+
+    def test_panels_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_for_other_panel(original):
+            def wrapper(*args, **kwargs):
+                barrier.wait()
+                return original(*args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(StatisticsService, "get_ips_overview",
+                               wait_for_other_panel(StatisticsService.get_ips_overview)), \
+                mock.patch.object(StatisticsService, "get_teams_test_comparison",
+                                  wait_for_other_panel(StatisticsService.get_teams_test_comparison)):
+            # последовательное выполнение панелей упёрлось бы в барьер и завершилось ошибкой
+            response = self._get("panels=ips_overview&panels=test_count_common")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(barrier.broken)
+
+    def test_errors(self):
+        other = User.objects.create_user("other", None, None, is_manager=True)
+        self.assertEqual(self._get(f"team_id={self.team.id}", user=other).status_code, 404)
+        self.assertEqual(self._get("team_id=not-a-uuid").status_code, 404)
+        self.assertEqual(self._get("buckets=11").status_code, 400)
+        self.assertEqual(self._get("panels=unknown").status_code, 422)
+
+        employee = User.objects.get(username="employee-0")
+        self.assertEqual(self._get(user=employee).status_code, 403)
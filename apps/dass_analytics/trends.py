@@ -0,0 +1,156 @@
+import math
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.assessments.dass.models import Dass9Result
+from apps.dass_analytics.models import EmployeeTrendState
+from apps.dass_analytics.rollups import SUBSCALES
+
+STATE_FIELDS = [
+    f"{subscale}_{suffix}" for subscale in SUBSCALES for suffix in ("mean", "var", "z")
+] + ["results_count", "last_date", "max_z"]
+BACKFILL_CHUNK_SIZE = 2000
+
+
+class TrendService:
+    """
+    Инкрементальное ведение EWMA-среднего и дисперсии баллов каждого сотрудника.
+
+    Новый результат обновляет состояние за O(1): z-оценка считается относительно
+    состояния до результата, затем среднее и дисперсия сдвигаются с весом alpha.
+    """
+
+    @staticmethod
+    def _params() -> Dict[str, float]:
+        return {
+            "alpha": getattr(settings, "DASS_TREND_ALPHA", 0.3),
+            "min_history": getattr(settings, "DASS_TREND_MIN_HISTORY", 3),
+            "min_std": getattr(settings, "DASS_TREND_MIN_STD", 1.0),
+        }
+
+    @staticmethod
+    def _step(state: EmployeeTrendState, result: Dict, params: Dict[str, float]) -> None:
+        alpha = params["alpha"]
+        z_scores = []
+        for subscale in SUBSCALES:
+            score = result[f"{subscale}_score"]
+            if state.results_count == 0:
+                mean, var, z = float(score), 0.0, None
+            else:
+                mean = getattr(state, f"{subscale}_mean")
+                var = getattr(state, f"{subscale}_var")
+                z = None
+                if state.results_count >= params["min_history"]:
+                    z = (score - mean) / max(math.sqrt(var), params["min_std"])
+                    z_scores.append(z)
+                diff = score - mean
+                increment = alpha * diff
+                mean += increment
+                var = (1 - alpha) * (var + diff * increment)
+            setattr(state, f"{subscale}_mean", mean)
+            setattr(state, f"{subscale}_var", var)
+            setattr(state, f"{subscale}_z", z)
+        state.max_z = max(z_scores) if z_scores else None
+        state.results_count += 1
+        state.last_date = result["date"]
+
+    @staticmethod
+    def _save(states: List[EmployeeTrendState]) -> None:
+        EmployeeTrendState.objects.bulk_create(
+            states,
+            batch_size=BACKFILL_CHUNK_SIZE,
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=STATE_FIELDS,
+        )
+
+    @staticmethod
+    def apply_results(results: List[Dict]) -> None:
+        """
+        Обновляет состояния сотрудников по новым результатам.
+        Если результат старше последнего учтённого (офлайн-синхронизация),
+        состояние сотрудника пересчитывается по истории.
+        """
+        if not results:
+            return
+        params = TrendService._params()
+        by_user = defaultdict(list)
+        for r in results:
+            by_user[r["user_id"]].append(r)
+
+        with transaction.atomic():
+            states = EmployeeTrendState.objects.select_for_update().in_bulk(list(by_user))
+            recompute = []
+            updated = []
+            for user_id, user_results in by_user.items():
+                user_results.sort(key=lambda r: r["date"])
+                state = states.get(user_id)
+                if state is not None and user_results[0]["date"] <= state.last_date:
+                    recompute.append(user_id)
+                    continue
+                if state is None:
+                    state = EmployeeTrendState(user_id=user_id, last_date=user_results[0]["date"])
+                for r in user_results:
+                    TrendService._step(state, r, params)
+                updated.append(state)
+            TrendService._save(updated)
+        if recompute:
+            TrendService.rebuild(user_ids=recompute)
+
+    @staticmethod
+    def rebuild(user_ids: Optional[Iterable] = None) -> Dict[str, int]:
+        """
+        Пересчитывает состояния по истории одним потоковым проходом,
+        отсортированным по (user, date); сохраняет пачками.
+        """
+        params = TrendService._params()
+        results = Dass9Result.objects.all() if user_ids is None else Dass9Result.objects.filter(
+            user_id__in=list(user_ids)
+        )
+        rows = (
+            results.order_by("user_id", "date")
+            .values("user_id", "date", "depression_score", "stress_score", "anxiety_score")
+        )
+
+        saved = 0
+        pending: List[EmployeeTrendState] = []
+        state: Optional[EmployeeTrendState] = None
+        with transaction.atomic():
+            if user_ids is None:
+                EmployeeTrendState.objects.all().delete()
+            else:
+                EmployeeTrendState.objects.filter(user_id__in=list(user_ids)).delete()
+
+            for row in rows.iterator(chunk_size=BACKFILL_CHUNK_SIZE):
+                if state is None or state.user_id != row["user_id"]:
+                    state = EmployeeTrendState(user_id=row["user_id"], last_date=row["date"])
+                    pending.append(state)
+                    if len(pending) > BACKFILL_CHUNK_SIZE:
+                        # все состояния, кроме текущего, уже досчитаны
+                        TrendService._save(pending[:-1])
+                        saved += len(pending) - 1
+                        pending = pending[-1:]
+                TrendService._step(state, row, params)
+            TrendService._save(pending)
+            saved += len(pending)
+        return {"states": saved}
+
+    @staticmethod
+    def get_alerts(scope, threshold: float, since: date):
+        """
+        Состояния сотрудников, подходящих под условие scope (Q или Exists по состоянию),
+        у которых z-оценка последнего результата (не раньше since) по какой-либо подшкале не ниже threshold.
+        """
+        return (
+            EmployeeTrendState.objects.filter(
+                scope,
+                max_z__gte=threshold,
+                last_date__gte=since,
+            )
+            .select_related("user")
+            .order_by("-max_z")
+        )
@@ -1,30 +1,19 @@
-from datetime import date, timedelta
+from datetime import date
+from typing import List, Optional, Tuple
+
+from apps.dass_analytics.calendar import calendar
 
 class DassAnalyticsUtils:
 
     @staticmethod
     def get_current_and_previous_period_dates(period: str):
+        """
+        Границы текущего календарного периода (дня, ISO-недели, месяца, года),
+        в который попадает сегодняшний день, и предыдущего периода.
+        """
         today = date.today()
-
-        if period == "day":
-            days = 1
-        elif period == "week":
-            days = 7
-        elif period == "month":
-            days = 31
-        elif period == "year":
-            days = 365
-        else:
-            raise ValueError("Invalid period")
-
-        # текущий период: последние N дней
-        end = today
-        start = end - timedelta(days=days - 1)
-
-        # предыдущий период: предыдущие N дней до текущего
-        prev_end = start - timedelta(days=1)
-        prev_start = prev_end - timedelta(days=days - 1)
-
+        start, end = calendar.period(today, period)
+        prev_start, prev_end = calendar.period(today, period, offset=1)
         return start, end, prev_start, prev_end
 
     @staticmethod
@@ -32,21 +21,47 @@ class DassAnalyticsUtils:
         """
         Возвращает начало и конец периода с учётом смещения offset (0 — текущий, 1 — предыдущий и т.д.)
         """
-        today = date.today()
+        return calendar.period(date.today(), period, offset)
+
+    @staticmethod
+    def get_period_buckets(period: str, count: int) -> List[Tuple[date, date]]:
+        """
+        Возвращает count последовательных календарных периодов (от текущего к более старым).
+        Периоды не пересекаются и идут без пропусков.
+        """
+        return [DassAnalyticsUtils.get_period_dates(period, offset) for offset in range(count)]
+
+    @staticmethod
+    def series_buckets(from_date: date, to_date: date, granularity: str) -> List[date]:
+        """
+        Начала всех периодов granularity, пересекающих диапазон [from_date, to_date].
+        """
+        first = calendar.key(from_date, granularity)
+        last = calendar.key(to_date, granularity)
+        return [calendar.bounds(granularity, key)[0] for key in range(first, last + 1)]
+
+    @staticmethod
+    def percentile_from_histogram(counts: List[int], p: float) -> Optional[float]:
+        """
+        Перцентиль с линейной интерполяцией (как percentile_cont в Postgres)
+        по гистограмме целых значений: counts[v] — количество значений v.
+        """
+        total = sum(counts)
+        if not total:
+            return None
+        position = p * (total - 1)
+        lower_rank = int(position)
+        fraction = position - lower_rank
+
+        def value_at(rank: int) -> int:
+            seen = 0
+            for value, count in enumerate(counts):
+                seen += count
+                if rank < seen:
+                    return value
+            return len(counts) - 1
 
-        if period == "day":
-            start = today - timedelta(days=offset)
-            end = start
-        elif period == "week":
-            end = today - timedelta(weeks=offset)
-            start = end - timedelta(days=6)
-        elif period == "month":
-            end = today.replace(day=1) - timedelta(days=offset * 30)
-            start = end - timedelta(days=30)
-        elif period == "year":
-            end = date(today.year - offset, 12, 31)
-            start = date(today.year - offset, 1, 1)
-        else:
-            raise ValueError("Invalid period type")
-
-        return start, end
\ No newline at end of file
+        lower = value_at(lower_rank)
+        if not fraction:
+            return float(lower)
+        return lower + (value_at(lower_rank + 1) - lower) * fraction
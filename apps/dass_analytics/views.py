@@ -1,38 +1,61 @@
+from django.conf import settings
 from ninja import Router, Query
-from typing import Optional
+from ninja.errors import HttpError
+from datetime import date, timedelta
+from typing import Optional, List, Union, Literal
+from apps.assessments.dass.models import Dass9Result
 from apps.auth_user.permissions import JWTAuthManager
+from apps.dass_analytics.cache import cached_analytics
 from apps.dass_analytics.services import StatisticsService
-from apps.dass_analytics.schemas import MentalStatisticsOut, TestCountOut, TeamsTestComparisonOut, TeamsTestComparisonIn
+from apps.dass_analytics.utils import DassAnalyticsUtils
+from apps.dass_analytics.schemas import MentalStatisticsOut, TestCountOut, TeamsTestComparisonOut, TeamsTestComparisonIn, \
+    MentalStatisticsMultiOut, TimeSeriesOut, DistributionOut, AtRiskEmployeesOut, TrendAlertsOut, DashboardOut, \
+    ParticipationOut, Period
+from apps.dass_analytics.dashboard import DashboardService, PANELS
 
 router = Router(tags=["Аналитика DASS"])
 
-@router.get("/ips_overview", response=MentalStatisticsOut, auth=JWTAuthManager())
+@router.get("/ips_overview", response=Union[MentalStatisticsMultiOut, MentalStatisticsOut], auth=JWTAuthManager())
+@cached_analytics("ips_overview")
 def get_mental_statistics(
         request,
-        period: Optional[str] = Query("day", description="day | week | month | year")
+        period: Period = Query("day", description="day | week | month | quarter | year"),
+        periods: Optional[List[Period]] = Query(None, description="Несколько периодов сразу: periods=day&periods=week")
 ):
     """
     Возвращает статистику IPS, тревожности, депрессии и стресса
     с динамикой изменения за предыдущий период.
+    Если передан `periods`, возвращается статистика по каждому из них (считается одним запросом).
     """
     manager_id = request.auth["user_id"]
+    if periods:
+        return {"periods": StatisticsService.get_ips_overviews(manager_id, periods=list(dict.fromkeys(periods)))}
     return StatisticsService.get_ips_overview(manager_id, period=period)
 
 @router.get("/test_count", response=TestCountOut, auth=JWTAuthManager())
+@cached_analytics("test_count")
 def get_test_count(
         request,
-        period: Optional[str] = Query("week", description="day | week | month | year"),
-        team_id: str = Query(..., description="ID команды (обязательно)")
+        period: Period = Query("week", description="day | week | month | quarter | year"),
+        team_id: str = Query(..., description="ID команды (обязательно)"),
+        buckets: int = Query(4, ge=1, description="Количество периодов (по умолчанию 4)")
 ):
     """
-    Возвращает количество прохождений теста DASS9 за последние 4 периода
-    (дня, недели, месяца или года) для выбранной команды.
+    Возвращает количество прохождений теста DASS9 за последние `buckets` периодов
+    (дней, недель, месяцев или лет) для выбранной команды.
     Если в периоде нет данных — добавляется сообщение "Данные ещё не собраны".
     """
+    max_buckets = getattr(settings, "DASS_ANALYTICS_MAX_BUCKETS", 104)
+    if buckets > max_buckets:
+        raise HttpError(400, f"Можно запросить не больше {max_buckets} периодов")
     manager_id = request.auth["user_id"]
-    return StatisticsService.get_test_count(manager_id, team_id=team_id, period=period)
+    try:
+        return StatisticsService.get_test_count(manager_id, team_id=team_id, period=period, buckets=buckets)
+    except ValueError as exc:
+        raise HttpError(400, str(exc))
 
 @router.post("/test_count_common", response=TeamsTestComparisonOut, auth=JWTAuthManager())
+@cached_analytics("test_count_common")
 def get_teams_test_comparison(request, payload: TeamsTestComparisonIn):
     """
     Возвращает количество прохождений теста DASS9 для всех (или выбранных) команд
@@ -43,4 +66,145 @@ def get_teams_test_comparison(request, payload: TeamsTestComparisonIn):
         manager_id,
         period=payload.period,
         team_ids=payload.team_ids
-    )
\ No newline at end of file
+    )
+@router.get("/time_series", response=TimeSeriesOut, auth=JWTAuthManager())
+@cached_analytics("time_series")
+def get_time_series(
+        request,
+        granularity: Literal["day", "week", "month", "quarter"] = Query("week"),
+        team_id: Optional[str] = Query(None, description="ID команды; без него — все сотрудники руководителя"),
+        from_date: Optional[date] = Query(None, description="По умолчанию — год назад"),
+        to_date: Optional[date] = Query(None, description="По умолчанию — сегодня"),
+):
+    """
+    Временной ряд средних DASS-9 (депрессия, стресс, тревожность) и количества тестов,
+    сгруппированный по дням, неделям, месяцам или кварталам. Пустые интервалы дополняются.
+    """
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=365)
+    if from_date > to_date:
+        raise HttpError(400, "from_date должна быть не позже to_date")
+
+    max_points = getattr(settings, "DASS_ANALYTICS_MAX_SERIES_POINTS", 1000)
+    try:
+        points = len(DassAnalyticsUtils.series_buckets(from_date, to_date, granularity))
+    except ValueError as exc:
+        raise HttpError(400, str(exc))
+    if points > max_points:
+        raise HttpError(400, f"Слишком длинный ряд: не больше {max_points} точек")
+
+    manager_id = request.auth["user_id"]
+    return StatisticsService.get_time_series(manager_id, team_id, granularity, from_date, to_date)
+
+@router.get("/distribution", response=DistributionOut, auth=JWTAuthManager())
+@cached_analytics("distribution")
+def get_distribution(
+        request,
+        team_id: Optional[str] = Query(None, description="ID команды; без него — все сотрудники руководителя"),
+        from_date: Optional[date] = Query(None),
+        to_date: Optional[date] = Query(None),
+):
+    """
+    Распределение баллов по подшкалам DASS-9: медиана, p75, p90
+    и гистограмма по значениям баллов 0..9 за диапазон дат.
+    """
+    manager_id = request.auth["user_id"]
+    return StatisticsService.get_distribution(manager_id, team_id, from_date, to_date)
+
+@router.get("/at_risk", response=AtRiskEmployeesOut, auth=JWTAuthManager())
+@cached_analytics("at_risk")
+def get_at_risk_employees(
+        request,
+        team_id: Optional[str] = Query(None, description="ID команды; без него — все сотрудники руководителя"),
+        from_date: Optional[date] = Query(None, description="По умолчанию — 6 дней назад"),
+        to_date: Optional[date] = Query(None, description="По умолчанию — сегодня"),
+        min_band: int = Query(
+            Dass9Result.SeverityBand.SEVERE,
+            ge=Dass9Result.AT_RISK_BAND,
+            le=Dass9Result.SeverityBand.SEVERE,
+            description="Минимальная степень: 2 — умеренная, 3 — тяжёлая",
+        ),
+):
+    """
+    Сотрудники в группе риска: степень выраженности депрессии, стресса или тревожности
+    не ниже min_band хотя бы в одном тесте за окно дат (по умолчанию — последние 7 дней).
+    """
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=6)
+    manager_id = request.auth["user_id"]
+    return StatisticsService.get_at_risk_employees(manager_id, team_id, from_date, to_date, min_band)
+
+@router.get("/alerts", response=TrendAlertsOut, auth=JWTAuthManager())
+@cached_analytics("alerts")
+def get_trend_alerts(
+        request,
+        team_id: Optional[str] = Query(None, description="ID команды; без него — все сотрудники руководителя"),
+        threshold: Optional[float] = Query(None, gt=0, description="Порог z-оценки (по умолчанию из настроек)"),
+        days: int = Query(14, ge=1, le=365, description="Учитывать последние результаты не старше N дней"),
+):
+    """
+    Сотрудники, чьи баллы в последнем тесте резко выросли относительно
+    их собственной базовой линии (z-оценка по EWMA не ниже порога).
+    """
+    threshold = threshold or getattr(settings, "DASS_TREND_Z_THRESHOLD", 2.0)
+    manager_id = request.auth["user_id"]
+    return StatisticsService.get_trend_alerts(
+        manager_id, team_id, threshold, date.today() - timedelta(days=days - 1)
+    )
+
+@router.get("/participation", response=ParticipationOut, auth=JWTAuthManager())
+@cached_analytics("participation")
+def get_participation(
+        request,
+        period: Period = Query("week"),
+        team_id: Optional[str] = Query(None, description="ID команды; без него — все команды руководителя"),
+        buckets: int = Query(4, ge=1, description="Количество периодов (по умолчанию 4)"),
+        mode: Literal["exact", "approx"] = Query("exact", description="exact — точный подсчёт, approx — по HLL-скетчам"),
+):
+    """
+    Доля сотрудников команды, прошедших тест DASS-9 хотя бы раз за период,
+    по каждой команде и каждому из последних `buckets` периодов.
+    В режиме approx число участников оценивается объединением дневных HyperLogLog-скетчей
+    (ошибка порядка 1–2%), что дешевле на длинных диапазонах.
+    """
+    max_buckets = getattr(settings, "DASS_ANALYTICS_MAX_BUCKETS", 104)
+    if buckets > max_buckets:
+        raise HttpError(400, f"Можно запросить не больше {max_buckets} периодов")
+    manager_id = request.auth["user_id"]
+    try:
+        return StatisticsService.get_participation(manager_id, team_id, period=period, buckets=buckets, mode=mode)
+    except ValueError as exc:
+        raise HttpError(400, str(exc))
+
+@router.get("/dashboard", response=DashboardOut, auth=JWTAuthManager())
+async def get_dashboard(
+        request,
+        panels: Optional[List[Literal[PANELS]]] = Query(
+            None, description="Панели: panels=ips_overview&panels=test_count; по умолчанию — все"
+        ),
+        period: Period = Query("week"),
+        team_id: Optional[str] = Query(None, description="Команда для test_count; без неё — все сотрудники руководителя"),
+        buckets: int = Query(4, ge=1, description="Количество периодов для test_count"),
+        from_date: Optional[date] = Query(None, description="Начало диапазона для all_teams_dass9_results"),
+        to_date: Optional[date] = Query(None, description="Конец диапазона для all_teams_dass9_results"),
+):
+    """
+    Сводные данные стартовой страницы руководителя одним запросом:
+    ips_overview, test_count, test_count_common и all_teams_dass9_results.
+
+    - Токен и принадлежность команды проверяются один раз.
+    - Выбранные панели считаются параллельно в пуле потоков, каждая со своим соединением с БД.
+    """
+    max_buckets = getattr(settings, "DASS_ANALYTICS_MAX_BUCKETS", 104)
+    if buckets > max_buckets:
+        raise HttpError(400, f"Можно запросить не больше {max_buckets} периодов")
+    manager_id = request.auth["user_id"]
+    return await DashboardService.build(
+        manager_id,
+        panels or PANELS,
+        period=period,
+        team_id=team_id,
+        buckets=buckets,
+        from_date=from_date,
+        to_date=to_date,
+    )
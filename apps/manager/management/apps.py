@@ -1,4 +1,7 @@
 from django.apps import AppConfig
 
 class ManagementConfig(AppConfig):
-    name = 'apps.manager.management'
\ No newline at end of file
+    name = 'apps.manager.management'
+
+    def ready(self):
+        from . import receivers  # noqa: F401
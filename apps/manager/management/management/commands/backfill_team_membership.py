@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.manager.management.services import TeamMembershipService
+
+
+class Command(BaseCommand):
+    help = "Создаёт периоды истории членства для текущего состава команд (после чего нужен rebuild_dass_rollups)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--valid-from",
+            type=date.fromisoformat,
+            default=date.fromisoformat(getattr(settings, "DASS_CALENDAR_START", "2000-01-01")),
+            help="С какой даты считать текущее членство (YYYY-MM-DD)",
+        )
+
+    def handle(self, *args, **options):
+        created = TeamMembershipService.backfill(options["valid_from"])
+        self.stdout.write(f"created={created} valid_from={options['valid_from']}")
@@ -0,0 +1,51 @@
+import sys
+import uuid
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import Http404
+from ninja.errors import HttpError
+
+from apps.auth_user.models import User
+from apps.manager.management.services import Dass9ExportService
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка сырых результатов DASS-9 сотрудников руководителя в CSV или Arrow IPC"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--manager", required=True, help="username руководителя")
+        parser.add_argument("--team", type=uuid.UUID, default=None, help="ID команды (по умолчанию — все сотрудники)")
+        parser.add_argument("--from-date", type=date.fromisoformat, default=None, help="YYYY-MM-DD")
+        parser.add_argument("--to-date", type=date.fromisoformat, default=None, help="YYYY-MM-DD")
+        parser.add_argument("--format", choices=Dass9ExportService.FORMATS, default="csv")
+        parser.add_argument("--output", default="-", help="Путь к файлу (по умолчанию — stdout)")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Размер чанка чтения")
+
+    def handle(self, *args, **options):
+        try:
+            manager = User.objects.get(username=options["manager"], is_manager=True)
+        except User.DoesNotExist:
+            raise CommandError("Руководитель с таким username не найден")
+        if options["format"] == "arrow" and not Dass9ExportService.arrow_available():
+            raise CommandError("Для формата arrow нужен pyarrow")
+
+        try:
+            rows = Dass9ExportService.rows(manager.id, options["team"], options["from_date"], options["to_date"])
+        except HttpError as exc:
+            raise CommandError(str(exc))
+        except Http404:
+            raise CommandError("Команда не найдена или не принадлежит руководителю")
+
+        if options["format"] == "csv":
+            chunks = (chunk.encode() for chunk in Dass9ExportService.iter_csv(rows, options["chunk_size"]))
+        else:
+            chunks = Dass9ExportService.iter_arrow(rows, options["chunk_size"])
+
+        output = sys.stdout.buffer if options["output"] == "-" else open(options["output"], "wb")
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from ninja.errors import HttpError
+
+from apps.auth_user.models import User
+from apps.manager.management.services import EmployeeImportService
+
+
+class Command(BaseCommand):
+    help = "Массовый импорт сотрудников из CSV или JSON с закреплением за руководителем"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу .csv или .json")
+        parser.add_argument("--manager", required=True, help="username руководителя")
+        parser.add_argument("--format", choices=["csv", "json"], default=None,
+                            help="Формат файла (по умолчанию — по расширению)")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Размер чанка bulk_create")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        file_format = options["format"] or ("csv" if path.suffix.lower() == ".csv" else "json")
+
+        try:
+            manager = User.objects.get(username=options["manager"], is_manager=True)
+        except User.DoesNotExist:
+            raise CommandError("Руководитель с таким username не найден")
+
+        try:
+            with path.open("rb") as stream:
+                rows = EmployeeImportService.parse_rows(stream, file_format)
+                result = EmployeeImportService.import_employees(manager.id, rows, chunk_size=options["chunk_size"])
+        except HttpError as exc:
+            raise CommandError(str(exc))
+
+        for error in result["errors"]:
+            self.stderr.write(f"row {error['row']} ({error['username']}): {error['error']}")
+        self.stdout.write(f"created={result['created']} failed={result['failed']}")
@@ -32,3 +32,31 @@ class TeamLead(models.Model):
 
     class Meta:
         unique_together = ("team", "user")
+
+class TeamMembershipPeriod(models.Model):
+    """
+    История состава команды: пользователь состоял в команде в днях [valid_from, valid_to).
+    valid_to = NULL — участник сейчас в команде.
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name="membership_periods")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="team_membership_periods"
+    )
+    valid_from = models.DateField()
+    valid_to = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["team", "user"],
+                condition=models.Q(valid_to__isnull=True),
+                name="team_membership_open_period_uniq",
+            ),
+        ]
+        indexes = [
+            # «в какой команде был пользователь на дату результата»
+            models.Index(fields=["user", "valid_from", "valid_to"], name="team_membership_user_idx"),
+            models.Index(fields=["team", "valid_from", "valid_to"], name="team_membership_team_idx"),
+        ]
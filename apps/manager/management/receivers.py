@@ -0,0 +1,26 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from apps.manager.management.models import Team
+from apps.manager.management.services import TeamMembershipService
+
+
+def _pairs(instance, pk_set, reverse):
+    if reverse:
+        # user.member_teams.add(team): instance — пользователь, pk_set — команды
+        return [(team_id, instance.pk) for team_id in pk_set]
+    return [(instance.pk, user_id) for user_id in pk_set]
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def write_membership_history(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        if reverse:
+            pk_set = instance.member_teams.values_list("id", flat=True)
+        else:
+            pk_set = instance.members.values_list("id", flat=True)
+        TeamMembershipService.close_periods(_pairs(instance, pk_set, reverse))
+    elif action == "post_add" and pk_set:
+        TeamMembershipService.open_periods(_pairs(instance, pk_set, reverse))
+    elif action == "post_remove" and pk_set:
+        TeamMembershipService.close_periods(_pairs(instance, pk_set, reverse))
@@ -33,6 +33,13 @@ class TeamDass9ResultOut(Schema):
     team: str
     results: List[Dass9DayAvgOut]
 
+class TeamDass9ColumnsOut(Schema):
+    team: str
+    dates: List[date]
+    depression: List[float]
+    stress: List[float]
+    anxiety: List[float]
+
 class TeamLeadIn(Schema):
     user_id: str
 
@@ -63,3 +70,13 @@ class MoveMemberToAnotherTeamIn(Schema):
     user_id: str
     from_team_id: str
     to_team_id: str
+
+class ImportRowErrorOut(Schema):
+    row: int
+    username: Optional[str]
+    error: str
+
+class ImportEmployeesOut(Schema):
+    created: int
+    failed: int
+    errors: List[ImportRowErrorOut]
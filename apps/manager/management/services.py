@@ -1,16 +1,28 @@
-from typing import Dict, Any, List, Optional
-
-from django.db.models import Avg
+import csv
+import io
+import json
+import re
+from typing import Dict, Any, List, Optional, Iterable
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction, IntegrityError
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum, UUIDField, Value
 from django.shortcuts import get_object_or_404
 from ninja.errors import HttpError
 from django.utils import timezone
 
 from apps.assessments.dass.models import Dass9Result
+from apps.auth_user.hashing import hash_passwords
 from apps.auth_user.models import User
+from apps.dass_analytics.matviews import MaterializedViewService
+from apps.dass_analytics.models import TeamDailyRollup, NoTeamDailyStats
 from apps.employee.settings.models import ManagerAssignmentRequest
-from apps.manager.management.models import Team, TeamLead
+from apps.manager.management.models import Team, TeamLead, TeamMembershipPeriod
 from datetime import date
 
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
 class ManagementService:
     @staticmethod
     def get_all_employees_by_manager(manager_id):
@@ -243,8 +255,9 @@ class ManagementService:
         if not from_team.members.filter(id=user.id).exists():
             raise HttpError(400, "Пользователь не состоит в исходной команде")
 
-        from_team.members.remove(user)
-        to_team.members.add(user)
+        with transaction.atomic():
+            from_team.members.remove(user)
+            to_team.members.add(user)
 
         return {
             "status": "moved",
@@ -254,6 +267,101 @@ class ManagementService:
         }
 
 
+class TeamMembershipService:
+    """
+    История состава команд (TeamMembershipPeriod).
+    Пишется из сигнала m2m_changed Team.members, то есть при любом изменении состава.
+    """
+
+    @staticmethod
+    def open_periods(pairs: Iterable, day: Optional[date] = None) -> None:
+        day = day or date.today()
+        TeamMembershipPeriod.objects.bulk_create(
+            [TeamMembershipPeriod(team_id=team_id, user_id=user_id, valid_from=day) for team_id, user_id in pairs],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def close_periods(pairs: Iterable, day: Optional[date] = None) -> None:
+        day = day or date.today()
+        pairs = list(pairs)
+        if not pairs:
+            return
+        condition = Q()
+        for team_id, user_id in pairs:
+            condition |= Q(team_id=team_id, user_id=user_id)
+        open_periods = TeamMembershipPeriod.objects.filter(condition, valid_to__isnull=True)
+        # период, открытый и закрытый в один день, ничего не покрывает
+        open_periods.filter(valid_from__gte=day).delete()
+        open_periods.update(valid_to=day)
+
+    @staticmethod
+    def member_at_date(user_ref: str = "user", date_ref: str = "date", **filters):
+        """
+        Подзапрос EXISTS: пользователь из OuterRef(user_ref) состоял в команде на дату OuterRef(date_ref).
+        """
+        return Exists(
+            TeamMembershipPeriod.objects.filter(
+                Q(valid_to__isnull=True) | Q(valid_to__gt=OuterRef(date_ref)),
+                user_id=OuterRef(user_ref),
+                valid_from__lte=OuterRef(date_ref),
+                **filters,
+            )
+        )
+
+    @staticmethod
+    def covers_date(periods_path: str, date_ref: str = "date") -> Q:
+        """
+        Условие для JOIN по периодам членства periods_path: период покрывает дату из поля date_ref.
+        Условие и ключ группировки должны быть в одном filter(), чтобы идти по одному JOIN.
+        """
+        return Q(**{f"{periods_path}__valid_from__lte": F(date_ref)}) & (
+            Q(**{f"{periods_path}__valid_to__isnull": True}) | Q(**{f"{periods_path}__valid_to__gt": F(date_ref)})
+        )
+
+    @staticmethod
+    def teams_at_date(user_id, day: date) -> List:
+        """
+        Команды, в которых пользователь состоял на дату day.
+        """
+        return list(
+            TeamMembershipPeriod.objects.filter(
+                Q(valid_to__isnull=True) | Q(valid_to__gt=day),
+                user_id=user_id,
+                valid_from__lte=day,
+            ).values_list("team_id", flat=True)
+        )
+
+    @staticmethod
+    def team_results(team: Team):
+        """
+        Результаты DASS-9, сохранённые участниками команды в период их членства.
+        """
+        return Dass9Result.objects.filter(TeamMembershipService.member_at_date(team=team))
+
+    @staticmethod
+    def backfill(valid_from: date) -> int:
+        """
+        Открывает периоды для текущих участников команд, у которых их ещё нет.
+        valid_from — ранняя дата, с которой считать текущее членство.
+        """
+        members = Team.members.through.objects.exclude(
+            Exists(TeamMembershipPeriod.objects.filter(
+                team_id=OuterRef("team_id"), user_id=OuterRef("user_id"), valid_to__isnull=True
+            ))
+        ).values_list("team_id", "user_id")
+        created = 0
+        with transaction.atomic():
+            while True:
+                # уже открытые периоды исключаются подзапросом, поэтому берём всегда первую пачку
+                chunk = list(members.order_by("id")[:2000])
+                if not chunk:
+                    break
+                TeamMembershipService.open_periods(chunk, valid_from)
+                created += len(chunk)
+        return created
+
+
 class Dass9TeamService:
 
     @staticmethod
@@ -264,6 +372,23 @@ class Dass9TeamService:
             qs = qs.filter(date__lte=to_date)
         return qs
 
+    @staticmethod
+    def _rollup_averages(rollup_qs) -> List[Dict[str, Any]]:
+        """
+        Средние по дням из дневных агрегатов (сумма / количество).
+        """
+        return [
+            {
+                "date": r["date"],
+                "depression_avg": r["depression_sum"] / r["test_count"],
+                "stress_avg": r["stress_sum"] / r["test_count"],
+                "anxiety_avg": r["anxiety_sum"] / r["test_count"],
+            }
+            for r in rollup_qs.filter(test_count__gt=0)
+            .order_by("date")
+            .values("date", "test_count", "depression_sum", "stress_sum", "anxiety_sum")
+        ]
+
     @staticmethod
     def get_team_results(manager_id: str, team_id: str,
                          from_date: Optional[date] = None,
@@ -272,24 +397,13 @@ class Dass9TeamService:
         Средние результаты DASS-9 по команде (группировка по датам, с фильтрацией по диапазону)
         """
         team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
-        member_ids = team.members.values_list("id", flat=True)
 
-        qs = Dass9Result.objects.filter(user_id__in=member_ids)
+        qs = TeamDailyRollup.objects.filter(team=team)
         qs = Dass9TeamService._filter_by_date(qs, from_date, to_date)
 
-        results = (
-            qs.values("date")
-            .annotate(
-                depression_avg=Avg("depression_score"),
-                stress_avg=Avg("stress_score"),
-                anxiety_avg=Avg("anxiety_score"),
-            )
-            .order_by("date")
-        )
-
         return {
             "team": team.name,
-            "results": list(results)
+            "results": Dass9TeamService._rollup_averages(qs)
         }
 
     @staticmethod
@@ -297,43 +411,368 @@ class Dass9TeamService:
                               from_date: Optional[date] = None,
                               to_date: Optional[date] = None) -> List[Dict[str, Any]]:
         """
-        Средние результаты DASS-9 по всем командам + дефолтная команда (по дням, с фильтрацией)
-        """
-        response = []
-        teams = Team.objects.filter(manager_id=manager_id)
+        Средние результаты DASS-9 по всем командам + дефолтная команда (по дням, с фильтрацией).
 
-        for team in teams:
-            member_ids = team.members.values_list("id", flat=True)
-            qs = Dass9Result.objects.filter(user_id__in=member_ids)
-            qs = Dass9TeamService._filter_by_date(qs, from_date, to_date)
-
-            results = (
-                qs.values("date")
-                .annotate(
-                    depression_avg=Avg("depression_score"),
-                    stress_avg=Avg("stress_score"),
-                    anxiety_avg=Avg("anxiety_score"),
-                )
-                .order_by("date")
-            )
-            response.append({"team": team.name, "results": list(results)})
+        Дни всех команд и сотрудников руководителя без команды считаются одним
+        запросом (UNION ALL дневных агрегатов команд и группировки результатов
+        сотрудников без команды). Ответ — колонки: dates[], depression[], stress[], anxiety[].
+        """
+        teams = list(Team.objects.filter(manager_id=manager_id).order_by("name", "id").values_list("id", "name"))
+
+        team_days = Dass9TeamService._filter_by_date(
+            TeamDailyRollup.objects.filter(team__manager_id=manager_id, test_count__gt=0), from_date, to_date
+        ).values_list("team_id", "date", "test_count", "depression_sum", "stress_sum", "anxiety_sum")
+
+        # результаты сотрудников этого руководителя, не состоявших в команде на дату результата
+        if MaterializedViewService.is_fresh(NoTeamDailyStats):
+            unknown_days = Dass9TeamService._filter_by_date(
+                NoTeamDailyStats.objects.filter(manager_id=manager_id), from_date, to_date
+            ).annotate(
+                team_key=Value(None, output_field=UUIDField()),
+            ).values_list(
+                "team_key", "date", "test_count", "depression_sum", "stress_sum", "anxiety_sum"
+            ).order_by()
+        else:
+            unknown_days = Dass9TeamService._filter_by_date(
+                Dass9Result.objects.filter(~TeamMembershipService.member_at_date(), user__manager_id=manager_id),
+                from_date, to_date
+            ).values("date").annotate(
+                team_key=Value(None, output_field=UUIDField()),
+                n=Count("id"),
+                depression=Sum("depression_score"),
+                stress=Sum("stress_score"),
+                anxiety=Sum("anxiety_score"),
+            ).values_list("team_key", "date", "n", "depression", "stress", "anxiety").order_by()
+
+        columns = {team_id: Dass9TeamService._empty_columns() for team_id, _ in teams}
+        for team_id, day, count, depression, stress, anxiety in team_days.order_by().union(unknown_days, all=True).order_by("date"):
+            target = columns.get(team_id)
+            if target is None:
+                target = columns[None] = Dass9TeamService._empty_columns()
+            target["dates"].append(day)
+            target["depression"].append(depression / count)
+            target["stress"].append(stress / count)
+            target["anxiety"].append(anxiety / count)
+
+        response = [{"team": name, **columns[team_id]} for team_id, name in teams]
 
         # пользователи без команды
-        members_without_team = User.objects.filter(member_teams=None).exclude(id=manager_id)
-        if members_without_team.exists():
-            member_ids = members_without_team.values_list("id", flat=True)
-            qs = Dass9Result.objects.filter(user_id__in=member_ids)
-            qs = Dass9TeamService._filter_by_date(qs, from_date, to_date)
-
-            results = (
-                qs.values("date")
-                .annotate(
-                    depression_avg=Avg("depression_score"),
-                    stress_avg=Avg("stress_score"),
-                    anxiety_avg=Avg("anxiety_score"),
-                )
-                .order_by("date")
+        unknown = columns.get(None)
+        if unknown is None and User.objects.filter(manager_id=manager_id, member_teams=None).exists():
+            unknown = Dass9TeamService._empty_columns()
+        if unknown is not None:
+            response.append({"team": "unknown", **unknown})
+        return response
+
+    @staticmethod
+    def _empty_columns() -> Dict[str, List]:
+        return {"dates": [], "depression": [], "stress": [], "anxiety": []}
+
+class Dass9ExportService:
+    """
+    Потоковая выгрузка сырых результатов DASS-9 (CSV или Arrow IPC).
+    Строки читаются серверным курсором чанками, память не зависит от объёма выгрузки.
+    """
+
+    COLUMNS = (
+        "date", "user_id", "username", "full_name",
+        "depression_score", "stress_score", "anxiety_score", "max_band",
+    )
+    FORMATS = ("csv", "arrow")
+
+    @staticmethod
+    def rows(manager_id: str, team_id: Optional[str] = None,
+             from_date: Optional[date] = None, to_date: Optional[date] = None):
+        """
+        Queryset кортежей COLUMNS: сотрудники выбранной команды руководителя
+        или все сотрудники руководителя, с фильтрацией по датам.
+        """
+        if team_id:
+            team = get_object_or_404(Team, id=team_id, manager_id=manager_id)
+            qs = TeamMembershipService.team_results(team)
+        else:
+            qs = Dass9Result.objects.filter(user__manager_id=manager_id)
+        qs = Dass9TeamService._filter_by_date(qs, from_date, to_date)
+        return qs.order_by("date", "user_id").values_list(
+            "date", "user_id", "user__username", "user__full_name",
+            "depression_score", "stress_score", "anxiety_score", "max_band",
+        )
+
+    @staticmethod
+    def iter_csv(rows, chunk_size: int = 2000) -> Iterable[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(Dass9ExportService.COLUMNS)
+        for i, row in enumerate(rows.iterator(chunk_size=chunk_size), start=1):
+            writer.writerow(row)
+            if i % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    @staticmethod
+    def iter_arrow(rows, chunk_size: int = 2000) -> Iterable[bytes]:
+        """
+        Arrow IPC stream: по record batch на каждый чанк строк.
+        Требует pyarrow (необязательная зависимость).
+        """
+        import pyarrow as pa
+
+        schema = pa.schema([
+            ("date", pa.date32()),
+            ("user_id", pa.string()),
+            ("username", pa.string()),
+            ("full_name", pa.string()),
+            ("depression_score", pa.int16()),
+            ("stress_score", pa.int16()),
+            ("anxiety_score", pa.int16()),
+            ("max_band", pa.int16()),
+        ])
+        # writer дописывает сообщения в buffer; после каждого батча отдаём и очищаем его
+        buffer = io.BytesIO()
+        writer = pa.ipc.new_stream(buffer, schema)
+
+        def take() -> bytes:
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return data
+
+        def write(chunk):
+            columns = [list(column) for column in zip(*chunk)]
+            columns[1] = [str(user_id) for user_id in columns[1]]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+
+        chunk = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                write(chunk)
+                chunk = []
+                yield take()
+        if chunk:
+            write(chunk)
+        writer.close()
+        yield take()
+
+    @staticmethod
+    def arrow_available() -> bool:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+
+class EmployeeImportService:
+    """
+    Массовое добавление сотрудников руководителем из CSV или JSON.
+
+    Файл читается потоково и обрабатывается чанками: в памяти одновременно
+    только текущий чанк строк (и множества уже встреченных username/email).
+    """
+
+    REQUIRED_FIELDS = ("username", "password")
+    # сколько символов JSON дочитывается за раз и наибольший допустимый размер одного элемента
+    JSON_READ_SIZE = 64 * 1024
+    JSON_MAX_ITEM_SIZE = 1024 * 1024
+
+    @staticmethod
+    def _csv_rows(stream) -> Iterable[Dict[str, Any]]:
+        # файл читается лениво: ошибки декодирования и разбора возникают при итерации,
+        # до записи в БД, поэтому весь файл отклоняется с 400
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        try:
+            yield from reader
+        except UnicodeDecodeError:
+            raise HttpError(400, "CSV-файл должен быть в кодировке UTF-8")
+        except csv.Error as exc:
+            raise HttpError(400, f"Некорректный CSV (строка {reader.line_num}): {exc}")
+
+    @staticmethod
+    def _json_rows(stream) -> Iterable[Dict[str, Any]]:
+        """
+        Элементы JSON-массива по одному, без чтения всего файла: буфер дочитывается
+        кусками, элемент разбирается JSONDecoder.raw_decode, как только он целиком в буфере.
+        """
+        decoder = json.JSONDecoder()
+        reader = io.TextIOWrapper(stream, encoding="utf-8-sig")
+        buffer, position, eof = "", 0, False
+        # start -> first ("[" прочитан) -> separator <-> value
+        state = "start"
+        try:
+            while True:
+                position = _JSON_WHITESPACE.match(buffer, position).end()
+                if position == len(buffer):
+                    if eof:
+                        raise HttpError(400, "Некорректный JSON")
+                    buffer, position = reader.read(EmployeeImportService.JSON_READ_SIZE), 0
+                    eof = not buffer
+                    continue
+
+                char = buffer[position]
+                if state == "start":
+                    if char != "[":
+                        raise HttpError(400, "Ожидается JSON-массив пользователей")
+                    position, state = position + 1, "first"
+                elif char == "]" and state in ("first", "separator"):
+                    rest = buffer[position + 1:] + reader.read(EmployeeImportService.JSON_READ_SIZE)
+                    if rest.strip():
+                        raise HttpError(400, "Некорректный JSON")
+                    return
+                elif state == "separator":
+                    if char != ",":
+                        raise HttpError(400, "Некорректный JSON")
+                    position, state = position + 1, "value"
+                else:
+                    try:
+                        value, end = decoder.raw_decode(buffer, position)
+                    except ValueError:
+                        end = None
+                    # значение на конце буфера может быть неполным (число "12" из "123") — дочитываем
+                    if end is None or (end == len(buffer) and not eof):
+                        if eof:
+                            raise HttpError(400, "Некорректный JSON")
+                        if len(buffer) - position > EmployeeImportService.JSON_MAX_ITEM_SIZE:
+                            raise HttpError(400, "Слишком большой элемент JSON")
+                        chunk = reader.read(EmployeeImportService.JSON_READ_SIZE)
+                        buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+                        continue
+                    yield value
+                    position, state = end, "separator"
+        except UnicodeDecodeError:
+            raise HttpError(400, "JSON-файл должен быть в кодировке UTF-8")
+
+    @staticmethod
+    def parse_rows(stream, file_format: str) -> Iterable[Dict[str, Any]]:
+        """
+        Читает строки импорта из бинарного потока (лениво).
+        CSV — с заголовком username,email,password,full_name; JSON — массив объектов.
+        """
+        if file_format == "csv":
+            return EmployeeImportService._csv_rows(stream)
+        if file_format == "json":
+            return EmployeeImportService._json_rows(stream)
+        raise HttpError(400, "Поддерживаются только форматы csv и json")
+
+    @staticmethod
+    def _validated_chunks(rows: Iterable[Dict[str, Any]], errors: List[Dict[str, Any]],
+                          chunk_size: int) -> Iterable[List[Dict[str, Any]]]:
+        """
+        Проверяет строки (обязательные поля, email, дубликаты внутри файла) и отдаёт
+        прошедшие проверку чанками по chunk_size; ошибки дописываются в errors.
+        """
+        seen_usernames = set()
+        seen_emails = set()
+        chunk: List[Dict[str, Any]] = []
+
+        for index, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                errors.append({"row": index, "username": None, "error": "Некорректная строка"})
+                continue
+            username = (row.get("username") or "").strip()
+            password = row.get("password") or ""
+            email = (row.get("email") or "").strip()
+            email = User.objects.normalize_email(email) if email else None
+
+            if not username or not password:
+                errors.append({"row": index, "username": username or None, "error": "Не указан username или password"})
+                continue
+            if email:
+                try:
+                    validate_email(email)
+                except ValidationError:
+                    errors.append({"row": index, "username": username, "error": "Некорректный email"})
+                    continue
+            if username in seen_usernames or (email and email in seen_emails):
+                errors.append({"row": index, "username": username, "error": "Дубликат в файле"})
+                continue
+
+            seen_usernames.add(username)
+            if email:
+                seen_emails.add(email)
+            chunk.append({
+                "row": index,
+                "username": username,
+                "email": email,
+                "password": password,
+                "full_name": (row.get("full_name") or "").strip(),
+            })
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _create_chunk(manager: User, candidates: List[Dict[str, Any]], errors: List[Dict[str, Any]]) -> int:
+        """
+        Создаёт пользователей чанка: уникальность относительно БД — одним запросом,
+        пароли — в пуле процессов, вставка — одним bulk_create.
+        """
+        usernames = {c["username"] for c in candidates}
+        emails = {c["email"] for c in candidates if c["email"]}
+        taken_usernames = set()
+        taken_emails = set()
+        for username, email in User.objects.filter(
+            Q(username__in=usernames) | Q(email__in=emails)
+        ).values_list("username", "email"):
+            taken_usernames.add(username)
+            if email:
+                taken_emails.add(email)
+
+        accepted = []
+        for c in candidates:
+            if c["username"] in taken_usernames or (c["email"] and c["email"] in taken_emails):
+                errors.append({
+                    "row": c["row"],
+                    "username": c["username"],
+                    "error": "Пользователь с таким никнеймом или почтой уже существует",
+                })
+            else:
+                accepted.append(c)
+
+        hashes = hash_passwords([c["password"] for c in accepted])
+        User.objects.bulk_create([
+            User(
+                username=c["username"],
+                email=c["email"],
+                full_name=c["full_name"],
+                password=password_hash,
+                manager=manager,
             )
-            response.append({"team": "unknown", "results": list(results)})
+            for c, password_hash in zip(accepted, hashes)
+        ])
+        return len(accepted)
 
-        return response
\ No newline at end of file
+    @staticmethod
+    def import_employees(manager_id: str, rows: Iterable[Dict[str, Any]],
+                         chunk_size: int = 500) -> Dict[str, Any]:
+        """
+        Создаёт пользователей пачкой и закрепляет их за руководителем.
+
+        - Строки читаются потоково и обрабатываются чанками по chunk_size.
+        - Уникальность username/email проверяется внутри файла и одним запросом к БД на чанк.
+        - Пароли хэшируются параллельно в пуле процессов, вставка — bulk_create на чанк.
+        - Импорт атомарен: ошибка разбора файла (400) или гонка с параллельным созданием (409)
+          откатывает всех уже вставленных пользователей.
+        Возвращает количество созданных и ошибки по строкам.
+        """
+        manager = get_object_or_404(User, id=manager_id, is_manager=True)
+
+        errors: List[Dict[str, Any]] = []
+        created = 0
+        try:
+            with transaction.atomic():
+                for chunk in EmployeeImportService._validated_chunks(rows, errors, chunk_size):
+                    created += EmployeeImportService._create_chunk(manager, chunk, errors)
+        except IntegrityError:
+            raise HttpError(409, "Часть пользователей была создана параллельно, повторите импорт")
+
+        errors.sort(key=lambda e: e["row"])
+        return {
+            "created": created,
+            "failed": len(errors),
+            "errors": errors,
+        }
@@ -0,0 +1,345 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import date, timedelta
+from unittest import mock, skipUnless
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from ninja.errors import HttpError
+
+from apps.auth_user.models import User
+from apps.auth_user.services import create_access_token
+from apps.assessments.dass.services import Dass9Service
+from apps.manager.management.models import Team, TeamMembershipPeriod
+from apps.manager.management.services import Dass9ExportService, Dass9TeamService, EmployeeImportService
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+class JsonImportParserTests(SimpleTestCase):
+    """
+    Потоковый разбор JSON-массива: элементы отдаются по одному на любых границах чтения.
+    """
+
+    def _parse(self, text: str, read_size: int = 3):
+        with mock.patch.object(EmployeeImportService, "JSON_READ_SIZE", read_size):
+            return list(EmployeeImportService.parse_rows(io.BytesIO(text.encode()), "json"))
+
+    def test_items_split_across_reads(self):
+        rows = [{"username": f"user-{i}", "password": "p" * i, "n": 12345 + i} for i in range(20)]
+        text = "﻿ " + json.dumps(rows, indent=2) + "\n"
+        for read_size in (1, 2, 7, 64, 65536):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(self._parse(text, read_size), rows)
+
+    def test_empty_array_and_scalars(self):
+        self.assertEqual(self._parse("[]"), [])
+        self.assertEqual(self._parse("[ 1 , \"a\" , null ]"), [1, "a", None])
+
+    def test_rows_are_yielded_lazily(self):
+        rows = EmployeeImportService.parse_rows(io.BytesIO(b'[{"username": "a"}, {"username": "b"} oops'), "json")
+        self.assertEqual(next(rows), {"username": "a"})
+        self.assertEqual(next(rows), {"username": "b"})
+        with self.assertRaises(HttpError):
+            next(rows)
+
+    def test_malformed_documents_are_rejected(self):
+        for text in ("", "{}", "[1,]", "[1 2]", "[1", "[{\"a\": ]", "[] tail", "[\"unterminated"):
+            with self.subTest(text=text):
+                with self.assertRaises(HttpError) as error:
+                    self._parse(text)
+                self.assertEqual(error.exception.status_code, 400)
+
+    def test_oversized_item_is_rejected(self):
+        with mock.patch.object(EmployeeImportService, "JSON_MAX_ITEM_SIZE", 10), \
+                self.assertRaises(HttpError):
+            self._parse('[{"username": "' + "x" * 50 + '"}]', read_size=4)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ImportEmployeesEndpointTests(TestCase):
+    """
+    /management/import_employees: создание, ошибки по строкам и отклонение битых файлов целиком.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.manager.id.int, True)}"}
+        User.objects.create_user("taken", "taken@example.com", None)
+
+    def _upload(self, name: str, content: bytes, headers=None):
+        return self.client.post(
+            "/api/management/import_employees",
+            {"file": SimpleUploadedFile(name, content)},
+            **(headers or self.headers),
+        )
+
+    def test_csv_import_reports_duplicates_and_invalid_rows(self):
+        content = (
+            "username,email,password,full_name\n"
+            "alice,alice@example.com,secret,Alice A\n"
+            "bob,,secret,\n"
+            "alice,other@example.com,secret,\n"
+            "carol,alice@example.com,secret,\n"
+            "taken,,secret,\n"
+            "dave,taken@example.com,secret,\n"
+            "erin,not-an-email,secret,\n"
+            ",,secret,\n"
+            "frank,,,\n"
+        ).encode()
+
+        response = self._upload("users.csv", content)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["created"], 2)
+        self.assertEqual([(e["row"], e["username"]) for e in body["errors"]], [
+            (3, "alice"), (4, "carol"), (5, "taken"), (6, "dave"), (7, "erin"), (8, None), (9, "frank"),
+        ])
+        self.assertEqual(body["failed"], 7)
+        created = User.objects.filter(manager=self.manager).order_by("username")
+        self.assertEqual([u.username for u in created], ["alice", "bob"])
+        self.assertTrue(created[0].check_password("secret"))
+        self.assertEqual(created[0].full_name, "Alice A")
+
+    def test_json_import_in_chunks(self):
+        rows = [{"username": f"user-{i}", "password": "secret"} for i in range(5)] + [{"username": "user-0"}]
+        with mock.patch.object(EmployeeImportService, "JSON_READ_SIZE", 16):
+            response = self._upload("users.json", json.dumps(rows).encode())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 5)
+        self.assertEqual(response.json()["errors"][0]["row"], 6)
+        self.assertEqual(User.objects.filter(manager=self.manager).count(), 5)
+
+    def test_chunked_import_checks_database_per_chunk(self):
+        rows = [{"username": f"user-{i}", "password": "secret"} for i in range(5)]
+        result = EmployeeImportService.import_employees(self.manager.id, rows, chunk_size=2)
+        self.assertEqual((result["created"], result["failed"]), (5, 0))
+
+        again = EmployeeImportService.import_employees(self.manager.id, rows, chunk_size=2)
+        self.assertEqual((again["created"], again["failed"]), (0, 5))
+
+    def test_bad_encoding_rejects_whole_file(self):
+        content = "username,password\nivan,secret\n".encode() + "пётр,secret\n".encode("cp1251")
+        response = self._upload("users.csv", content)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(manager=self.manager).exists())
+
+    def test_malformed_json_rejects_whole_file(self):
+        response = self._upload("users.json", b'[{"username": "ivan", "password": "secret"}, {"username": ')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(manager=self.manager).exists())
+
+    def test_json_object_instead_of_array_is_400(self):
+        response = self._upload("users.json", b'{"username": "ivan", "password": "secret"}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_employee_cannot_import(self):
+        employee = User.objects.create_user("employee", None, None)
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(employee.id.int, False)}"}
+        response = self._upload("users.csv", b"username,password\nivan,secret\n", headers)
+        self.assertEqual(response.status_code, 403)
+
+
+class AllTeamsResultsTests(TestCase):
+    """
+    /management/dass_9_result: дни всех команд и сотрудников без команды одним запросом UNION ALL.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.today = date.today()
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(name, None, None, manager=self.manager) for name in ("alice", "bob", "carol")
+        )
+        self.team = Team.objects.create(name="A team", manager=self.manager)
+        self.team.members.add(self.alice, self.bob)
+        TeamMembershipPeriod.objects.filter(team=self.team).update(valid_from=date(2000, 1, 1))
+        self.empty_team = Team.objects.create(name="B team", manager=self.manager)
+
+        self._save(self.alice, 2, 2, 4, 6)
+        self._save(self.bob, 2, 4, 0, 0)
+        self._save(self.alice, 0, 1, 1, 1)
+        # carol без команды, её результаты попадают в unknown
+        self._save(self.carol, 1, 9, 9, 9)
+        # сотрудник другого руководителя без команды не попадает в ответ
+        other_manager = User.objects.create_user("other", None, None, is_manager=True)
+        self._save(User.objects.create_user("stranger", None, None, manager=other_manager), 1, 5, 5, 5)
+
+    def _save(self, user, days_ago: int, depression: int, stress: int, anxiety: int):
+        Dass9Service.save_results_batch(user.id, [{
+            "date": self.today - timedelta(days=days_ago),
+            "depression": depression, "stress": stress, "anxiety": anxiety,
+        }])
+
+    def _get(self, **params):
+        return self.client.get(
+            "/api/management/dass_9_result", params,
+            HTTP_AUTHORIZATION=f"Bearer {create_access_token(self.manager.id.int, True)}",
+        )
+
+    def test_columns_per_team_and_unknown(self):
+        response = self._get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {
+                "team": "A team",
+                "dates": [(self.today - timedelta(days=2)).isoformat(), self.today.isoformat()],
+                "depression": [3.0, 1.0],
+                "stress": [2.0, 1.0],
+                "anxiety": [3.0, 1.0],
+            },
+            {"team": "B team", "dates": [], "depression": [], "stress": [], "anxiety": []},
+            {
+                "team": "unknown",
+                "dates": [(self.today - timedelta(days=1)).isoformat()],
+                "depression": [9.0],
+                "stress": [9.0],
+                "anxiety": [9.0],
+            },
+        ])
+
+    def test_date_filter_applies_to_both_branches(self):
+        body = self._get(from_date=(self.today - timedelta(days=1)).isoformat()).json()
+
+        self.assertEqual([(team["team"], len(team["dates"])) for team in body], [
+            ("A team", 1), ("B team", 0), ("unknown", 1),
+        ])
+        body = self._get(to_date=(self.today - timedelta(days=2)).isoformat()).json()
+        # сотрудник без команды есть, но без результатов в диапазоне
+        self.assertEqual([(team["team"], len(team["dates"])) for team in body], [
+            ("A team", 1), ("B team", 0), ("unknown", 0),
+        ])
+
+    def test_single_union_query_regardless_of_team_count(self):
+        def captured():
+            with CaptureQueriesContext(connection) as queries:
+                Dass9TeamService.get_all_teams_results(self.manager.id)
+            return [q["sql"] for q in queries.captured_queries]
+
+        few = captured()
+        for index in range(10):
+            team = Team.objects.create(name=f"team-{index}", manager=self.manager)
+            team.members.add(User.objects.create_user(f"member-{index}", None, None, manager=self.manager))
+        many = captured()
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len([sql for sql in many if "UNION ALL" in sql]), 1)
+
+
+class Dass9ExportTests(TestCase):
+    """
+    Потоковая выгрузка сырых результатов: эндпоинт и команда export_dass9_results.
+    """
+
+    def setUp(self):
+        self.manager = User.objects.create_user("manager", None, None, is_manager=True)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {create_access_token(self.manager.id.int, True)}"}
+        self.today = date.today()
+        self.alice = User.objects.create_user("alice", None, None, manager=self.manager, full_name="Alice A")
+        self.bob = User.objects.create_user("bob", None, None, manager=self.manager)
+        # bob в команде с сегодняшнего дня: его вчерашний результат к команде не относится
+        self.team = Team.objects.create(name="team", manager=self.manager)
+        self.team.members.add(self.alice, self.bob)
+        TeamMembershipPeriod.objects.filter(team=self.team, user=self.alice).update(valid_from=date(2000, 1, 1))
+        for user, scores in ((self.alice, (1, 2, 9)), (self.bob, (3, 4, 5))):
+            Dass9Service.save_results_batch(user.id, [
+                {"date": self.today - timedelta(days=days), "depression": scores[0] + days,
+                 "stress": scores[1], "anxiety": scores[2]}
+                for days in (0, 1)
+            ])
+        stranger = User.objects.create_user("stranger", None, None)
+        Dass9Service.save_results_batch(stranger.id, [
+            {"date": self.today, "depression": 0, "stress": 0, "anxiety": 0}
+        ])
+
+    def _get(self, **params):
+        return self.client.get("/api/management/export_dass9_results", params, **self.headers)
+
+    def _row(self, user, days_ago, depression, stress, anxiety, max_band):
+        return [(self.today - timedelta(days=days_ago)).isoformat(), str(user.id), user.username,
+                user.full_name or "", str(depression), str(stress), str(anxiety), str(max_band)]
+
+    def test_csv_is_streamed_in_order(self):
+        with override_settings(DASS9_EXPORT_CHUNK_SIZE=1):
+            response = self._get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="dass9_results.csv"')
+        chunks = list(response.streaming_content)
+        # заголовок и каждая строка — отдельные чанки
+        self.assertEqual(len(chunks), 5)
+        rows = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+        alice_first, bob_first = sorted([self.alice, self.bob], key=lambda user: user.id)
+        self.assertEqual(rows[0], list(Dass9ExportService.COLUMNS))
+        self.assertEqual([(row[0], row[2]) for row in rows[1:]], [
+            ((self.today - timedelta(days=1)).isoformat(), alice_first.username),
+            ((self.today - timedelta(days=1)).isoformat(), bob_first.username),
+            (self.today.isoformat(), alice_first.username),
+            (self.today.isoformat(), bob_first.username),
+        ])
+        self.assertIn(self._row(self.alice, 1, 2, 2, 9, 3), rows)
+
+    def test_team_export_uses_membership_periods(self):
+        body = b"".join(self._get(team_id=self.team.id, from_date=self.today - timedelta(days=7)).streaming_content)
+        rows = list(csv.reader(io.StringIO(body.decode())))[1:]
+
+        self.assertEqual(sorted((row[0], row[2]) for row in rows), sorted([
+            ((self.today - timedelta(days=1)).isoformat(), "alice"),
+            (self.today.isoformat(), "alice"),
+            (self.today.isoformat(), "bob"),
+        ]))
+
+    def test_errors(self):
+        self.assertEqual(self._get(format="xlsx").status_code, 400)
+        with mock.patch.object(Dass9ExportService, "arrow_available", return_value=False):
+            self.assertEqual(self._get(format="arrow").status_code, 400)
+
+        other = User.objects.create_user("other", None, None, is_manager=True)
+        response = self.client.get(
+            "/api/management/export_dass9_results", {"team_id": self.team.id},
+            HTTP_AUTHORIZATION=f"Bearer {create_access_token(other.id.int, True)}",
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @skipUnless(Dass9ExportService.arrow_available(), "нужен pyarrow")
+    def test_arrow_stream_round_trip(self):
+        import pyarrow as pa
+
+        with override_settings(DASS9_EXPORT_CHUNK_SIZE=3):
+            response = self._get(format="arrow")
+        table = pa.ipc.open_stream(b"".join(response.streaming_content)).read_all()
+
+        self.assertEqual(table.num_rows, 4)
+        self.assertEqual(table.column_names, list(Dass9ExportService.COLUMNS))
+        self.assertEqual(sorted(table.column("username").to_pylist()), ["alice", "alice", "bob", "bob"])
+
+    def test_command_writes_csv_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.csv")
+            call_command(
+                "export_dass9_results", manager="manager", team=str(self.team.id),
+                to_date=(self.today - timedelta(days=1)).isoformat(), output=path, chunk_size=1,
+            )
+            with open(path, newline="") as file:
+                rows = list(csv.reader(file))
+
+        self.assertEqual(rows, [list(Dass9ExportService.COLUMNS), self._row(self.alice, 1, 2, 2, 9, 3)])
+
+    def test_command_errors(self):
+        with self.assertRaises(CommandError):
+            call_command("export_dass9_results", manager="alice", output=os.devnull)
+        with self.assertRaises(CommandError):
+            call_command("export_dass9_results", manager="manager", team=str(uuid.uuid4()), output=os.devnull)
@@ -1,15 +1,21 @@
 from datetime import date
 from typing import List, Optional, Dict
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from ninja import Router, Query
+from ninja import Router, Query, File
+from ninja.errors import HttpError
+from ninja.files import UploadedFile
 
 from apps.auth_user.models import User
 from apps.auth_user.permissions import JWTAuthManager
+from apps.dass_analytics.cache import cached_analytics
 from apps.manager.management.models import Team
 from apps.manager.management.schemas import EmployeeOut, TeamIn, AddMembersIn, TeamDass9ResultOut, TeamLeadIn, \
-    TeamWithMembersOut, AssignTeamLeadIn, ManagerRequestResponseIn
-from apps.manager.management.services import ManagementService, Dass9TeamService
+    TeamWithMembersOut, AssignTeamLeadIn, ManagerRequestResponseIn, ImportEmployeesOut, TeamDass9ColumnsOut
+from apps.manager.management.services import ManagementService, Dass9TeamService, EmployeeImportService, \
+    Dass9ExportService
 
 router = Router(tags=["Management(Управление персоналом)"])
 
@@ -77,6 +83,7 @@ def get_team_members(request, team_id: str):
     auth=JWTAuthManager(),
     response=TeamDass9ResultOut
 )
+@cached_analytics("management_team_dass9")
 def get_team_dass9_results(
         request,
         team_id: str,
@@ -93,15 +100,17 @@ def get_team_dass9_results(
 @router.get(
     "/dass_9_result",
     auth=JWTAuthManager(),
-    response=List[TeamDass9ResultOut]
+    response=List[TeamDass9ColumnsOut]
 )
+@cached_analytics("management_all_teams_dass9")
 def get_all_teams_dass9_results(
         request,
         from_date: Optional[date] = Query(None),
         to_date: Optional[date] = Query(None),
 ):
     """
-    Усреднённые результаты DASS-9 по всем командам руководителя (по дням, с возможностью фильтрации по диапазону)
+    Усреднённые результаты DASS-9 по всем командам руководителя (по дням, с возможностью фильтрации по диапазону).
+    Для каждой команды — параллельные массивы dates, depression, stress, anxiety.
     """
     manager_id = request.auth["user_id"]
     return Dass9TeamService.get_all_teams_results(manager_id, from_date, to_date)
@@ -187,3 +196,52 @@ def move_member_to_another_team(request, data: MoveMemberToAnotherTeamIn):
         data.to_team_id
     )
 
+
+
+@router.post("/import_employees", auth=JWTAuthManager(), response=ImportEmployeesOut)
+def import_employees(request, file: UploadedFile = File(...)):
+    """
+    Массовое добавление сотрудников из файла CSV или JSON.
+
+    - CSV: заголовок username,email,password,full_name.
+    - JSON: массив объектов с теми же полями.
+    - Созданные пользователи закрепляются за текущим руководителем.
+    - Возвращает количество созданных и ошибки по строкам.
+    """
+    manager_id = request.auth["user_id"]
+    file_format = "csv" if (file.name or "").lower().endswith(".csv") else "json"
+    rows = EmployeeImportService.parse_rows(file.file, file_format)
+    return EmployeeImportService.import_employees(manager_id, rows)
+
+@router.get("/export_dass9_results", auth=JWTAuthManager())
+def export_dass9_results(
+        request,
+        format: str = Query("csv", description="csv | arrow"),
+        team_id: Optional[str] = Query(None, description="ID команды; без него — все сотрудники руководителя"),
+        from_date: Optional[date] = Query(None),
+        to_date: Optional[date] = Query(None),
+):
+    """
+    Потоковая выгрузка сырых результатов DASS-9 сотрудников (для BI).
+
+    - csv — текст с заголовком;
+    - arrow — Arrow IPC stream (если на сервере установлен pyarrow).
+    """
+    if format not in Dass9ExportService.FORMATS:
+        raise HttpError(400, "Поддерживаются форматы csv и arrow")
+    if format == "arrow" and not Dass9ExportService.arrow_available():
+        raise HttpError(400, "Формат arrow недоступен на сервере")
+
+    manager_id = request.auth["user_id"]
+    rows = Dass9ExportService.rows(manager_id, team_id, from_date, to_date)
+    chunk_size = getattr(settings, "DASS9_EXPORT_CHUNK_SIZE", 2000)
+    if format == "csv":
+        response = StreamingHttpResponse(
+            Dass9ExportService.iter_csv(rows, chunk_size), content_type="text/csv; charset=utf-8"
+        )
+    else:
+        response = StreamingHttpResponse(
+            Dass9ExportService.iter_arrow(rows, chunk_size), content_type="application/vnd.apache.arrow.stream"
+        )
+    response["Content-Disposition"] = f'attachment; filename="dass9_results.{format}"'
+    return response
@@ -94,6 +94,23 @@ DATABASES = {
     }
 }
 
+# Кэш ответов аналитики руководителя (версионируется сигналами, см. apps/dass_analytics/cache.py)
+# и denylist отозванных access-токенов (apps/auth_user/token_cache.py).
+# Для нескольких процессов/серверов заменить на общий бэкенд (Redis, Memcached).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "mindpoint-default",
+    },
+}
+
+DASS_ANALYTICS_CACHE_ALIAS = "default"
+DASS_ANALYTICS_CACHE_TIMEOUT = 300
+
+# Читать дашборды из материализованных представлений, если refresh_dass_views
+# обновлял их не раньше чем N секунд назад (None — всегда считать по агрегатам).
+DASS_ANALYTICS_MV_MAX_STALENESS = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators